@@ -14,22 +14,35 @@
 
 """Facilities for automatically determining files' correct metadata.
 """
+from __future__ import with_statement # for Python 2.5
 
 import os
 from collections import defaultdict
 from beets.autotag import mb
+from beets.autotag import timing
 import re
-from munkres import Munkres
 from beets import library, mediafile, plugins
-from beets.util import levenshtein, sorted_walk
+from beets.util import levenshtein, sorted_walk, assignment
 import logging
 
+try:
+    import multiprocessing
+except ImportError:
+    # Python 2.5.
+    multiprocessing = None
+
 # Try 5 releases. In the future, this should be more dynamic: let the
 # probability of continuing to the next release be inversely
 # proportional to how good our current best is and how long we've
 # already taken.
 MAX_CANDIDATES = 5
 
+# The pool of worker processes that evaluates album candidates, if it
+# is running (see `start_pool`), and the number of candidates to
+# evaluate at once.
+_pool = None
+_pool_size = 1
+
 # Distance parameters.
 # Text distance weights: proportions on the normalized intuitive edit
 # distance.
@@ -74,6 +87,9 @@ SD_PATTERNS = [
     (r'\[.*?\]', 0.3),
     (r'(, )?(pt\.|part) .+', 0.2),
 ]
+# The number of entries kept by each of the string distance caches
+# (which may hold up to twice as many).
+SD_CACHE_SIZE = 10000
 
 # Artist signals that indicate "various artists".
 VA_ARTISTS = (u'', u'various artists', u'va', u'unknown')
@@ -85,6 +101,17 @@ class AutotagError(Exception):
 # Global logger.
 log = logging.getLogger('beets')
 
+def _read_item(path):
+    """Returns an Item for the media file at path or None if the file
+    is not a readable media file.
+    """
+    try:
+        return library.Item.from_path(path)
+    except mediafile.FileTypeError:
+        pass
+    except mediafile.UnreadableFileError:
+        log.warn('unreadable file: ' + os.path.basename(path))
+
 def albums_in_dir(path):
     """Recursively searches the given directory and returns an iterable
     of (path, items) where path is a containing directory and items is
@@ -95,45 +122,137 @@ def albums_in_dir(path):
         # Get a list of items in the directory.
         items = []
         for filename in files:
-            try:
-                i = library.Item.from_path(os.path.join(root, filename))
-            except mediafile.FileTypeError:
-                pass
-            except mediafile.UnreadableFileError:
-                log.warn('unreadable file: ' + filename)
-            else:
+            i = _read_item(os.path.join(root, filename))
+            if i is not None:
                 items.append(i)
         
         # If it's nonempty, yield it.
         if items:
             yield root, items
 
+def albums_from_paths(paths):
+    """Like `albums_in_dir`, but groups an iterable of file paths
+    rather than walking a directory tree. Consecutive paths in the same
+    directory form an album, so each album's files should be listed
+    together. The iterable is consumed lazily: an album is produced as
+    soon as a path from a different directory (or the end of the
+    input) is seen.
+    """
+    cur_root = None
+    items = []
+    for path in paths:
+        root = os.path.dirname(path)
+        if root != cur_root:
+            if items:
+                yield cur_root, items
+            cur_root, items = root, []
+
+        i = _read_item(path)
+        if i is not None:
+            items.append(i)
+
+    if items:
+        yield cur_root, items
+
+class _Memo(object):
+    """Wraps a function to remember its results. At most `size` results
+    are kept, approximating least-recently-used eviction with two
+    generations: results are looked up in the young table and then in
+    the old one (and moved to the young one); when the young table is
+    full, it replaces the old one. `hits` and `misses` count the calls
+    that were and were not answered from the tables.
+    """
+    def __init__(self, func, size=SD_CACHE_SIZE):
+        self.func = func
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+        self.__doc__ = func.__doc__
+
+    def clear(self):
+        self.young = {}
+        self.old = {}
+
+    def __call__(self, *args):
+        try:
+            value = self.young[args]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return value
+        try:
+            value = self.old[args]
+            self.hits += 1
+        except KeyError:
+            value = self.func(*args)
+            self.misses += 1
+        if len(self.young) >= self.size:
+            self.old = self.young
+            self.young = {}
+        self.young[args] = value
+        return value
+
+def _sd_normalize(string):
+    """Lowercases a string for `string_dist` and moves any of the
+    `SD_END_WORDS` at its end (as in "something, the") to the front.
+    """
+    string = string.lower()
+    for word in SD_END_WORDS:
+        if string.endswith(', %s' % word):
+            string = '%s %s' % (word, string[:-len(word)-2])
+    return string
+_sd_normalize = _Memo(_sd_normalize)
+
+# Compiled versions of the `SD_PATTERNS`, along with one expression
+# that matches wherever any of them does.
+_sd_patterns = [(re.compile(pat), weight) for pat, weight in SD_PATTERNS]
+_sd_any_pattern = re.compile('|'.join('(?:%s)' % pat
+                                      for pat, _ in SD_PATTERNS))
+_sd_non_alnum = re.compile(r'[^a-z0-9]')
+
+def _sd_variants(string):
+    """Returns a tuple containing, for each of the `SD_PATTERNS`, the
+    string with the pattern's matches removed. Returns None if none of
+    the patterns match (as is usually the case), which takes a single
+    search.
+    """
+    if not _sd_any_pattern.search(string):
+        return None
+    return tuple(regex.sub('', string) for regex, _ in _sd_patterns)
+_sd_variants = _Memo(_sd_variants)
+
+def _sd_alnum(string):
+    """Lowercases a string and drops its non-alphanumeric characters.
+    """
+    return _sd_non_alnum.sub('', string.lower())
+_sd_alnum = _Memo(_sd_alnum)
+
 def _string_dist_basic(str1, str2):
     """Basic edit distance between two strings, ignoring
     non-alphanumeric characters and case. Normalized by string length.
     """
-    str1 = re.sub(r'[^a-z0-9]', '', str1.lower())
-    str2 = re.sub(r'[^a-z0-9]', '', str2.lower())
+    str1 = _sd_alnum(str1)
+    str2 = _sd_alnum(str2)
     if not str1 and not str2:
         return 0.0
     return levenshtein(str1, str2) / float(max(len(str1), len(str2)))
+_string_dist_basic = _Memo(_string_dist_basic)
 
 def string_dist(str1, str2):
     """Gives an "intuitive" edit distance between two strings. This is
     an edit distance, normalized by the string length, with a number of
     tweaks that reflect intuition about text.
     """
-    str1 = str1.lower()
-    str2 = str2.lower()
-    
+    return _string_dist(str1, str2)
+
+def _string_dist(str1, str2):
     # Don't penalize strings that move certain words to the end. For
     # example, "the something" should be considered equal to
     # "something, the".
-    for word in SD_END_WORDS:
-        if str1.endswith(', %s' % word):
-            str1 = '%s %s' % (word, str1[:-len(word)-2])
-        if str2.endswith(', %s' % word):
-            str2 = '%s %s' % (word, str2[:-len(word)-2])
+    str1 = _sd_normalize(str1)
+    str2 = _sd_normalize(str2)
     
     # Change the weight for certain string portions matched by a set
     # of regular expressions. We gradually change the strings and build
@@ -141,10 +260,15 @@ def string_dist(str1, str2):
     # deleted.
     base_dist = _string_dist_basic(str1, str2)
     penalty = 0.0
-    for pat, weight in SD_PATTERNS:
+    for i, (_, weight) in enumerate(_sd_patterns):
         # Get strings that drop the pattern.
-        case_str1 = re.sub(pat, '', str1)
-        case_str2 = re.sub(pat, '', str2)
+        variants1 = _sd_variants(str1)
+        variants2 = _sd_variants(str2)
+        if variants1 is None and variants2 is None:
+            # No pattern matches either string.
+            break
+        case_str1 = str1 if variants1 is None else variants1[i]
+        case_str2 = str2 if variants2 is None else variants2[i]
         
         if case_str1 != str1 or case_str2 != str2:
             # If the pattern was present (i.e., it is deleted in the
@@ -165,6 +289,7 @@ def string_dist(str1, str2):
     dist = base_dist + penalty
     
     return dist
+_string_dist = _Memo(_string_dist)
 
 def _plurality(objs):
     """Given a sequence of comparable objects, returns the object that
@@ -202,20 +327,18 @@ def order_items(items, trackinfo):
     information. This always produces a result if the numbers of tracks
     match.
     """
-    # Make sure lengths match.
+    # Make sure lengths match. (A lazily fetched track list may turn
+    # out to be a different length than the search result claimed.)
+    trackinfo = list(trackinfo)
     if len(items) != len(trackinfo):
         return None
 
     # Construct the cost matrix.
-    costs = []
-    for cur_item in items:
-        row = []
-        for i, canon_item in enumerate(trackinfo):
-            row.append(track_distance(cur_item, canon_item, i+1))
-        costs.append(row)
+    costs = track_distance_matrix(items, trackinfo)
+    timing.count('matrix_cells', len(items) * len(trackinfo))
     
     # Find a minimum-cost bipartite matching.
-    matching = Munkres().compute(costs)
+    matching = assignment(costs)
 
     # Order items based on the matching.
     ordered_items = [None]*len(items)
@@ -223,6 +346,65 @@ def order_items(items, trackinfo):
         ordered_items[canon_idx] = items[cur_idx]
     return ordered_items
 
+def track_distance_matrix(items, tracks, incl_artist=False):
+    """Computes `track_distance` for every item and track, using the
+    position of each track in the list (starting at 1) as its index.
+    Returns a list with a row for each item and a column for each
+    track. The work that depends only on the item or only on the
+    track is done once, and plugins compute their distances for all
+    the pairs at once.
+    """
+    with timing.timed('plugins'):
+        plugin_d, plugin_dm = plugins.track_distance_matrix(items, tracks)
+
+    # Per-track values.
+    track_lengths = [track_data.get('length') for track_data in tracks]
+    track_titles = [track_data['title'] for track_data in tracks]
+    track_artists = []
+    for track_data in tracks:
+        if incl_artist and 'artist' in track_data:
+            track_artists.append(track_data['artist'])
+        else:
+            track_artists.append(None)
+    track_ids = [track_data.get('id') for track_data in tracks]
+
+    # Accumulate the components in the same order as track_distance
+    # so that the results are identical.
+    costs = []
+    for i, item in enumerate(items):
+        length, title, artist = item.length, item.title, item.artist
+        track_num, trackid = item.track, item.mb_trackid
+        row = []
+        for j in range(len(tracks)):
+            dist, dist_max = 0.0, 0.0
+            if track_lengths[j] is None:
+                dist += TRACK_LENGTH_WEIGHT
+            else:
+                diff = abs(length - track_lengths[j])
+                diff = max(diff - TRACK_LENGTH_GRACE, 0.0)
+                diff = min(diff, TRACK_LENGTH_MAX)
+                dist += (diff / TRACK_LENGTH_MAX) * TRACK_LENGTH_WEIGHT
+            dist_max += TRACK_LENGTH_WEIGHT
+            dist += string_dist(title, track_titles[j]) * TRACK_TITLE_WEIGHT
+            dist_max += TRACK_TITLE_WEIGHT
+            if track_artists[j] is not None:
+                dist += string_dist(artist, track_artists[j]) * \
+                        TRACK_ARTIST_WEIGHT
+                dist_max += TRACK_ARTIST_WEIGHT
+            if track_num:
+                if j + 1 != track_num:
+                    dist += TRACK_INDEX_WEIGHT
+                dist_max += TRACK_INDEX_WEIGHT
+            if trackid:
+                if trackid != track_ids[j]:
+                    dist += TRACK_ID_WEIGHT
+                dist_max += TRACK_ID_WEIGHT
+            dist += plugin_d[i][j]
+            dist_max += plugin_dm[i][j]
+            row.append(dist / dist_max)
+        costs.append(row)
+    return costs
+
 def track_distance(item, track_data, track_index=None, incl_artist=False):
     """Determines the significance of a track metadata change. Returns
     a float in [0.0,1.0]. `track_index` is the track number of the
@@ -272,7 +454,8 @@ def track_distance(item, track_data, track_index=None, incl_artist=False):
         dist_max += TRACK_ID_WEIGHT
 
     # Plugin distances.
-    plugin_d, plugin_dm = plugins.track_distance(item, track_data)
+    with timing.timed('plugins'):
+        plugin_d, plugin_dm = plugins.track_distance(item, track_data)
     dist += plugin_d
     dist_max += plugin_dm
 
@@ -305,7 +488,8 @@ def distance(items, info):
         dist_max += TRACK_WEIGHT
 
     # Plugin distances.
-    plugin_d, plugin_dm = plugins.album_distance(items, info)
+    with timing.timed('plugins'):
+        plugin_d, plugin_dm = plugins.album_distance(items, info)
     dist += plugin_d
     dist_max += plugin_dm
 
@@ -315,6 +499,37 @@ def distance(items, info):
     else:
         return dist/dist_max
 
+def distance_bound(items, info):
+    """Returns a lower bound on `distance(items, info)` that is cheap
+    to compute: it uses the album-level metadata only, as if every
+    track matched perfectly. The items need not be ordered, and the
+    numbers of items and tracks must be equal.
+    """
+    cur_artist, cur_album, _ = current_metadata(items)
+    cur_artist = cur_artist or ''
+    cur_album = cur_album or ''
+
+    # The components are accumulated as in `distance`, except that the
+    # track distances are taken to be zero.
+    dist = 0.0
+    dist_max = 0.0
+    if not info['va']:
+        dist += string_dist(cur_artist, info['artist']) * ARTIST_WEIGHT
+        dist_max += ARTIST_WEIGHT
+    dist += string_dist(cur_album,  info['album']) * ALBUM_WEIGHT
+    dist_max += ALBUM_WEIGHT
+    for item in items:
+        dist_max += TRACK_WEIGHT
+    with timing.timed('plugins'):
+        plugin_d, plugin_dm = plugins.album_distance(items, info)
+    dist += plugin_d
+    dist_max += plugin_dm
+
+    if dist_max == 0.0:
+        return 0.0
+    else:
+        return dist/dist_max
+
 def apply_item_metadata(item, track_data):
     """Set an item's metadata from its matched info dictionary.
     """
@@ -411,37 +626,179 @@ def recommendation(results):
             rec = RECOMMEND_NONE
     return rec
 
-def validate_candidate(items, tuple_dict, info):
-    """Given a candidate info dict, attempt to add the candidate to
-    the output dictionary of result tuples. This involves checking
-    the track count, ordering the items, checking for duplicates, and
-    calculating the distance.
+def start_pool(processes):
+    """Starts a pool of worker processes that evaluate album candidates
+    in parallel. Since the workers are copies of the current process,
+    this should be called before any other threads are started and
+    after plugins are loaded. Has no effect if the multiprocessing
+    module is not available.
+    """
+    global _pool, _pool_size
+    if multiprocessing is None:
+        log.debug('multiprocessing not available; evaluating candidates '
+                  'in this process')
+        return
+    stop_pool()
+    _pool = multiprocessing.Pool(processes)
+    _pool_size = processes
+
+def stop_pool():
+    """Shuts down the worker pool, if it is running."""
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+        _pool_size = 1
+
+def _check_candidate(items, tuple_dict, info):
+    """Checks whether a candidate info dict is worth evaluating: it
+    must not already be in the output dictionary of result tuples and
+    must have the right number of tracks.
     """
     log.debug('Candidate: %s - %s' % (info['artist'], info['album']))
 
     # Don't duplicate.
     if info['album_id'] in tuple_dict:
         log.debug('Duplicate.')
-        return
+        return False
 
     # Make sure the album has the correct number of tracks.
     if len(items) != len(info['tracks']):
         log.debug('Track count mismatch.')
-        return
+        return False
 
-    # Put items in order.
+    return True
+
+def _score_in_worker(args):
+    """Orders the items for a candidate and calculates the distance in
+    a worker process. args is a pair of the items' records and the
+    info dict. Returns the distance and the indices of the items in
+    track order, or None if the items cannot be ordered.
+    """
+    records, info = args
+    items = [library.Item(record) for record in records]
     ordered = order_items(items, info['tracks'])
     if not ordered:
-        log.debug('Not orderable.')
-        return
+        return None
+    indices = dict((id(item), i) for i, item in enumerate(items))
+    return distance(ordered, info), [indices[id(item)] for item in ordered]
+
+def _score_candidates(items, infos):
+    """Puts the items in order for each of the candidate info dicts
+    and calculates the distance. Returns a list with a (distance,
+    ordered items) pair, or None if the items cannot be ordered, for
+    each candidate. If the worker pool is running (see `start_pool`),
+    the candidates are evaluated in parallel.
+    """
+    timing.count('evaluated', len(infos))
+    out = []
+    if _pool is None or len(infos) < 2:
+        for info in infos:
+            with timing.timed('order'):
+                ordered = order_items(items, info['tracks'])
+            if ordered:
+                with timing.timed('distance'):
+                    dist = distance(ordered, info)
+                out.append((dist, ordered))
+            else:
+                out.append(None)
+    else:
+        records = [item.record for item in items]
+        with timing.timed('pool'):
+            results = _pool.map(_score_in_worker,
+                                [(records, info) for info in infos])
+        for result in results:
+            if result is None:
+                out.append(None)
+            else:
+                dist, order = result
+                out.append((dist, [items[i] for i in order]))
+    return out
 
-    # Get the change distance.
-    dist = distance(ordered, info)
+def _add_candidate(tuple_dict, info, result):
+    """Adds a candidate to the output dictionary of result tuples
+    given its result from `_score_candidates`.
+    """
+    if result is None:
+        log.debug('Not orderable: %s - %s' % (info['artist'], info['album']))
+        return
+    dist, ordered = result
     log.debug('Success. Distance: %f' % dist)
-
     tuple_dict[info['album_id']] = dist, ordered, info
 
-def tag_album(items, config, search_artist=None, search_album=None):
+def validate_candidate(items, tuple_dict, info):
+    """Given a candidate info dict, attempt to add the candidate to
+    the output dictionary of result tuples. This involves checking
+    the track count, ordering the items, checking for duplicates, and
+    calculating the distance.
+    """
+    if _check_candidate(items, tuple_dict, info):
+        _add_candidate(tuple_dict, info, _score_candidates(items, [info])[0])
+
+def _best_distance(tuple_dict):
+    """Returns the smallest distance among the result tuples in the
+    dictionary or None if it is empty.
+    """
+    if tuple_dict:
+        return min(dist for dist, _, _ in tuple_dict.itervalues())
+
+def validate_candidates(items, tuple_dict, candidates, prune=False):
+    """Adds each of the candidates to the output dictionary of result
+    tuples (see `validate_candidate`). If prune is set, only the
+    candidates that may be better than the best result so far are
+    validated: candidates are tried in order of their `distance_bound`
+    until the bound is no smaller than the best distance.
+
+    If the worker pool is running, candidates are evaluated several at
+    a time; the results are the same as when they are evaluated one
+    by one.
+    """
+    if not prune:
+        batch = []
+        for info in candidates:
+            if _check_candidate(items, tuple_dict, info):
+                batch.append(info)
+        for info, result in zip(batch, _score_candidates(items, batch)):
+            if info['album_id'] not in tuple_dict:
+                _add_candidate(tuple_dict, info, result)
+        return
+
+    bounded = []
+    for info in candidates:
+        if len(items) != len(info['tracks']):
+            log.debug('Track count mismatch: %s - %s' %
+                      (info['artist'], info['album']))
+            continue
+        with timing.timed('bound'):
+            bound = distance_bound(items, info)
+        bounded.append((bound, info))
+    bounded.sort(key=lambda b: b[0])
+
+    # With a pool, evaluate as many candidates at once as there are
+    # workers. Every candidate in a batch could beat the best result
+    # from before the batch.
+    bounded.reverse()
+    while bounded:
+        best = _best_distance(tuple_dict)
+        batch = []
+        while bounded and len(batch) < _pool_size:
+            bound, info = bounded[-1]
+            if best is not None and bound >= best:
+                break
+            bounded.pop()
+            if _check_candidate(items, tuple_dict, info) and \
+               info['album_id'] not in [b['album_id'] for b in batch]:
+                batch.append(info)
+        if not batch:
+            log.debug('Pruned %i candidates.' % len(bounded))
+            timing.count('pruned', len(bounded))
+            break
+        for info, result in zip(batch, _score_candidates(items, batch)):
+            _add_candidate(tuple_dict, info, result)
+
+def tag_album(items, config, search_artist=None, search_album=None,
+              prune=False, profile=None):
     """Bundles together the functionality used to infer tags for a
     set of items comprised by an album. Returns everything relevant:
         - The current artist.
@@ -456,18 +813,58 @@ def tag_album(items, config, search_artist=None, search_album=None):
           be reached.
     If search_artist and search_album are provided, then they are used
     as search terms in place of the current metadata.
+    If prune is set, only the best candidate is of interest (as when
+    importing non-interactively): candidates that cannot beat the best
+    one found are not fully evaluated and so are left out of the list,
+    and the Various Artists search is skipped if the artist search
+    already found a strong match.
+    The time spent on each part of the work and counts of queries,
+    candidates, etc. are logged and, if profile is a `timing.Profile`,
+    added to it.
     May raise an AutotagError if existing metadata is insufficient.
     """
+    if profile is None:
+        profile = timing.Profile()
+    hits, misses = _string_dist.hits, _string_dist.misses
+    timing.activate(profile)
+    try:
+        return _tag_album(items, config, search_artist, search_album, prune)
+    finally:
+        timing.deactivate()
+        # The cache is shared by all threads, so these are approximate
+        # when several albums are tagged at once.
+        profile.counts['cache_hits'] += _string_dist.hits - hits
+        profile.counts['cache_misses'] += _string_dist.misses - misses
+        log.debug(u'Tagging profile: %s' % profile.summary())
+
+def _record_best(found, out_tuples):
+    """Records the number of candidates found and the position and
+    distance of the best one in the active profile. found is the list
+    of candidates' album IDs in the order they were found.
+    """
+    timing.count('candidates', len(found))
+    if out_tuples:
+        dist, _, info = min(out_tuples)
+        if info['album_id'] in found:
+            timing.value('best_rank', found.index(info['album_id']))
+        timing.value('best_distance', dist)
+
+def _tag_album(items, config, search_artist, search_album, prune):
+    """Does the work of `tag_album`."""
     # Get current metadata.
     cur_artist, cur_album, artist_consensus = current_metadata(items)
     log.debug('Tagging %s - %s' % (cur_artist, cur_album))
     
-    # The output result tuples (keyed by MB album ID).
+    # The output result tuples (keyed by MB album ID) and the IDs of
+    # all the candidates in the order they were found.
     out_tuples = {}
+    found = []
     
     # Try to find album indicated by MusicBrainz IDs.
-    id_info = match_by_id(items)
+    with timing.timed('search'):
+        id_info = match_by_id(items)
     if id_info:
+        found.append(id_info['album_id'])
         validate_candidate(items, out_tuples, id_info)
         if out_tuples:
             # If we have a very good MBID match, return immediately.
@@ -476,6 +873,7 @@ def tag_album(items, config, search_artist=None, search_album=None):
             rec = recommendation(out_tuples.values())
             if rec == RECOMMEND_STRONG and not config.interactive_autotag:
                 log.debug('ID match.')
+                _record_best(found, out_tuples.values())
                 return cur_artist, cur_album, out_tuples.values(), rec
     
     # Search terms.
@@ -486,41 +884,85 @@ def tag_album(items, config, search_artist=None, search_album=None):
     
     # Get candidate metadata from search.
     if search_artist and search_album:
-        candidates = mb.match_album(search_artist, search_album,
-                                    len(items), MAX_CANDIDATES)
-        candidates = list(candidates)
+        with timing.timed('search'):
+            candidates = mb.match_album(search_artist, search_album,
+                                        len(items), MAX_CANDIDATES)
+            candidates = list(candidates)
     else:
         candidates = []
+    found += [info['album_id'] for info in candidates]
 
-    # Possibly add "various artists" search.
+    # Possibly add "various artists" search. When only the best
+    # candidate is needed, the search is unnecessary if the artist
+    # search has already found a strong match.
     if search_album and ((not artist_consensus) or \
                          (search_artist.lower() in VA_ARTISTS) or \
                          any(item.comp for item in items)):
-        log.debug(u'Possibly Various Artists; adding matches.')
-        candidates.extend(mb.match_album(None, search_album, len(items),
-                                         MAX_CANDIDATES))
+        best = None
+        if prune:
+            validate_candidates(items, out_tuples, candidates, prune)
+            candidates = []
+            best = _best_distance(out_tuples)
+        if best is not None and best < STRONG_REC_THRESH:
+            log.debug(u'Strong match; skipping Various Artists search.')
+        else:
+            log.debug(u'Possibly Various Artists; adding matches.')
+            with timing.timed('search'):
+                va_candidates = list(mb.match_album(None, search_album,
+                                                    len(items),
+                                                    MAX_CANDIDATES))
+            candidates.extend(va_candidates)
+            found += [info['album_id'] for info in va_candidates]
 
     # Get candidates from plugins.
-    candidates.extend(plugins.candidates(items))
+    with timing.timed('plugins'):
+        plugin_candidates = list(plugins.candidates(items))
+    candidates.extend(plugin_candidates)
+    found += [info['album_id'] for info in plugin_candidates]
     
     # Get the distance to each candidate.
     log.debug(u'Evaluating %i candidates.' % len(candidates))
-    for info in candidates:
-        validate_candidate(items, out_tuples, info)
+    validate_candidates(items, out_tuples, candidates, prune)
     
     # Sort by distance.
     out_tuples = out_tuples.values()
     out_tuples.sort()
+    _record_best(found, out_tuples)
     
     rec = recommendation(out_tuples)
     return cur_artist, cur_album, out_tuples, rec
 
-def tag_item(item, search_artist=None, search_title=None):
+def candidate_tracks(candidates):
+    """Given a list of album candidates (`(distance, items, info)`
+    triples, as returned by `tag_album`), returns a list of the track
+    info dictionaries on those releases, suitable for `tag_item`'s
+    `known_tracks`. Tracks without their own artist get the album's.
+    Each track appears once.
+    """
+    out = []
+    seen = set()
+    for _, _, info in candidates:
+        for track_info in info['tracks']:
+            if track_info['id'] in seen:
+                continue
+            seen.add(track_info['id'])
+            if 'artist' not in track_info:
+                track_info = dict(track_info)
+                track_info['artist'] = info['artist']
+                track_info['artist_id'] = info['artist_id']
+            out.append(track_info)
+    return out
+
+def tag_item(item, search_artist=None, search_title=None,
+             known_tracks=None):
     """Attempts to find metadata for a single track. Returns a
     `(candidates, recommendation)` pair where `candidates` is a list
     of `(distance, track_info)` pairs. `search_artist` and 
     `search_title` may be used to override the current metadata for
-    the purposes of the MusicBrainz category.
+    the purposes of the MusicBrainz category. `known_tracks` is an
+    optional list of track info dictionaries that have already been
+    fetched (see `candidate_tracks`); if one of them is a strong match,
+    no search is performed.
     """
     candidates = []
 
@@ -536,6 +978,19 @@ def tag_item(item, search_artist=None, search_title=None):
             if rec == RECOMMEND_STRONG:
                 log.debug('Track ID match.')
                 return candidates, rec
+
+    # Next, try the tracks we already know about.
+    if known_tracks:
+        known = []
+        for track_info in known_tracks:
+            dist = track_distance(item, track_info, incl_artist=True)
+            known.append((dist, track_info))
+        known.sort()
+        if recommendation(known) == RECOMMEND_STRONG:
+            log.debug('Known track match.')
+            candidates += known[:mb.SEARCH_LIMIT]
+            candidates.sort()
+            return candidates, recommendation(candidates)
     
     # Search terms.
     if not (search_artist and search_title):
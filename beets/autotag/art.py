@@ -14,9 +14,15 @@
 
 """Finding album art for tagged albums."""
 
+from __future__ import with_statement
 import urllib
 import sys
+import os
+import time
 import logging
+import threading
+
+from beets import util
 
 from beets.autotag.mb import album_for_id
 
@@ -57,6 +63,97 @@ def art_for_album(album):
         return None
 
 
+# On-disk cache.
+
+DEFAULT_CACHE_DIR = os.path.expanduser('~/.beetsart')
+# Misses are remembered for this many seconds before trying again.
+MISS_TTL = 30 * 24 * 60 * 60
+MISS_SUFFIX = '.none'
+HIT_SUFFIX = '.jpg'
+
+class ArtCache(object):
+    """Keeps downloaded album art in a directory so that each image is
+    only fetched once, even across imports. Art is keyed by ASIN (so
+    the discs of a multi-disc release share an image) or, for albums
+    without one, by MusicBrainz ID. Albums with no art are recorded
+    too, so the lookup is not repeated for `MISS_TTL` seconds. The
+    cache may be used from several threads at once; concurrent
+    requests for the same key wait for a single download.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = util.bytestring_path(directory)
+        util.mkdirall(os.path.join(self.directory, 'x'))
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def _key(self, album):
+        if album.get('asin'):
+            return 'asin-' + album['asin']
+        elif album.get('album_id'):
+            return 'mbid-' + album['album_id']
+        else:
+            return None
+
+    def _path(self, key, suffix):
+        # Keys come from outside; keep them to a single path component.
+        key = key.replace(os.sep, '_')
+        return os.path.join(self.directory, key + suffix)
+
+    def _key_lock(self, key):
+        with self.lock:
+            if key not in self.key_locks:
+                self.key_locks[key] = threading.Lock()
+            return self.key_locks[key]
+
+    def lookup(self, album):
+        """Returns a tuple (hit, path) describing the cached art for the
+        album info dictionary. If hit is False, nothing is known about
+        the album. Otherwise, path is the cached image or None if the
+        album is known to have no art.
+        """
+        key = self._key(album)
+        if key is None:
+            return True, None
+        path = self._path(key, HIT_SUFFIX)
+        if os.path.exists(util.syspath(path)):
+            return True, path
+        miss = self._path(key, MISS_SUFFIX)
+        try:
+            mtime = os.path.getmtime(util.syspath(miss))
+        except OSError:
+            return False, None
+        if time.time() - mtime < MISS_TTL:
+            return True, None
+        return False, None
+
+    def art_for_album(self, album):
+        """Like the module-level `art_for_album` but consults and fills
+        the cache. The returned path is in the cache directory and
+        should be copied rather than moved.
+        """
+        key = self._key(album)
+        if key is None:
+            return None
+        with self._key_lock(key):
+            hit, path = self.lookup(album)
+            if hit:
+                return path
+
+            fn = art_for_album(album)
+            if fn:
+                path = self._path(key, HIT_SUFFIX)
+                # Move under a temporary name so that a partial file is
+                # never mistaken for cached art.
+                tmp = path + '.part'
+                util.move(fn, tmp)
+                os.rename(util.syspath(tmp), util.syspath(path))
+                return path
+            else:
+                f = open(util.syspath(self._path(key, MISS_SUFFIX)), 'w')
+                f.close()
+                return None
+
+
 # Smoke test.
 
 if __name__ == '__main__':
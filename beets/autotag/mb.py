@@ -18,6 +18,9 @@ This is a thin layer over the official `python-musicbrainz2` module. It
 abstracts away that module's object model, the server's Lucene query
 syntax, and other uninteresting parts of using musicbrainz2. The
 principal interface is the function `match_album`.
+
+Lookups can instead be answered by another backend, such as a local
+mirror of the MusicBrainz database (see `set_backend`).
 """
 
 from __future__ import with_statement # for Python 2.5
@@ -28,6 +31,7 @@ import musicbrainz2.webservice as mbws
 from musicbrainz2.model import Release
 from threading import Lock
 from musicbrainz2.model import VARIOUS_ARTISTS_ID
+from beets.autotag import timing
 
 SEARCH_LIMIT = 10
 VARIOUS_ARTISTS_ID = VARIOUS_ARTISTS_ID.rsplit('/', 1)[1]
@@ -36,6 +40,19 @@ class ServerBusyError(Exception): pass
 
 log = logging.getLogger('beets')
 
+# The object that answers lookups in place of the web service, if
+# any. See `set_backend`.
+_backend = None
+
+def set_backend(backend):
+    """Makes `match_album`, `match_track`, `album_for_id`, and
+    `track_for_id` delegate to backend, an object with methods of the
+    same names and signatures, instead of querying the MusicBrainz web
+    service. If backend is None, the web service is used again.
+    """
+    global _backend
+    _backend = backend
+
 # We hard-code IDs for artists that can't easily be searched for.
 SPECIAL_CASE_ARTISTS = {
     '!!!': 'f26c72d3-e52c-467b-b651-679c73d8e1a7',
@@ -70,35 +87,76 @@ def _query_wrap(fun, *args, **kwargs):
     then try again. Tries up to `MAX_QUERY_RETRY` times before
     giving up.
     """
-    with mb_lock:
-        global last_query_time
-        for i in range(MAX_QUERY_RETRY):
-            since_last_query = time.time() - last_query_time
-            if since_last_query < QUERY_WAIT_TIME:
-                time.sleep(QUERY_WAIT_TIME - since_last_query)
-            last_query_time = time.time()
-            try:
-                # Try the function.
-                res = fun(*args, **kwargs)
-            except mbws.WebServiceError, e:
-                # Server busy. Retry.
-                message = str(e.reason)
-                for errnum in (503, 504):
-                    if 'Error %i' % errnum in message:
-                        break
+    with timing.timed('query_wait'):
+        with mb_lock:
+            global last_query_time
+            for i in range(MAX_QUERY_RETRY):
+                since_last_query = time.time() - last_query_time
+                if since_last_query < QUERY_WAIT_TIME:
+                    time.sleep(QUERY_WAIT_TIME - since_last_query)
+                last_query_time = time.time()
+                timing.count('queries')
+                try:
+                    # Try the function.
+                    with timing.timed('query'):
+                        res = fun(*args, **kwargs)
+                except mbws.WebServiceError, e:
+                    # Server busy. Retry.
+                    message = str(e.reason)
+                    for errnum in (503, 504):
+                        if 'Error %i' % errnum in message:
+                            break
+                    else:
+                        # This is not the error we're looking for.
+                        raise
                 else:
-                    # This is not the error we're looking for.
-                    raise
-            else:
-                # Success. Return the result.
-                return res
-        # Gave up.
-        raise ServerBusyError()
+                    # Success. Return the result.
+                    return res
+            # Gave up.
+            raise ServerBusyError()
     # FIXME exponential backoff?
 
+class ReleaseTracks(object):
+    """The list of track dictionaries for a release found by a search,
+    which is fetched from the server when it is first used. The number
+    of tracks is included in the search results, so `len()` does not
+    need another query unless the count is unknown. Pickles as a
+    plain list.
+    """
+    def __init__(self, release_id, count=None):
+        self.release_id = release_id
+        self.count = count
+        self._tracks = None
+
+    def _get_tracks(self):
+        if self._tracks is None:
+            log.debug('Fetching tracks for release %s' % self.release_id)
+            timing.count('fetches')
+            info = release_info(self.release_id)
+            if info:
+                self._tracks = map(track_dict, info[0])
+            else:
+                self._tracks = []
+        return self._tracks
+
+    def __len__(self):
+        if self._tracks is None and self.count is not None:
+            return self.count
+        return len(self._get_tracks())
+
+    def __iter__(self):
+        return iter(self._get_tracks())
+
+    def __getitem__(self, index):
+        return self._get_tracks()[index]
+
+    def __reduce__(self):
+        return list, (self._get_tracks(),)
+
 def get_releases(**params):
     """Given a list of parameters to ReleaseFilter, executes the
-    query and yields release dicts (complete with tracks).
+    query and yields release dicts. Their track lists are fetched only
+    when they are used (see `ReleaseTracks`).
     """
     # Replace special cases.
     if 'artistName' in params:
@@ -114,8 +172,9 @@ def get_releases(**params):
     # Construct results.
     for result in results:
         release = result.release
-        tracks, _ = release_info(release.id)
-        yield release_dict(release, tracks)
+        out = release_dict(release)
+        out['tracks'] = ReleaseTracks(release.id, release.tracksCount)
+        yield out
 
 def release_info(release_id):
     """Given a MusicBrainz release ID, fetch a list of tracks on the
@@ -249,6 +308,9 @@ def match_album(artist, album, tracks=None, limit=SEARCH_LIMIT):
     The query consists of an artist name, an album name, and,
     optionally, a number of tracks on the album.
     """
+    if _backend is not None:
+        return _backend.match_album(artist, album, tracks, limit)
+
     # Build search criteria.
     criteria = {'release': album}
     if artist is not None:
@@ -266,6 +328,8 @@ def match_track(artist, title):
     """Searches for a single track and returns an iterable of track
     info dictionaries (as returned by `track_dict`).
     """
+    if _backend is not None:
+        return _backend.match_track(artist, title)
     return find_tracks({
         'artist': artist,
         'track': title,
@@ -275,6 +339,8 @@ def album_for_id(albumid):
     """Fetches an album by its MusicBrainz ID and returns an
     information dictionary. If no match is found, returns None.
     """
+    if _backend is not None:
+        return _backend.album_for_id(albumid)
     query = mbws.Query()
     inc = mbws.ReleaseIncludes(artist=True, tracks=True)
     try:
@@ -287,6 +353,8 @@ def track_for_id(trackid):
     """Fetches a track by its MusicBrainz ID. Returns a track info
     dictionary or None if no track is found.
     """
+    if _backend is not None:
+        return _backend.track_for_id(trackid)
     query = mbws.Query()
     try:
         track = _query_wrap(query.getTrackById, trackid)
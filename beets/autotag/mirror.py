@@ -0,0 +1,591 @@
+# This file is part of beets.
+# Copyright 2011, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""A local mirror of the MusicBrainz database that can answer the
+lookups in `beets.autotag.mb` without the (rate-limited) web service.
+
+The mirror is an SQLite database built from a MusicBrainz data dump.
+Releases and tracks are searched using an inverted index of the
+character trigrams in their names: the candidates are the releases or
+tracks that share trigrams with the query, ranked by their Dice
+similarity to it. Trigrams that occur in a large share of the names
+are too common to narrow a search down and are left out of queries.
+"""
+
+from __future__ import with_statement # for Python 2.5
+import os
+import re
+import sqlite3
+import logging
+import threading
+import unicodedata
+
+from beets.autotag import mb
+
+# Kinds of names in the trigram index.
+RELEASE_TITLE = 0
+RELEASE_ARTIST = 1
+TRACK_TITLE = 2
+TRACK_ARTIST = 3
+
+# Track searches rank this many times as many tracks as will be
+# returned by their exact similarity to the query.
+TRACK_POOL_FACTOR = 10
+
+# A trigram is too common to search by if it occurs in more than this
+# share of the names of its kind and in at least COMMON_GRAM_MIN of
+# them. If all of a query's trigrams of one kind are common, the
+# rarest one is used.
+COMMON_GRAM_SHARE = 0.01
+COMMON_GRAM_MIN = 1000
+
+# The version of the mirror's layout. Mirrors built with an older
+# layout must be rebuilt.
+MIRROR_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS releases (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT,
+    title TEXT,
+    artist TEXT,
+    artist_id TEXT,
+    asin TEXT,
+    albumtype TEXT,
+    year INTEGER,
+    month INTEGER,
+    day INTEGER,
+    va INTEGER,
+    track_count INTEGER DEFAULT 0,
+    title_grams INTEGER DEFAULT 0,
+    artist_grams INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    rowid INTEGER PRIMARY KEY,
+    release INTEGER,
+    position INTEGER,
+    id TEXT,
+    title TEXT,
+    artist TEXT,
+    artist_id TEXT,
+    length REAL,
+    title_grams INTEGER DEFAULT 0,
+    artist_grams INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS grams (
+    kind INTEGER,
+    gram TEXT,
+    ref INTEGER
+);
+CREATE TABLE IF NOT EXISTS gram_counts (
+    kind INTEGER,
+    gram TEXT,
+    count INTEGER,
+    PRIMARY KEY (kind, gram)
+);
+CREATE TABLE IF NOT EXISTS name_counts (
+    kind INTEGER PRIMARY KEY,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS releases_id ON releases (id);
+CREATE INDEX IF NOT EXISTS tracks_id ON tracks (id);
+CREATE INDEX IF NOT EXISTS tracks_release ON tracks (release, position);
+"""
+GRAMS_INDEX = "CREATE INDEX IF NOT EXISTS grams_lookup ON grams (kind, gram)"
+
+# The columns of the data dump tables used to build the mirror, in
+# the order in which they appear in the dump (trailing columns that
+# are not needed are omitted). Columns are numeric unless a type is
+# given.
+DUMP_TABLES = [
+    ('artist', ['id', 'gid TEXT', 'name']),
+    ('artist_name', ['id', 'name TEXT']),
+    ('artist_credit', ['id', 'name']),
+    ('artist_credit_name', ['artist_credit', 'position', 'artist']),
+    ('release_name', ['id', 'name TEXT']),
+    ('release_group', ['id', 'gid TEXT', 'name', 'artist_credit', 'type']),
+    ('release_group_type', ['id', 'name TEXT']),
+    ('release', ['id', 'gid TEXT', 'name', 'artist_credit', 'release_group',
+                 'status', 'packaging', 'country', 'language', 'script',
+                 'date_year', 'date_month', 'date_day']),
+    ('release_meta', ['id', 'date_added TEXT', 'info_url TEXT',
+                      'amazon_asin TEXT']),
+    ('medium', ['id', 'tracklist', 'release', 'position']),
+    ('recording', ['id', 'gid TEXT']),
+    ('track_name', ['id', 'name TEXT']),
+    ('track', ['id', 'recording', 'tracklist', 'position', 'name',
+               'artist_credit', 'length']),
+]
+# Tables that may be missing from a dump.
+OPTIONAL_DUMP_TABLES = ('release_meta',)
+# Extra indices on the dump tables for the joins.
+DUMP_INDICES = [
+    ('artist_credit_name', 'artist_credit, position'),
+    ('medium', 'tracklist'),
+]
+
+log = logging.getLogger('beets')
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+def grams(text):
+    """Returns the set of character trigrams in the words of text,
+    ignoring case and accents. Each word is padded with a marker
+    character on both ends so that even short words have trigrams.
+    """
+    if not isinstance(text, unicode):
+        text = text.decode('utf8', 'ignore')
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = u''.join(c for c in text if not unicodedata.combining(c))
+    out = set()
+    for word in _word_re.findall(text):
+        word = u'$%s$' % word
+        for i in range(len(word) - 2):
+            out.add(word[i:i + 3])
+    return out
+
+def _dice(grams1, grams2):
+    """The Dice coefficient of two sets of trigrams."""
+    return 2.0 * len(grams1 & grams2) / max(len(grams1) + len(grams2), 1)
+
+def _unescape_dump(value):
+    """Decodes a field from a data dump, which is in PostgreSQL's COPY
+    format. Returns None for NULL.
+    """
+    if value == '\\N':
+        return None
+    if '\\' in value:
+        value = re.sub(r'\\(.)', _unescape_char, value)
+    return value.decode('utf8')
+_dump_escapes = {'t': '\t', 'n': '\n', 'r': '\r'}
+def _unescape_char(match):
+    c = match.group(1)
+    return _dump_escapes.get(c, c)
+
+class Mirror(object):
+    """A local MusicBrainz database. A Mirror may be passed to
+    `mb.set_backend` to answer lookups; it may be used from several
+    threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < MIRROR_VERSION and \
+           conn.execute('SELECT 1 FROM releases LIMIT 1').fetchone():
+            log.warn('The MusicBrainz mirror at %s is out of date; '
+                     'rebuild it from a data dump.' % path)
+
+    def _conn(self):
+        """Returns this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _index_name(self, kind, ref, name):
+        """Adds the trigrams of a name to the index and returns how
+        many there are.
+        """
+        name_grams = grams(name or u'')
+        self._conn().executemany(
+            'INSERT INTO grams (kind, gram, ref) VALUES (?, ?, ?)',
+            [(kind, gram, ref) for gram in name_grams]
+        )
+        return len(name_grams)
+
+    # Building the mirror.
+
+    def add_release(self, info):
+        """Adds a release, given as an info dictionary in the form
+        returned by `mb.release_dict` (including its tracks), to the
+        mirror. Call `commit` when done adding releases.
+        """
+        conn = self._conn()
+        rowid = conn.execute(
+            'INSERT INTO releases (id, title, artist, artist_id, asin, '
+            'albumtype, year, month, day, va, track_count) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (info['album_id'], info['album'], info['artist'],
+             info['artist_id'], info.get('asin'), info.get('albumtype'),
+             info.get('year'), info.get('month'), info.get('day'),
+             info['va'], len(info['tracks']))
+        ).lastrowid
+        for position, track in enumerate(info['tracks']):
+            conn.execute(
+                'INSERT INTO tracks (release, position, id, title, artist, '
+                'artist_id, length) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (rowid, position, track['id'], track['title'],
+                 track.get('artist'), track.get('artist_id'),
+                 track.get('length'))
+            )
+        self._index_release(rowid)
+
+    def _index_release(self, rowid):
+        """Indexes the names of a release and its tracks."""
+        conn = self._conn()
+        row = conn.execute('SELECT title, artist FROM releases '
+                           'WHERE rowid = ?', (rowid,)).fetchone()
+        conn.execute(
+            'UPDATE releases SET title_grams = ?, artist_grams = ? '
+            'WHERE rowid = ?',
+            (self._index_name(RELEASE_TITLE, rowid, row['title']),
+             self._index_name(RELEASE_ARTIST, rowid, row['artist']),
+             rowid)
+        )
+        tracks = conn.execute('SELECT rowid, title, artist FROM tracks '
+                              'WHERE release = ?', (rowid,)).fetchall()
+        for track in tracks:
+            # Tracks are indexed under their release's artist unless
+            # they have their own.
+            conn.execute(
+                'UPDATE tracks SET title_grams = ?, artist_grams = ? '
+                'WHERE rowid = ?',
+                (self._index_name(TRACK_TITLE, track['rowid'],
+                                  track['title']),
+                 self._index_name(TRACK_ARTIST, track['rowid'],
+                                  track['artist'] or row['artist']),
+                 track['rowid'])
+            )
+
+    def commit(self):
+        """Commits changes to the mirror and makes sure that the search
+        index (including the trigram frequencies) is ready.
+        """
+        conn = self._conn()
+        conn.execute(GRAMS_INDEX)
+        conn.execute('DELETE FROM gram_counts')
+        conn.execute('INSERT INTO gram_counts (kind, gram, count) '
+                     'SELECT kind, gram, COUNT(*) FROM grams '
+                     'GROUP BY kind, gram')
+        conn.execute('DELETE FROM name_counts')
+        conn.execute('INSERT INTO name_counts (kind, count) '
+                     'SELECT kind, COUNT(DISTINCT ref) FROM grams '
+                     'GROUP BY kind')
+        conn.execute('PRAGMA user_version = %i' % MIRROR_VERSION)
+        conn.commit()
+
+    def import_dump(self, dumpdir):
+        """Fills the mirror from a MusicBrainz data dump. dumpdir is the
+        directory containing the dump's table files (the "mbdump"
+        directory in the dump archives). Releases already in the mirror
+        are replaced.
+        """
+        conn = self._conn()
+
+        # Load the raw tables into temporary tables.
+        for table, columns in DUMP_TABLES:
+            path = os.path.join(dumpdir, table)
+            defs = []
+            for column in columns:
+                if column == 'id':
+                    column = 'id INTEGER PRIMARY KEY'
+                elif ' ' not in column:
+                    column += ' NUMERIC'
+                defs.append(column)
+            conn.execute('CREATE TEMP TABLE dump_%s (%s)' %
+                         (table, ', '.join(defs)))
+            if not os.path.exists(path):
+                if table in OPTIONAL_DUMP_TABLES:
+                    continue
+                raise IOError('dump table missing: %s' % path)
+            log.debug('Loading dump table %s' % table)
+            conn.executemany(
+                'INSERT INTO dump_%s VALUES (%s)' %
+                (table, ', '.join('?' * len(columns))),
+                self._read_dump(path, len(columns))
+            )
+        for table, columns in DUMP_INDICES:
+            conn.execute('CREATE INDEX temp.dump_%s_idx ON dump_%s (%s)' %
+                         (table, table, columns))
+
+        # Clear out the old data (recreating the tables in case they
+        # were made by an older version). The search index is rebuilt
+        # at the end, which is much faster than updating it.
+        for table in ('grams', 'gram_counts', 'name_counts', 'tracks',
+                      'releases'):
+            conn.execute('DROP TABLE %s' % table)
+        conn.executescript(SCHEMA)
+        conn.execute('DROP INDEX IF EXISTS grams_lookup')
+
+        # Join the dump tables into releases and tracks. Releases keep
+        # their row IDs from the dump. The first credited artist is
+        # the release's or track's artist ID.
+        log.debug('Building releases')
+        conn.execute("""
+            INSERT INTO releases (rowid, id, title, artist, artist_id, asin,
+                                  albumtype, year, month, day, va)
+            SELECT r.id, r.gid, rn.name, an.name, a.gid, rm.amazon_asin,
+                   COALESCE(LOWER(rgt.name), ''),
+                   r.date_year, r.date_month, r.date_day, a.gid = ?
+            FROM dump_release r
+            JOIN dump_release_name rn ON rn.id = r.name
+            JOIN dump_artist_credit ac ON ac.id = r.artist_credit
+            JOIN dump_artist_name an ON an.id = ac.name
+            JOIN dump_artist_credit_name acn
+                ON acn.artist_credit = ac.id AND acn.position = 0
+            JOIN dump_artist a ON a.id = acn.artist
+            LEFT JOIN dump_release_group rg ON rg.id = r.release_group
+            LEFT JOIN dump_release_group_type rgt ON rgt.id = rg.type
+            LEFT JOIN dump_release_meta rm ON rm.id = r.id
+        """, (mb.VARIOUS_ARTISTS_ID,))
+
+        # Tracks on all of a release's media are numbered in order.
+        # Like the web service, a track only gets its own artist if it
+        # is credited differently from its release.
+        log.debug('Building tracks')
+        conn.execute("""
+            INSERT INTO tracks (release, position, id, title, artist,
+                                artist_id, length)
+            SELECT m.release, m.position * 10000 + t.position, rec.gid,
+                   tn.name,
+                   CASE WHEN t.artist_credit != r.artist_credit
+                        THEN an.name END,
+                   CASE WHEN t.artist_credit != r.artist_credit
+                        THEN a.gid END,
+                   t.length / 1000.0
+            FROM dump_track t
+            JOIN dump_medium m ON m.tracklist = t.tracklist
+            JOIN dump_release r ON r.id = m.release
+            JOIN dump_recording rec ON rec.id = t.recording
+            JOIN dump_track_name tn ON tn.id = t.name
+            JOIN dump_artist_credit ac ON ac.id = t.artist_credit
+            JOIN dump_artist_name an ON an.id = ac.name
+            JOIN dump_artist_credit_name acn
+                ON acn.artist_credit = ac.id AND acn.position = 0
+            JOIN dump_artist a ON a.id = acn.artist
+            ORDER BY m.release, m.position, t.position
+        """)
+        conn.execute("""
+            UPDATE releases SET track_count =
+                (SELECT COUNT(*) FROM tracks
+                 WHERE tracks.release = releases.rowid)
+        """)
+
+        for table, _ in DUMP_TABLES:
+            conn.execute('DROP TABLE dump_%s' % table)
+
+        # Index the names.
+        log.debug('Indexing names')
+        rowids = [row[0] for row in
+                  conn.execute('SELECT rowid FROM releases').fetchall()]
+        for rowid in rowids:
+            self._index_release(rowid)
+        self.commit()
+        log.debug('Mirror contains %i releases' % len(rowids))
+
+    def _read_dump(self, path, count):
+        """Generates the rows of a dump table file, keeping the first
+        count columns.
+        """
+        f = open(path)
+        try:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')[:count]
+                yield [_unescape_dump(field) for field in fields]
+        finally:
+            f.close()
+
+    # Lookups.
+
+    def _release_dict(self, row):
+        """Returns the info dictionary, complete with tracks, for a
+        release row.
+        """
+        out = {
+            'album': row['title'],
+            'album_id': row['id'],
+            'artist': row['artist'],
+            'artist_id': row['artist_id'],
+            'asin': row['asin'],
+            'albumtype': row['albumtype'] or '',
+            'va': bool(row['va']),
+        }
+        for key in ('year', 'month', 'day'):
+            if row[key]:
+                out[key] = row[key]
+        out['tracks'] = [self._track_dict(track) for track in
+                         self._conn().execute(
+                             'SELECT * FROM tracks WHERE release = ? '
+                             'ORDER BY position', (row['rowid'],)
+                         )]
+        return out
+
+    def _track_dict(self, row, release_artist=None):
+        """Returns the info dictionary for a track row. If the track
+        has no artist of its own, release_artist, an (artist,
+        artist_id) pair, is used if it is given.
+        """
+        out = {'title': row['title'], 'id': row['id']}
+        if row['artist'] is not None:
+            out['artist'] = row['artist']
+            out['artist_id'] = row['artist_id']
+        elif release_artist:
+            out['artist'], out['artist_id'] = release_artist
+        if row['length'] is not None:
+            out['length'] = row['length']
+        return out
+
+    def _search_grams(self, kind, query_grams):
+        """Returns the trigrams in query_grams that are worth looking
+        up in the index of the given kind: those that occur in the
+        index and are not too common (see `COMMON_GRAM_SHARE`) or, if
+        they all are, the rarest one.
+        """
+        if not query_grams:
+            return []
+        conn = self._conn()
+        row = conn.execute('SELECT count FROM name_counts WHERE kind = ?',
+                           (kind,)).fetchone()
+        names = row and row[0] or 0
+        cutoff = max(COMMON_GRAM_MIN, COMMON_GRAM_SHARE * names)
+        query_grams = list(query_grams)
+        counts = [tuple(row) for row in conn.execute(
+            'SELECT count, gram FROM gram_counts '
+            'WHERE kind = ? AND gram IN (%s)' %
+            ', '.join('?' * len(query_grams)),
+            [kind] + query_grams
+        )]
+        if not counts:
+            return []
+        out = [gram for count, gram in counts if count <= cutoff]
+        if not out:
+            out = [min(counts)[1]]
+        return out
+
+    def _gram_conditions(self, kinds):
+        """Builds the condition selecting the index entries for the
+        trigrams to search for. kinds is a list of (kind, trigrams)
+        pairs. Returns the SQL and its arguments, or None if there is
+        nothing to search for.
+        """
+        conds = []
+        args = []
+        for kind, kind_grams in kinds:
+            if kind_grams:
+                conds.append('(g.kind = ? AND g.gram IN (%s))' %
+                             ', '.join('?' * len(kind_grams)))
+                args += [kind] + kind_grams
+        if conds:
+            return '(%s)' % ' OR '.join(conds), args
+
+    def match_album(self, artist, album, tracks=None,
+                    limit=mb.SEARCH_LIMIT):
+        """Searches for releases like `mb.match_album`. The releases
+        are ranked by the similarity of their titles and artists to
+        the query; releases with the requested number of tracks come
+        first among equals. If artist is None, only Various Artists
+        releases are considered.
+        """
+        album_grams = grams(album)
+        artist_grams = grams(artist or u'')
+        if not album_grams:
+            return iter([])
+        cond = self._gram_conditions([
+            (RELEASE_TITLE, self._search_grams(RELEASE_TITLE, album_grams)),
+            (RELEASE_ARTIST, self._search_grams(RELEASE_ARTIST,
+                                                artist_grams)),
+        ])
+        if not cond:
+            return iter([])
+        where, args = cond
+        if artist is None:
+            where += ' AND r.va'
+        query = """
+            SELECT r.*,
+                   2.0 * SUM(g.kind = ?) / MAX(? + r.title_grams, 1) +
+                   2.0 * SUM(g.kind = ?) / MAX(? + r.artist_grams, 1)
+                   AS score
+            FROM grams g JOIN releases r ON r.rowid = g.ref
+            WHERE %s
+            GROUP BY r.rowid
+            ORDER BY score DESC, r.track_count = ? DESC
+            LIMIT ?
+        """ % where
+        args = [RELEASE_TITLE, len(album_grams),
+                RELEASE_ARTIST, len(artist_grams)] + args + [tracks, limit]
+        rows = self._conn().execute(query, args).fetchall()
+        return iter([self._release_dict(row) for row in rows])
+
+    def match_track(self, artist, title, limit=mb.SEARCH_LIMIT):
+        """Searches for tracks like `mb.match_track`. The tracks that
+        share the most trigrams with the title and the artist are
+        ranked by the similarity of their titles and artists to the
+        query.
+        """
+        title_grams = grams(title)
+        artist_grams = grams(artist or u'')
+        if not title_grams:
+            return iter([])
+        cond = self._gram_conditions([
+            (TRACK_TITLE, self._search_grams(TRACK_TITLE, title_grams)),
+            (TRACK_ARTIST, self._search_grams(TRACK_ARTIST, artist_grams)),
+        ])
+        if not cond:
+            return iter([])
+        where, args = cond
+        query = """
+            SELECT t.*, r.artist AS release_artist,
+                   r.artist_id AS release_artist_id,
+                   2.0 * SUM(g.kind = ?) / MAX(? + t.title_grams, 1) +
+                   2.0 * SUM(g.kind = ?) / MAX(? + t.artist_grams, 1)
+                   AS score
+            FROM grams g
+            JOIN tracks t ON t.rowid = g.ref
+            JOIN releases r ON r.rowid = t.release
+            WHERE %s
+            GROUP BY t.rowid
+            ORDER BY score DESC
+            LIMIT ?
+        """ % where
+        args = [TRACK_TITLE, len(title_grams),
+                TRACK_ARTIST, len(artist_grams)] + args + \
+               [limit * TRACK_POOL_FACTOR]
+        results = []
+        for row in self._conn().execute(query, args):
+            info = self._track_dict(row, (row['release_artist'],
+                                          row['release_artist_id']))
+            score = _dice(title_grams, grams(info['title']))
+            if artist_grams:
+                score += _dice(artist_grams,
+                               grams(info.get('artist') or u''))
+            results.append((-score, len(results), info))
+        results.sort()
+        return iter([info for _, _, info in results[:limit]])
+
+    def album_for_id(self, albumid):
+        """Looks up a release by its MusicBrainz ID like
+        `mb.album_for_id`.
+        """
+        row = self._conn().execute('SELECT * FROM releases WHERE id = ?',
+                                   (albumid,)).fetchone()
+        if row:
+            return self._release_dict(row)
+
+    def track_for_id(self, trackid):
+        """Looks up a track by its MusicBrainz ID like
+        `mb.track_for_id`.
+        """
+        row = self._conn().execute("""
+            SELECT t.*, r.artist AS release_artist,
+                   r.artist_id AS release_artist_id
+            FROM tracks t JOIN releases r ON r.rowid = t.release
+            WHERE t.id = ?
+        """, (trackid,)).fetchone()
+        if row:
+            return self._track_dict(row, (row['release_artist'],
+                                          row['release_artist_id']))
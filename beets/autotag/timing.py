@@ -0,0 +1,162 @@
+# This file is part of beets.
+# Copyright 2011, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Records where the autotagger spends its time. While a `Profile` is
+active in a thread (see `activate`), the autotagger adds the time
+spent on each kind of work and counts of interesting events to it.
+"""
+import time
+import threading
+from collections import defaultdict
+
+# The kinds of work that are timed. Times are exclusive: time spent
+# in a nested timer (e.g., waiting for a query while searching) is
+# not counted for the enclosing one.
+TIMES = [
+    'search',      # Searching for candidates (besides queries).
+    'query_wait',  # Waiting to send MusicBrainz queries (rate limit).
+    'query',       # Sending MusicBrainz queries.
+    'order',       # Ordering items (besides plugin distances).
+    'distance',    # Computing album distances (besides plugins).
+    'bound',       # Computing distance bounds for pruning.
+    'plugins',     # Plugin distances and candidates.
+    'pool',        # Waiting for worker processes.
+]
+# The events that are counted.
+COUNTS = [
+    'queries',       # MusicBrainz queries sent.
+    'fetches',       # Release track lists fetched.
+    'candidates',    # Candidates found.
+    'evaluated',     # Candidates ordered and scored.
+    'pruned',        # Candidates skipped because they could not win.
+    'matrix_cells',  # Entries in the track ordering cost matrices.
+    'cache_hits',    # String distance cache hits.
+    'cache_misses',  # String distance cache misses.
+]
+# Other figures describing the result.
+VALUES = [
+    'best_rank',      # Position of the best match among the candidates.
+    'best_distance',  # Distance of the best match.
+]
+
+# The fields of a report row (see `report_row`).
+REPORT_FIELDS = ['name', 'total', 'other'] + TIMES + COUNTS + VALUES
+
+class Profile(object):
+    """Timings and counters for the tagging of one album. `times` maps
+    the names in `TIMES` to seconds, `counts` maps the names in
+    `COUNTS` to numbers, and `values` may contain the figures in
+    `VALUES`. `total` is the time for which the profile was active.
+    """
+    def __init__(self, name=None):
+        self.name = name
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.values = {}
+        self.total = 0.0
+        self._started = None
+        # Running timers: [name, start time, time in nested timers].
+        self._timers = []
+
+    def other(self):
+        """The active time not accounted for by any timer."""
+        return self.total - sum(self.times.values())
+
+    def summary(self):
+        """A one-line description of the profile for the log."""
+        parts = ['%.3fs' % self.total]
+        for name in TIMES:
+            if self.times.get(name):
+                parts.append('%s %.3fs' % (name, self.times[name]))
+        for name in COUNTS:
+            if self.counts.get(name):
+                parts.append('%s %i' % (name, self.counts[name]))
+        for name in VALUES:
+            if self.values.get(name) is not None:
+                parts.append('%s %s' % (name, self.values[name]))
+        return ', '.join(parts)
+
+    def _start_timer(self, name):
+        self._timers.append([name, time.time(), 0.0])
+
+    def _stop_timer(self):
+        name, start, nested = self._timers.pop()
+        elapsed = time.time() - start
+        self.times[name] += elapsed - nested
+        if self._timers:
+            self._timers[-1][2] += elapsed
+
+_local = threading.local()
+
+def activate(profile):
+    """Makes profile collect the autotagger's timings in the current
+    thread until `deactivate` is called.
+    """
+    profile._started = time.time()
+    _local.profile = profile
+
+def deactivate():
+    """Stops collecting timings in the current thread."""
+    profile = current()
+    if profile is not None:
+        profile.total += time.time() - profile._started
+        _local.profile = None
+
+def current():
+    """Returns the profile active in the current thread or None."""
+    return getattr(_local, 'profile', None)
+
+def count(name, n=1):
+    """Adds n to a counter in the active profile, if any."""
+    profile = current()
+    if profile is not None:
+        profile.counts[name] += n
+
+def value(name, val):
+    """Records a figure in the active profile, if any."""
+    profile = current()
+    if profile is not None:
+        profile.values[name] = val
+
+class timed(object):
+    """A context manager that adds the time spent in its block to the
+    named time in the active profile, if any.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profile = current()
+        if self.profile is not None:
+            self.profile._start_timer(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profile is not None:
+            self.profile._stop_timer()
+
+def report_row(profile):
+    """Returns a list of the values of the `REPORT_FIELDS` for a
+    profile, suitable for writing to a CSV file.
+    """
+    row = [profile.name, '%.4f' % profile.total, '%.4f' % profile.other()]
+    row += ['%.4f' % profile.times.get(name, 0.0) for name in TIMES]
+    row += [profile.counts.get(name, 0) for name in COUNTS]
+    for name in VALUES:
+        val = profile.values.get(name)
+        if val is None:
+            val = ''
+        elif isinstance(val, float):
+            val = '%.4f' % val
+        row.append(val)
+    return row
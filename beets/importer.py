@@ -19,22 +19,40 @@ from __future__ import with_statement # Python 2.5
 import os
 import logging
 import pickle
+import time
+import sys
+import threading
+import Queue
+import csv
+import tempfile
 
 from beets import autotag
+from beets.autotag import timing
 from beets import library
 import beets.autotag.art
 from beets import plugins
+from beets import util
 from beets.util import pipeline
-from beets.util import syspath, normpath
+from beets.util import watch
+from beets.util import syspath, normpath, manifest_paths
 from beets.util.enumeration import enum
 
 action = enum(
-    'SKIP', 'ASIS', 'TRACKS', 'MANUAL', 'APPLY',
+    'SKIP', 'ASIS', 'TRACKS', 'MANUAL', 'APPLY', 'DEFER',
     name='action'
 )
 
 QUEUE_SIZE = 128
+# The maximum total weight (see `_task_weight`) of the tasks waiting
+# between any two stages of a threaded import.
+QUEUE_WEIGHT = 4096
+# In quiet mode, a warning is logged when a stage spends longer than
+# this many seconds on one album.
+STALL_TIME = 300.0
+# The number of albums whose art is fetched at once in threaded mode.
+ART_THREADS = 4
 STATE_FILE = os.path.expanduser('~/.beetsstate')
+PENDING_FILE = os.path.expanduser('~/.beetspending')
 
 # Global logger.
 log = logging.getLogger('beets')
@@ -54,6 +72,16 @@ def tag_log(logfile, status, path):
     if logfile:
         print >>logfile, '%s %s' % (status, path)
 
+_report_lock = threading.Lock()
+def tag_report(reportfile, profile):
+    """Add a CSV row describing the time spent tagging an album (see
+    `timing.report_row`) to reportfile, if it is not None. The column
+    names are written by `run_import`.
+    """
+    if reportfile:
+        with _report_lock:
+            csv.writer(reportfile).writerow(timing.report_row(profile))
+
 def _reopen_lib(lib):
     """Because of limitations in SQLite, a given Library is bound to
     the thread in which it was created. This function reopens Library
@@ -69,6 +97,19 @@ def _reopen_lib(lib):
     else:
         return lib
 
+def _task_weight(task):
+    """Estimates the memory held by a task for bounding the pipeline's
+    queues. The weight is roughly the number of tracks the task refers
+    to: its items plus the tracks of each of its candidate matches.
+    """
+    weight = 1 + task.item_count()
+    for info in task.candidate_infos():
+        weight += len(info['tracks'])
+    item_match = getattr(task, 'item_match', None)
+    if item_match:
+        weight += len(item_match[0])
+    return weight
+
 def _duplicate_check(lib, artist, album):
     """Check whether the match already exists in the library."""
     if artist is None:
@@ -116,6 +157,101 @@ def progress_get(toppath):
         return None
     return state[PROGRESS_KEY].get(toppath)
 
+# Utilities for the pending-decisions store. Tasks that are deferred
+# during a non-interactive import are appended to this file (along
+# with their candidates) so that they can be resolved later without
+# repeating the lookups. The file is a sequence of pickled
+# dictionaries; later entries for the same key replace earlier ones,
+# and resolved decisions are recorded by appending removal entries so
+# that the file is only ever appended to during an import.
+def pending_add(entry):
+    """Append a pending-decision entry (as produced by
+    `ImportTask.pending_entry`) to the store.
+    """
+    with open(PENDING_FILE, 'ab') as f:
+        pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+def pending_get():
+    """Returns a list of all the pending-decision entries in the
+    store, oldest first.
+    """
+    # Maps keys to (position, entry) pairs.
+    entries = {}
+    pos = 0
+    try:
+        f = open(PENDING_FILE, 'rb')
+    except IOError:
+        return []
+    with f:
+        while True:
+            try:
+                entry = pickle.load(f)
+            except EOFError:
+                break
+            except pickle.UnpicklingError:
+                # An append was interrupted. Everything before it is
+                # intact.
+                log.warn('Ignoring a truncated entry in %s' % PENDING_FILE)
+                break
+            key = entry['key']
+            if entry.get('removed'):
+                entries.pop(key, None)
+            elif key in entries:
+                entries[key] = (entries[key][0], entry)
+            else:
+                entries[key] = (pos, entry)
+                pos += 1
+    return [entry for _, entry in sorted(entries.values())]
+def pending_remove(keys):
+    """Remove the entries with the given keys from the
+    pending-decision store.
+    """
+    with open(PENDING_FILE, 'ab') as f:
+        for key in keys:
+            pickle.dump({'key': key, 'removed': True}, f,
+                        pickle.HIGHEST_PROTOCOL)
+def pending_compact():
+    """Rewrite the pending-decision store without the entries that
+    have been replaced or removed. The new store is written next to
+    the old one and then renamed over it, so an interruption cannot
+    lose any entries. The file is deleted when it becomes empty.
+    """
+    if not os.path.exists(PENDING_FILE):
+        return
+    entries = pending_get()
+    if not entries:
+        os.remove(PENDING_FILE)
+        return
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(PENDING_FILE))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for entry in entries:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmppath, PENDING_FILE)
+    except:
+        os.remove(tmppath)
+        raise
+
+def plan_entries(planfile):
+    """Generates the entries (see `ImportTask.plan_entry`) in an
+    import plan read from the open file planfile.
+    """
+    while True:
+        try:
+            yield pickle.load(planfile)
+        except EOFError:
+            return
+
+def _mount_point(path):
+    """Returns the mount point of the filesystem that contains (or
+    would contain) path.
+    """
+    path = os.path.abspath(syspath(path))
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
 
 # The configuration structure.
 
@@ -127,7 +263,12 @@ class ImportConfig(object):
     _fields = ['lib', 'paths', 'resume', 'logfile', 'color', 'quiet',
                'quiet_fallback', 'copy', 'write', 'art', 'delete',
                'choose_match_func', 'should_resume_func', 'threaded',
-               'autot', 'singletons', 'interactive_autotag', 'choose_item_func']
+               'autot', 'singletons', 'interactive_autotag', 'choose_item_func',
+               'resolve', 'manifest', 'watch', 'commit_every',
+               'commit_interval', 'transfer_threads', 'transfer_per_device',
+               'plan', 'apply_plan', 'lookup_threads', 'pool_size',
+               'time_limit', 'lookup_timeout', 'art_cache',
+               'autotag_processes', 'tag_report']
     def __init__(self, **kwargs):
         for slot in self._fields:
             setattr(self, slot, kwargs[slot])
@@ -146,8 +287,88 @@ class ImportTask(object):
     def __init__(self, toppath=None, path=None, items=None):
         self.toppath = toppath
         self.path = path
+        self._records = None
         self.items = items
+        self._candidate_records = None
+        self.candidates = None
         self.sentinel = False
+        self.pending_key = None
+        self.old_paths = []
+        self.dests = None
+        self.art_path = None
+        self.known_tracks = None
+
+    # Tasks waiting in the pipeline's queues can hold their items as
+    # compact records (tuples of field values in `library.ITEM_KEYS`
+    # order); Item objects are recreated when `items` is first used.
+    def _get_items(self):
+        if self._records is not None:
+            self._items = [library.Item(dict(zip(library.ITEM_KEYS, rec)))
+                           for rec in self._records]
+            self._records = None
+        return self._items
+    def _set_items(self, items):
+        self._items = items
+        self._records = None
+    items = property(_get_items, _set_items)
+
+    # Likewise, the album candidates of a compacted task refer to the
+    # items by their indices instead of holding reordered item lists.
+    def _get_candidates(self):
+        if self._candidate_records is not None:
+            items = self.items
+            self._candidates = [
+                (dist, [items[i] for i in indices], info)
+                for dist, indices, info in self._candidate_records
+            ]
+            self._candidate_records = None
+        return self._candidates
+    def _set_candidates(self, candidates):
+        self._candidates = candidates
+        self._candidate_records = None
+    candidates = property(_get_candidates, _set_candidates)
+
+    def compact(self):
+        """Store the task's items (and its candidates' reorderings of
+        them) compactly until they are next needed. Any other
+        references to the Item objects no longer refer to the task's
+        items.
+        """
+        if self._items:
+            if self._candidates:
+                indices = dict((id(item), i)
+                               for i, item in enumerate(self._items))
+                self._candidate_records = [
+                    (dist, [indices[id(item)] for item in items], info)
+                    for dist, items, info in self._candidates
+                ]
+                self._candidates = None
+            self._records = [tuple([item.record[key]
+                                    for key in library.ITEM_KEYS])
+                             for item in self._items]
+            self._items = None
+
+    def item_count(self):
+        """The number of items in the task, without recreating any
+        compacted items.
+        """
+        if self._records is not None:
+            return len(self._records)
+        elif self._items:
+            return len(self._items)
+        else:
+            return 0
+
+    def candidate_infos(self):
+        """The info dictionaries of the task's album candidates,
+        without recreating any compacted items.
+        """
+        if self._candidate_records is not None:
+            return [info for _, _, info in self._candidate_records]
+        elif self._candidates:
+            return [info for _, _, info in self._candidates]
+        else:
+            return []
 
     @classmethod
     def done_sentinel(cls, toppath):
@@ -159,11 +380,15 @@ class ImportTask(object):
         return obj
 
     @classmethod
-    def item_task(cls, item):
-        """Creates an ImportTask for a single item."""
+    def item_task(cls, item, known_tracks=None):
+        """Creates an ImportTask for a single item. known_tracks may
+        be a list of track info dictionaries to try before searching
+        (see `autotag.tag_item`).
+        """
         obj = cls()
         obj.item = item
         obj.is_album = False
+        obj.known_tracks = known_tracks
         return obj
 
     def set_match(self, cur_artist, cur_album, candidates, rec):
@@ -203,6 +428,17 @@ class ImportTask(object):
         assert not self.sentinel
         assert choice != action.MANUAL # Not part of the task structure.
         assert choice != action.APPLY # Only used internally.
+        if choice is action.DEFER:
+            # Keep the items and candidates around for the store.
+            self.choice_flag = choice
+            self.info = None
+            return
+
+        # The candidates are no longer needed once a choice is made.
+        if self.is_album:
+            self.candidates = None
+        else:
+            self.item_match = None
         if choice in (action.SKIP, action.ASIS, action.TRACKS):
             self.choice_flag = choice
             self.info = None
@@ -231,6 +467,118 @@ class ImportTask(object):
         else:
             progress_set(self.toppath, self.path)
 
+    def pending_entry(self):
+        """Returns a picklable dictionary describing this task and its
+        candidates for the pending-decision store. Items are stored
+        as their field dictionaries and the reordered item lists in
+        album candidates are stored as indices into the item list.
+        """
+        entry = {'toppath': self.toppath, 'is_album': self.is_album}
+        if self.is_album:
+            entry['key'] = self.path
+            entry['items'] = [dict(item.record) for item in self.items]
+            entry['cur_artist'] = self.cur_artist
+            entry['cur_album'] = self.cur_album
+            entry['rec'] = self.rec
+            indices = dict((id(item), i) for i, item in enumerate(self.items))
+            entry['candidates'] = [
+                (dist, [indices[id(item)] for item in items], info)
+                for dist, items, info in self.candidates or ()
+            ]
+        else:
+            entry['key'] = self.item.path
+            entry['items'] = [dict(self.item.record)]
+            if self.item_match:
+                entry['candidates'], entry['rec'] = self.item_match
+            else:
+                entry['candidates'], entry['rec'] = None, None
+        return entry
+
+    @classmethod
+    def from_pending(cls, entry):
+        """Reconstruct a matched (but undecided) task from an entry in
+        the pending-decision store.
+        """
+        items = [library.Item(record) for record in entry['items']]
+        if entry['is_album']:
+            obj = cls(entry['toppath'], entry['key'], items)
+            candidates = [
+                (dist, [items[i] for i in indices], info)
+                for dist, indices, info in entry['candidates']
+            ]
+            obj.set_match(entry['cur_artist'], entry['cur_album'],
+                          candidates, entry['rec'])
+        else:
+            obj = cls.item_task(items[0])
+            if entry['candidates'] is None:
+                obj.set_null_item_match()
+            else:
+                obj.set_item_match(entry['candidates'], entry['rec'])
+        obj.pending_key = entry['key']
+        return obj
+
+    def plan_entry(self, conflicts):
+        """Returns a picklable dictionary describing the decision made
+        for this task for an import plan. The items are stored as
+        their field dictionaries with the new metadata already applied
+        and the destinations in `self.dests`. conflicts is a list
+        giving, for each item, None or a string describing why its
+        destination is already taken (see `plan_choices`). Deferred
+        tasks also carry their pending-decision entry.
+        """
+        items = self.items if self.is_album else [self.item]
+        sizes = []
+        mounts = []
+        for item, dest in zip(items, self.dests):
+            if dest is None:
+                sizes.append(0)
+                mounts.append(None)
+            else:
+                sizes.append(os.path.getsize(syspath(item.path)))
+                mounts.append(_mount_point(dest))
+        entry = {
+            'toppath': self.toppath,
+            'path': self.path,
+            'is_album': self.is_album,
+            'choice': self.choice_flag.name,
+            'info': self.info,
+            'items': [dict(item.record) for item in items],
+            'dests': self.dests,
+            'sizes': sizes,
+            'mounts': mounts,
+            'conflicts': conflicts,
+        }
+        if self.choice_flag == action.DEFER:
+            entry['pending'] = self.pending_entry()
+        return entry
+
+    @classmethod
+    def from_plan(cls, entry):
+        """Reconstruct a decided task from an import plan entry."""
+        if entry['choice'] == 'DEFER':
+            # Deferred again when the plan is applied, so it goes to
+            # the pending-decision store then.
+            obj = cls.from_pending(entry['pending'])
+            obj.set_choice(action.DEFER)
+            obj.pending_key = None
+            obj.dests = entry['dests']
+            return obj
+        items = [library.Item(record) for record in entry['items']]
+        if entry['is_album']:
+            obj = cls(entry['toppath'], entry['path'], items)
+            obj.is_album = True
+        else:
+            obj = cls.item_task(items[0])
+        if entry['choice'] == 'APPLY':
+            if obj.is_album:
+                obj.set_choice((entry['info'], items))
+            else:
+                obj.set_choice(entry['info'])
+        else:
+            obj.set_choice(action[entry['choice']])
+        obj.dests = entry['dests']
+        return obj
+
     # Logical decisions.
     def should_create_album(self):
         """Should an album structure be created for these items?"""
@@ -271,12 +619,31 @@ class ImportTask(object):
 
 # Full-album pipeline stages.
 
+def _read_task(toppath, path, items):
+    """Creates the task for an album that has just been read. The
+    items are compacted, since the task may wait in a queue for a long
+    time before it is looked up.
+    """
+    task = ImportTask(toppath, path, items)
+    task.compact()
+    return task
+
 def read_albums(config):
     """A generator yielding all the albums (as ImportTask objects) found
     in the user-specified list of paths. `progress` specifies whether
     the resuming feature should be used. It may be True (resume if
     possible), False (never resume), or None (ask).
     """
+    # In watch mode, directories are imported as they settle.
+    if config.watch:
+        for album in _settled_albums(config):
+            if album is pipeline.BUBBLE:
+                yield album
+            else:
+                path, items = album
+                yield _read_task(None, path, items)
+        return
+
     # Look for saved progress.
     progress = config.resume is not False
     if progress:
@@ -311,11 +678,60 @@ def read_albums(config):
                     resume_dir = None
                 continue
 
-            yield ImportTask(toppath, path, items)
+            yield _read_task(toppath, path, items)
 
         # Indicate the directory is finished.
         yield ImportTask.done_sentinel(toppath)
 
+    # Stream albums listed in a manifest without walking any trees.
+    if config.manifest:
+        paths = manifest_paths(config.manifest)
+        for path, items in autotag.albums_from_paths(paths):
+            yield _read_task(None, path, items)
+
+def _settled_albums(config):
+    """Watches the directories in `config.paths` forever, generating
+    a (path, items) pair for each directory as it settles (i.e., once
+    its files stop changing). `config.watch` is the settle time in
+    seconds. When no directory is ready, BUBBLE is generated instead
+    so that the pipeline has a chance to shut down.
+    """
+    watcher = watch.watcher(config.paths, config.watch)
+    try:
+        while True:
+            dirpaths = watcher.poll()
+            if not dirpaths:
+                yield pipeline.BUBBLE
+                continue
+            for dirpath in dirpaths:
+                paths = sorted(watch.dir_files(dirpath))
+                for pair in autotag.albums_from_paths(paths):
+                    yield pair
+    finally:
+        watcher.close()
+
+def read_plan(config):
+    """A generator yielding the tasks recorded in the import plan
+    `config.apply_plan` (an open file).
+    """
+    for entry in plan_entries(config.apply_plan):
+        for source, dest, conflict in zip(entry['items'], entry['dests'],
+                                          entry['conflicts']):
+            if conflict:
+                log.warn('Planned destination for %s conflicts (%s): %s' %
+                         (source['path'], conflict, dest))
+        yield ImportTask.from_plan(entry)
+
+def read_pending(config):
+    """A generator yielding the tasks left undecided by a previous
+    deferred import. Only album tasks are produced unless the importer
+    is in singleton mode, in which case only item tasks are.
+    """
+    for entry in pending_get():
+        if entry['is_album'] != (not config.singletons):
+            continue
+        yield ImportTask.from_pending(entry)
+
 def initial_lookup(config):
     """A coroutine for performing the initial MusicBrainz lookup for an
     album. It accepts lists of Items and yields
@@ -328,11 +744,25 @@ def initial_lookup(config):
         if task.sentinel:
             continue
 
+        # Without anyone to choose among the candidates, only the best
+        # one matters.
+        prune = config.quiet and config.quiet_fallback != action.DEFER
+
         log.debug('Looking up: %s' % task.path)
+        profile = timing.Profile(task.path)
         try:
-            task.set_match(*autotag.tag_album(task.items, config))
+            task.set_match(*autotag.tag_album(task.items, config,
+                                              prune=prune, profile=profile))
         except autotag.AutotagError:
             task.set_null_match()
+        tag_report(config.tag_report, profile)
+
+        # The task may wait a long time for the user's choice. Only
+        # the best candidate is used in quiet mode (unless the task
+        # is deferred, in which case all of them are stored).
+        if prune and task.candidates:
+            task.candidates = task.candidates[:1]
+        task.compact()
 
 def user_query(config):
     """A coroutine for interfacing with the user about the tagging
@@ -347,24 +777,36 @@ def user_query(config):
         if task.sentinel:
             continue
         
-        # Ask the user for a choice.
+        # Ask the user for a choice. (Choosing drops the candidates,
+        # whose tracks are useful when importing as tracks.)
         choice = config.choose_match_func(task, config)
+        if choice is action.TRACKS:
+            known = autotag.candidate_tracks(task.candidates or [])
         task.set_choice(choice)
 
         # As-tracks: transition to singleton workflow.
         if choice is action.TRACKS:
             # Set up a little pipeline for dealing with the singletons.
+            # The tracks of the album candidates are tried before
+            # searching, and the lookups run ahead of the questions.
             item_tasks = []
             def emitter():
                 for item in task.items:
-                    yield ImportTask.item_task(item)
+                    yield ImportTask.item_task(item, known)
             def collector():
                 while True:
                     item_task = yield
                     item_tasks.append(item_task)
-            ipl = pipeline.Pipeline((emitter(), item_lookup(config), 
+            ipl = pipeline.Pipeline((emitter(),
+                                     _lookup_stage(item_lookup, config),
                                      item_query(config), collector()))
-            ipl.run_sequential()
+            if config.threaded:
+                ipl.run_parallel(QUEUE_SIZE, ordered=True)
+            else:
+                ipl.run_sequential()
+            if item_tasks and task.pending_key is not None:
+                # Clear the stored decision once the last track is in.
+                item_tasks[-1].pending_key = task.pending_key
             task = pipeline.multiple(item_tasks)
 
         # Log certain choices.
@@ -372,6 +814,8 @@ def user_query(config):
             tag_log(config.logfile, 'asis', task.path)
         elif choice is action.SKIP:
             tag_log(config.logfile, 'skip', task.path)
+        elif choice is action.DEFER:
+            tag_log(config.logfile, 'defer', task.path)
 
         # Check for duplicates if we have a match (or ASIS).
         if choice is action.ASIS or isinstance(choice, tuple):
@@ -403,85 +847,402 @@ def show_progress(config):
         task.set_null_match()
         task.set_choice(action.ASIS)
         
-def apply_choices(config):
-    """A coroutine for applying changes to albums during the autotag
-    process. The parameters to the generator control the behavior of
-    the import. The coroutine accepts ImportTask objects and yields
-    nothing.
+class _CommitBatch(object):
+    """Groups the database work of several tasks in the apply stage
+    into a single transaction. The transaction is committed (and the
+    library's "save" event sent) once `config.commit_every` tasks
+    have finished or `config.commit_interval` seconds have passed
+    since the last commit, whichever comes first; a zero value
+    disables either limit. Work that must not happen before the data
+    is safely in the database -- recording progress, clearing resolved
+    pending decisions, and deleting moved source files -- is held back
+    until the commit.
+    """
+    def __init__(self, lib, config):
+        self.lib = lib
+        self.config = config
+        self.tasks = []
+        self.old_paths = []
+        self.last_commit = time.time()
+
+    def add(self, task, old_paths=()):
+        """Record that a task has finished. old_paths is a list of
+        source files to delete once the task has been committed.
+        """
+        self.tasks.append(task)
+        self.old_paths += old_paths
+        self.check()
+
+    def check(self):
+        """Commit if either limit has been reached. Called for each
+        task and also while the import is waiting (for new files or
+        for the user, say), so that finished tasks are not left
+        uncommitted for longer than `config.commit_interval`.
+        """
+        every = self.config.commit_every
+        interval = self.config.commit_interval
+        if (every and len(self.tasks) >= every) or \
+           (interval and time.time() - self.last_commit >= interval):
+            self.commit()
+
+    def commit(self):
+        """Commit the current transaction and then perform the work
+        deferred for the tasks it contains.
+        """
+        if not self.tasks:
+            return
+        if any(not t.sentinel and t.choice_flag not in
+               (action.SKIP, action.DEFER) for t in self.tasks):
+            self.lib.save()
+
+        resolved = []
+        for task in self.tasks:
+            if self.config.resume is not False:
+                task.save_progress()
+            if task.pending_key is not None:
+                resolved.append(task.pending_key)
+        if resolved:
+            pending_remove(resolved)
+        for old_path in self.old_paths:
+            os.remove(syspath(old_path))
+
+        self.tasks = []
+        self.old_paths = []
+        self.last_commit = time.time()
+
+class _TransferPool(object):
+    """A set of worker threads that copy files into the library and
+    write their tags. At most `per_device` transfers write to any one
+    device at a time (zero means no limit), so importing from an
+    external or network drive keeps both disks busy without making
+    either one seek back and forth between many files. With fewer than
+    two threads, transfers run in the calling thread.
+    """
+    def __init__(self, threads, per_device):
+        self.per_device = per_device
+        self.jobs = Queue.Queue()
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.workers = []
+        if threads > 1:
+            for _ in range(threads):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self.workers.append(thread)
+
+    def _device_lock(self, dest):
+        """Returns the semaphore limiting the concurrent transfers to
+        the device containing dest (whose directory must exist) or
+        None if there is no limit.
+        """
+        if not self.per_device:
+            return None
+        device = os.stat(syspath(os.path.dirname(dest))).st_dev
+        with self.lock:
+            if device not in self.devices:
+                self.devices[device] = threading.Semaphore(self.per_device)
+            return self.devices[device]
+
+    def transfer(self, item, dest, write):
+        """Copy item's file to dest (unless dest is None) and then, if
+        write is set, write its tags.
+        """
+        if dest is not None:
+            util.mkdirall(dest)
+        sem = self._device_lock(dest or item.path)
+        if sem:
+            sem.acquire()
+        try:
+            if dest is not None:
+                if not util.samefile(item.path, dest):
+                    util.copy(item.path, dest)
+                item.path = dest
+            if write:
+                item.write()
+        finally:
+            if sem:
+                sem.release()
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            args, results = job
+            try:
+                self.transfer(*args)
+            except Exception:
+                results.put(sys.exc_info())
+            else:
+                results.put(None)
+
+    def run(self, jobs):
+        """Perform the transfers described by a list of (item, dest,
+        write) tuples, returning when all of them are done. If any
+        transfer fails, the first exception is re-raised.
+        """
+        if not self.workers:
+            for args in jobs:
+                self.transfer(*args)
+            return
+
+        results = Queue.Queue()
+        for args in jobs:
+            self.jobs.put((args, results))
+        exc_info = None
+        for _ in jobs:
+            res = results.get()
+            if res and not exc_info:
+                exc_info = res
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def close(self):
+        """Stop the worker threads."""
+        for _ in self.workers:
+            self.jobs.put(None)
+        for thread in self.workers:
+            thread.join()
+        self.workers = []
+
+def transfer_files(config):
+    """A coroutine that applies the chosen metadata to the items of
+    each task, copies their files into the library directory (if
+    `config.copy` is set), and writes their tags (if `config.write`
+    is set). The files of each task are transferred concurrently by
+    `config.transfer_threads` workers when importing in threaded
+    mode. The source files to be deleted after the task is committed
+    are stored in the task's `old_paths` list.
     """
     lib = _reopen_lib(config.lib)
-    while True:    
-        task = yield
-        # Don't do anything if we're skipping the album or we're done.
+    if config.threaded:
+        pool = _TransferPool(config.transfer_threads,
+                             config.transfer_per_device)
+    else:
+        pool = _TransferPool(1, 0)
+    task = None
+    try:
+        while True:
+            task = yield task
+            if task.sentinel or \
+               task.choice_flag in (action.SKIP, action.DEFER):
+                continue
+
+            # Change metadata.
+            if task.should_write_tags():
+                if task.is_album:
+                    autotag.apply_metadata(task.items, task.info)
+                else:
+                    autotag.apply_item_metadata(task.item, task.info)
+            items = task.items if task.is_album else [task.item]
+            if config.copy and config.delete:
+                task.old_paths = [os.path.realpath(syspath(item.path))
+                                  for item in items]
+
+            # Destinations are computed here because they may require
+            # database access, which is bound to this thread.
+            write = config.write and task.should_write_tags()
+            jobs = []
+            for i, item in enumerate(items):
+                if task.dests is not None:
+                    # Destinations chosen in an import plan.
+                    dest = task.dests[i]
+                elif config.copy:
+                    dest = lib.destination(
+                        item, in_album=task.should_create_album()
+                    )
+                else:
+                    dest = None
+                if dest is not None or write:
+                    jobs.append((item, dest, write))
+            pool.run(jobs)
+    finally:
+        pool.close()
+
+def plan_choices(config):
+    """A coroutine that replaces the transfer and apply stages when an
+    import is only being planned. The chosen metadata is applied to
+    the items in memory and their destinations are computed, but
+    nothing is written to the files, the library directory, or the
+    database. Instead, an entry describing each task is written to the
+    open file `config.plan`. Destinations that already exist are marked
+    as "exists" conflicts and those claimed by more than one file are
+    marked as "duplicate" conflicts. Deferred tasks are recorded
+    without destinations so that they are deferred when the plan is
+    applied.
+    """
+    lib = _reopen_lib(config.lib)
+    claimed = set()
+    task = None
+    while True:
+        task = yield task
         if task.sentinel or task.choice_flag == action.SKIP:
-            if config.resume is not False:
-                task.save_progress()
+            continue
+        if task.choice_flag == action.DEFER:
+            nitems = len(task.items) if task.is_album else 1
+            task.dests = [None] * nitems
+            pickle.dump(task.plan_entry([None] * nitems), config.plan,
+                        pickle.HIGHEST_PROTOCOL)
             continue
 
-        # Change metadata, move, and copy.
         if task.should_write_tags():
             if task.is_album:
                 autotag.apply_metadata(task.items, task.info)
             else:
                 autotag.apply_item_metadata(task.item, task.info)
         items = task.items if task.is_album else [task.item]
-        if config.copy and config.delete:
-            old_paths = [os.path.realpath(syspath(item.path)) for item in items]
+
+        task.dests = []
+        conflicts = []
         for item in items:
+            conflict = None
             if config.copy:
-                item.move(lib, True, task.should_create_album())
-            if config.write and task.should_write_tags():
-                item.write()
+                dest = lib.destination(
+                    item, in_album=task.should_create_album()
+                )
+                if dest in claimed:
+                    conflict = 'duplicate'
+                elif os.path.exists(syspath(dest)) and \
+                     not util.samefile(item.path, dest):
+                    conflict = 'exists'
+                claimed.add(dest)
+            else:
+                dest = None
+            task.dests.append(dest)
+            conflicts.append(conflict)
+        pickle.dump(task.plan_entry(conflicts), config.plan,
+                    pickle.HIGHEST_PROTOCOL)
 
-        # Add items to library. We consolidate this at the end to avoid
-        # locking while we do the copying and tag updates.
-        if task.should_create_album():
-            # Add an album.
-            albuminfo = lib.add_album(task.items,
-                                      infer_aa = task.should_infer_aa())
-        else:
-            # Add tracks.
-            for item in items:
-                lib.add(item)
-        lib.save()
-
-        # Get album art if requested.
-        if config.art and task.should_fetch_art():
-            artpath = beets.autotag.art.art_for_album(task.info)
-            if artpath:
-                albuminfo.set_art(artpath)
-        lib.save()
-
-        # Announce that we've added an album.
-        if task.should_create_album():
-            plugins.send('album_imported', lib=lib, album=albuminfo)
+def fetch_art(config, cache=None):
+    """A coroutine that downloads album art for the tasks that should
+    have it (see `ImportTask.should_fetch_art`) and stores its path in
+    the task's `art_path`. If cache is an `art.ArtCache`, it is
+    consulted first and filled with the results. Several of these
+    coroutines may share a cache.
+    """
+    task = None
+    while True:
+        task = yield task
+        if task.sentinel or \
+           task.choice_flag in (action.SKIP, action.DEFER) or \
+           not task.should_fetch_art():
+            continue
+        if cache:
+            task.art_path = cache.art_for_album(task.info)
         else:
-            plugins.send('item_imported', lib=lib, item=task.item)
+            task.art_path = beets.autotag.art.art_for_album(task.info)
 
-        # Finally, delete old files.
-        if config.copy and config.delete:
-            new_paths = [os.path.realpath(item.path) for item in items]
-            for old_path in old_paths:
-                # Only delete files that were actually moved.
-                if old_path not in new_paths:
-                    os.remove(syspath(old_path))
+def _art_stage(config):
+    """Returns the pipeline stage that fetches album art: in threaded
+    mode, `ART_THREADS` coroutines sharing the cache in
+    `config.art_cache` (if any).
+    """
+    if config.art_cache:
+        cache = beets.autotag.art.ArtCache(config.art_cache)
+    else:
+        cache = None
+    if config.threaded:
+        stage = tuple(fetch_art(config, cache) for i in range(ART_THREADS))
+    else:
+        stage = fetch_art(config, cache)
+    return pipeline.blocking(stage)
 
-        # Update progress.
-        if config.resume is not False:
-            task.save_progress()
+def apply_choices(config):
+    """A coroutine for applying changes to albums during the autotag
+    process. The parameters to the generator control the behavior of
+    the import. The coroutine accepts ImportTask objects and yields
+    nothing. Database changes are committed in batches (see
+    `_CommitBatch`); the final batch is committed when the coroutine
+    is closed at the end of the import.
+    """
+    lib = _reopen_lib(config.lib)
+    batch = _CommitBatch(lib, config)
+    try:
+        while True:
+            task = yield
+            if task is pipeline.IDLE:
+                batch.check()
+                continue
+
+            # Don't do anything if we're skipping the album or we're
+            # done.
+            if task.sentinel or task.choice_flag == action.SKIP:
+                batch.add(task)
+                continue
+
+            # Deferred tasks go to the pending-decision store.
+            if task.choice_flag == action.DEFER:
+                if task.pending_key is None:
+                    pending_add(task.pending_entry())
+                batch.add(task)
+                continue
+
+            # Add items to library. The files have already been
+            # transferred and tagged by the transfer stage.
+            items = task.items if task.is_album else [task.item]
+            if task.should_create_album():
+                # Add an album.
+                albuminfo = lib.add_album(task.items,
+                                          infer_aa = task.should_infer_aa())
+            else:
+                # Add tracks.
+                for item in items:
+                    lib.add(item)
+
+            # Add the art found by the art stage.
+            if task.art_path and task.should_create_album():
+                albuminfo.set_art(task.art_path)
+
+            # Announce that we've added an album.
+            if task.should_create_album():
+                plugins.send('album_imported', lib=lib, album=albuminfo)
+            else:
+                # An album imported as tracks announces each item.
+                for item in items:
+                    plugins.send('item_imported', lib=lib, item=item)
+
+            # Finally, delete old files (once committed).
+            delete_paths = []
+            if config.copy and config.delete:
+                new_paths = [os.path.realpath(item.path) for item in items]
+                for old_path in task.old_paths:
+                    # Only delete files that were actually moved.
+                    if old_path not in new_paths:
+                        delete_paths.append(old_path)
+
+            # Update progress.
+            batch.add(task, delete_paths)
+
+    finally:
+        batch.commit()
 
 
 # Singleton pipeline stages.
 
 def read_items(config):
     """Reads individual items by recursively descending into a set of
-    directories. Generates ImportTask objects, each of which contains
-    a single item.
+    directories (and from the manifest, if any). Generates ImportTask
+    objects, each of which contains a single item.
     """
+    if config.watch:
+        for album in _settled_albums(config):
+            if album is pipeline.BUBBLE:
+                yield album
+            else:
+                _, items = album
+                yield pipeline.multiple(map(ImportTask.item_task, items))
+        return
+
     for toppath in config.paths:
         for path, items in autotag.albums_in_dir(toppath):
             for item in items:
                 yield ImportTask.item_task(item)
+    if config.manifest:
+        paths = manifest_paths(config.manifest)
+        for path, items in autotag.albums_from_paths(paths):
+            for item in items:
+                yield ImportTask.item_task(item)
 
 def item_lookup(config):
     """A coroutine used to perform the initial MusicBrainz lookup for
@@ -490,7 +1251,9 @@ def item_lookup(config):
     task = None
     while True:
         task = yield task
-        task.set_item_match(*autotag.tag_item(task.item))
+        task.set_item_match(*autotag.tag_item(
+            task.item, known_tracks=task.known_tracks
+        ))
 
 def item_query(config):
     """A coroutine that queries the user for input on single-item
@@ -517,18 +1280,49 @@ def item_progress(config):
 
 # Main driver.
 
+def _lookup_stage(func, config):
+    """Returns the pipeline stage for a lookup coroutine function: a
+    single coroutine or, if `config.lookup_threads` is more than one,
+    a tuple of coroutines to be run concurrently. The stage is marked
+    as blocking so that, when a worker pool is used, the lookups run
+    in the pool. If `config.lookup_timeout` is set, a threaded import
+    stops when a single lookup takes longer than that many seconds.
+    """
+    if config.lookup_threads > 1:
+        stage = tuple(func(config) for i in range(config.lookup_threads))
+    else:
+        stage = func(config)
+    stage = pipeline.blocking(stage)
+    if config.lookup_timeout:
+        stage = pipeline.time_limit(stage, config.lookup_timeout)
+    return stage
+
 def run_import(**kwargs):
     """Run an import. The keyword arguments are the same as those to
-    ImportConfig.
+    ImportConfig. Returns a list of `pipeline.StageStats` objects
+    describing the work done by each stage.
     """
     config = ImportConfig(**kwargs)
     
     # Set up the pipeline.
-    if config.singletons:
+    if config.apply_plan:
+        # Carry out the decisions recorded in a plan without looking
+        # anything up again.
+        stages = [read_plan(config)]
+    elif config.resolve:
+        # Work through the pending-decision store. No lookups are
+        # performed; the stored candidates are presented instead.
+        stages = [read_pending(config)]
+        if config.singletons:
+            stages += [item_query(config)]
+        else:
+            stages += [user_query(config)]
+    elif config.singletons:
         # Singleton importer.
         stages = [read_items(config)]
         if config.autot:
-            stages += [item_lookup(config), item_query(config)]
+            stages += [_lookup_stage(item_lookup, config),
+                       item_query(config)]
         else:
             stages += [item_progress(config)]
     else:
@@ -536,19 +1330,71 @@ def run_import(**kwargs):
         stages = [read_albums(config)]
         if config.autot:
             # Only look up and query the user when autotagging.
-            stages += [initial_lookup(config), user_query(config)]
+            stages += [_lookup_stage(initial_lookup, config),
+                       user_query(config)]
+            if config.tag_report:
+                csv.writer(config.tag_report).writerow(timing.REPORT_FIELDS)
         else:
             # When not autotagging, just display progress.
             stages += [show_progress(config)]
-    stages += [apply_choices(config)]
-    pl = pipeline.Pipeline(stages)
+    if config.plan:
+        stages += [plan_choices(config)]
+    else:
+        if config.art:
+            # Downloads overlap with the file transfers.
+            stages += [_art_stage(config)]
+        stages += [transfer_files(config)]
+        if config.commit_interval:
+            # Check the interval even when no tasks are arriving.
+            stages += [pipeline.idle(apply_choices(config),
+                                     config.commit_interval)]
+        else:
+            stages += [apply_choices(config)]
+    # Nobody is waiting at a prompt in quiet mode, so a stage that
+    # takes a long time is probably stuck.
+    if config.quiet:
+        pl = pipeline.Pipeline(stages, stall_time=STALL_TIME)
+    else:
+        pl = pipeline.Pipeline(stages)
+
+    # Candidates are evaluated in worker processes, which must be
+    # started before any threads are.
+    if config.autot and config.autotag_processes > 1:
+        autotag.start_pool(config.autotag_processes)
+
+    # Stop starting new albums once the time limit is up.
+    if config.time_limit:
+        timer = threading.Timer(config.time_limit, pl.cancel)
+        timer.setDaemon(True)
+        timer.start()
+    else:
+        timer = None
 
     # Run the pipeline.
     try:
-        if config.threaded:
-            pl.run_parallel(QUEUE_SIZE)
+        # Lookups running concurrently are put back in order so that
+        # progress is recorded correctly.
+        if config.threaded and config.pool_size:
+            # Share a few threads among many concurrent lookups.
+            pl.run_pooled(config.pool_size, QUEUE_SIZE, ordered=True)
+        elif config.threaded:
+            pl.run_parallel(QUEUE_SIZE, QUEUE_WEIGHT, _task_weight,
+                            adaptive=True, ordered=True)
         else:
             pl.run_sequential()
     except ImportAbort:
         # User aborted operation. Silently stop.
         pass
+    except pipeline.StageTimeout, exc:
+        log.error('Import stopped: %s' % exc)
+    finally:
+        autotag.stop_pool()
+    if config.resolve:
+        # Drop the decisions resolved by this run from the store.
+        pending_compact()
+    if timer:
+        timer.cancel()
+    if pl.cancelled:
+        log.warn('Import time limit reached; stopping.')
+
+    return pl.stats
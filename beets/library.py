@@ -235,14 +235,11 @@ class Item(object):
         # Create necessary ancestry for the move.
         util.mkdirall(dest)
         
-        if not shutil._samefile(syspath(self.path), syspath(dest)):
+        if not util.samefile(self.path, dest):
             if copy:
-                # copyfile rather than copy will not copy permissions
-                # bits, thus possibly making the copy writable even when
-                # the original is read-only.
-                shutil.copyfile(syspath(self.path), syspath(dest))
+                util.copy(self.path, dest)
             else:
-                shutil.move(syspath(self.path), syspath(dest))
+                util.move(self.path, dest)
             
         # Either copying or moving succeeded, so update the stored path.
         self.path = dest
@@ -45,6 +45,25 @@ class BeetsPlugin(object):
         """
         return 0.0, 0.0
 
+    def track_distance_matrix(self, items, tracks):
+        """Should return a pair of matrices (lists with a row for each
+        item and a column for each track) holding the distance and
+        distance_max values that `track_distance` gives for each pair.
+        Plugins that can share work between the comparisons should
+        override this; by default, `track_distance` is called for each
+        pair.
+        """
+        dist, dist_max = [], []
+        for item in items:
+            row, row_max = [], []
+            for info in tracks:
+                d, dm = self.track_distance(item, info)
+                row.append(d)
+                row_max.append(dm)
+            dist.append(row)
+            dist_max.append(row_max)
+        return dist, dist_max
+
     def album_distance(self, items, info):
         """Should return a (distance, distance_max) pair to be added
         to the distance value for every album-level comparison.
@@ -161,6 +180,30 @@ def track_distance(item, info):
         dist_max += dm
     return dist, dist_max
 
+def _overrides(plugin, name):
+    """Does the plugin override the named BeetsPlugin method?"""
+    return getattr(type(plugin), name).im_func is not \
+           getattr(BeetsPlugin, name).im_func
+
+def track_distance_matrix(items, tracks):
+    """Gets the track distances calculated by all loaded plugins for
+    each item and track. Returns a pair of matrices (see
+    `BeetsPlugin.track_distance_matrix`).
+    """
+    dist = [[0.0] * len(tracks) for item in items]
+    dist_max = [[0.0] * len(tracks) for item in items]
+    for plugin in find_plugins():
+        if not (_overrides(plugin, 'track_distance') or
+                _overrides(plugin, 'track_distance_matrix')):
+            continue
+        d, dm = plugin.track_distance_matrix(items, tracks)
+        for i in range(len(items)):
+            row, row_max, d_row, dm_row = dist[i], dist_max[i], d[i], dm[i]
+            for j in range(len(tracks)):
+                row[j] += d_row[j]
+                row_max[j] += dm_row[j]
+    return dist, dist_max
+
 def album_distance(items, info):
     """Returns the album distance calculated by plugins."""
     dist = 0.0
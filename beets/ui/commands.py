@@ -47,6 +47,16 @@ DEFAULT_IMPORT_ART            = True
 DEFAULT_IMPORT_QUIET          = False
 DEFAULT_IMPORT_QUIET_FALLBACK = 'skip'
 DEFAULT_IMPORT_RESUME         = None # "ask"
+DEFAULT_IMPORT_WATCH_SETTLE   = 30.0
+DEFAULT_IMPORT_COMMIT_EVERY   = 1
+DEFAULT_IMPORT_COMMIT_TIME    = 0.0
+DEFAULT_IMPORT_XFER_THREADS   = 4
+DEFAULT_IMPORT_XFER_PER_DEV   = 2
+DEFAULT_IMPORT_LOOKUP_THREADS = 1
+DEFAULT_IMPORT_POOL_SIZE      = 0
+DEFAULT_IMPORT_TIME_LIMIT     = 0.0
+DEFAULT_IMPORT_LOOKUP_TIMEOUT = 0.0
+DEFAULT_IMPORT_AUTOTAG_PROCS  = 0
 DEFAULT_THREADED              = True
 DEFAULT_COLOR                 = True
 
@@ -159,6 +169,8 @@ def _quiet_fall_back(config):
         print_('Skipping.')
     elif config.quiet_fallback == importer.action.ASIS:
         print_('Importing as-is.')
+    elif config.quiet_fallback == importer.action.DEFER:
+        print_('Deferring.')
     else:
         assert(False)
     return config.quiet_fallback
@@ -364,9 +376,9 @@ def choose_item(task, config):
 
     if config.quiet:
         # Quiet mode; make a decision.
-        if task.rec == autotag.RECOMMEND_STRONG:
+        if rec == autotag.RECOMMEND_STRONG:
             dist, track_info = candidates[0]
-            show_item_change(task.item.color)
+            show_item_change(task.item, track_info, dist, config.color)
             return track_info
         else:
             return _quiet_fall_back(config)
@@ -390,11 +402,67 @@ def choose_item(task, config):
             assert not isinstance(choice, importer.action)
             return choice
 
+def show_pipeline_stats(stats):
+    """Print a table summarizing the per-stage statistics (a list of
+    `pipeline.StageStats` objects) collected during an import.
+    """
+    print_()
+    print_('%-16s %8s %9s %9s %9s %10s' % ('Stage', 'Messages', 'Busy',
+                                           'In wait', 'Out wait', 'Queue'))
+    for stage in stats:
+        mean_depth = stage.mean_depth()
+        if mean_depth is None:
+            depth = '-'
+        else:
+            depth = '%.1f/%i' % (mean_depth, stage.depth_max)
+        print_('%-16s %8i %8.1fs %8.1fs %8.1fs %10s' % (
+            stage.name, stage.messages, stage.busy, stage.in_wait,
+            stage.out_wait, depth
+        ))
+
+def show_plan(planfile):
+    """Print the import plan read from the open file planfile. Each
+    file in the plan is printed on a line containing, separated by
+    tabs, its current path, its destination ("-" if it stays in
+    place), its size in bytes, and either "ok", "deferred", or the
+    kind of conflict at the destination. These are followed by a line for each
+    filesystem giving its mount point and the number of bytes to be
+    copied to it.
+    """
+    totals = {}
+    for entry in importer.plan_entries(planfile):
+        if entry['choice'] == 'DEFER':
+            status = 'deferred'
+        else:
+            status = 'ok'
+        for record, dest, size, mount, conflict in zip(
+                    entry['items'], entry['dests'], entry['sizes'],
+                    entry['mounts'], entry['conflicts']):
+            print_('\t'.join((record['path'], dest or '-', str(size),
+                              conflict or status)))
+            if mount is not None:
+                totals[mount] = totals.get(mount, 0) + size
+    for mount in sorted(totals):
+        print_('total\t%s\t%i' % (mount, totals[mount]))
+
 # The import command.
 
 def import_files(lib, paths, copy, write, autot, logpath, art, threaded,
                  color, delete, quiet, resume, quiet_fallback, singletons,
-                 interactive_autotag):
+                 interactive_autotag, resolve=False, manifest=None,
+                 watch=None, stats=False,
+                 commit_every=DEFAULT_IMPORT_COMMIT_EVERY,
+                 commit_interval=DEFAULT_IMPORT_COMMIT_TIME,
+                 transfer_threads=DEFAULT_IMPORT_XFER_THREADS,
+                 transfer_per_device=DEFAULT_IMPORT_XFER_PER_DEV,
+                 plan=None, apply_plan=None,
+                 lookup_threads=DEFAULT_IMPORT_LOOKUP_THREADS,
+                 pool_size=DEFAULT_IMPORT_POOL_SIZE,
+                 time_limit=DEFAULT_IMPORT_TIME_LIMIT,
+                 lookup_timeout=DEFAULT_IMPORT_LOOKUP_TIMEOUT,
+                 art_cache=beets.autotag.art.DEFAULT_CACHE_DIR,
+                 autotag_processes=DEFAULT_IMPORT_AUTOTAG_PROCS,
+                 tag_report=None):
     """Import the files in the given list of paths, tagging each leaf
     directory as an album. If copy, then the files are copied into
     the library folder. If write, then new metadata is written to the
@@ -408,8 +476,35 @@ def import_files(lib, paths, copy, write, autot, logpath, art, threaded,
     never prompted for input; instead, the tagger just skips anything
     it is not confident about. resume indicates whether interrupted
     imports can be resumed and is either a boolean or None.
-    quiet_fallback should be either ASIS or SKIP and indicates what
-    should happen in quiet mode when the recommendation is not strong.
+    quiet_fallback should be either ASIS, SKIP or DEFER and indicates
+    what should happen in quiet mode when the recommendation is not
+    strong. If resolve, then no paths are imported; instead, the
+    decisions deferred by earlier imports are presented to the user.
+    manifest may name a file (or "-" for standard input) listing the
+    paths of files to import in addition to the directories in paths.
+    If watch is a number, then the import runs until it is interrupted,
+    importing each directory under paths once its contents have not
+    changed for that many seconds. If stats, then a summary of the
+    time spent in each stage of the importer is shown at the end.
+    Changes to the database are committed after every commit_every
+    albums or commit_interval seconds (zero disables either limit).
+    In threaded mode, up to transfer_threads files are copied at once,
+    with at most transfer_per_device of them written to each device.
+    If plan names a file, then nothing is changed; instead, the
+    decisions made and the destination of each file are saved there
+    and printed. apply_plan may name such a file to import exactly as
+    it describes, in which case paths must be empty. In threaded
+    mode, lookup_threads albums are looked up at once. If pool_size
+    is nonzero, then the lookups share that many threads and the rest
+    of the import runs in the current thread. If time_limit is
+    nonzero, then no new albums are started after that many seconds.
+    In threaded mode, the import stops if a single lookup takes longer
+    than lookup_timeout seconds (if nonzero). Downloaded art is kept in
+    the directory art_cache (unless it is None) and reused by later
+    imports. If autotag_processes is more than one, then that many
+    processes evaluate the candidates for each album. If tag_report
+    names a file, then a CSV table of the time spent tagging each
+    album and of the queries and candidates involved is written there.
     """
     # Check the user-specified directories.
     for path in paths:
@@ -426,8 +521,53 @@ def import_files(lib, paths, copy, write, autot, logpath, art, threaded,
     if resume is None and quiet:
         resume = False
 
+    # Resolving deferred decisions has nothing to resume.
+    if resolve:
+        resume = False
+
+    # Open the manifest. Manifests are streams with no top-level
+    # directory to record progress against, so resuming is disabled.
+    if manifest == '-':
+        manifestfile = sys.stdin
+    elif manifest:
+        try:
+            manifestfile = open(syspath(manifest), 'rb')
+        except IOError, exc:
+            raise ui.UserError('could not open manifest: %s' % exc)
+    else:
+        manifestfile = None
+    if manifestfile or watch:
+        resume = False
+
+    # Open the plan to write or to carry out. Neither records progress.
+    if plan:
+        try:
+            planfile = open(syspath(plan), 'wb')
+        except IOError, exc:
+            raise ui.UserError('could not write plan: %s' % exc)
+        resume = False
+    else:
+        planfile = None
+    if apply_plan:
+        try:
+            applyfile = open(syspath(apply_plan), 'rb')
+        except IOError, exc:
+            raise ui.UserError('could not open plan: %s' % exc)
+        resume = False
+    else:
+        applyfile = None
+
+    # Open the tagging report.
+    if tag_report:
+        try:
+            reportfile = open(syspath(tag_report), 'wb')
+        except IOError, exc:
+            raise ui.UserError('could not write tagging report: %s' % exc)
+    else:
+        reportfile = None
+
     # Perform the import.
-    importer.run_import(
+    pipeline_stats = importer.run_import(
         lib = lib,
         paths = paths,
         resume = resume,
@@ -446,14 +586,47 @@ def import_files(lib, paths, copy, write, autot, logpath, art, threaded,
         singletons = singletons,
         interactive_autotag = interactive_autotag,
         choose_item_func = choose_item,
+        resolve = resolve,
+        manifest = manifestfile,
+        watch = watch,
+        commit_every = commit_every,
+        commit_interval = commit_interval,
+        transfer_threads = transfer_threads,
+        transfer_per_device = transfer_per_device,
+        plan = planfile,
+        apply_plan = applyfile,
+        lookup_threads = lookup_threads,
+        pool_size = pool_size,
+        time_limit = time_limit,
+        lookup_timeout = lookup_timeout,
+        art_cache = art_cache,
+        autotag_processes = autotag_processes,
+        tag_report = reportfile,
     )
     
     # If we were logging, close the file.
     if logfile:
         logfile.close()
-
-    # Emit event.
-    plugins.send('import', lib=lib, paths=paths)
+    if manifestfile and manifestfile is not sys.stdin:
+        manifestfile.close()
+    if applyfile:
+        applyfile.close()
+    if reportfile:
+        reportfile.close()
+    if planfile:
+        planfile.close()
+        planfile = open(syspath(plan), 'rb')
+        try:
+            show_plan(planfile)
+        finally:
+            planfile.close()
+
+    if stats:
+        show_pipeline_stats(pipeline_stats)
+
+    # Emit event (unless nothing was imported).
+    if not plan:
+        plugins.send('import', lib=lib, paths=paths)
 
 import_cmd = ui.Subcommand('import', help='import new music',
     aliases=('imp', 'im'))
@@ -480,6 +653,23 @@ import_cmd.parser.add_option('-R', '--noart', action='store_false',
     dest='art', help="don't album art (opposite of -r)")
 import_cmd.parser.add_option('-q', '--quiet', action='store_true',
     dest='quiet', help="never prompt for input: skip albums instead")
+import_cmd.parser.add_option('--defer', action='store_true',
+    help="never prompt for input: save uncertain albums for --resolve")
+import_cmd.parser.add_option('--resolve', action='store_true',
+    help="decide on the albums deferred by earlier imports")
+import_cmd.parser.add_option('-m', '--manifest', dest='manifest',
+    help='import the files listed (one per line or NUL-separated) in '
+         'a manifest file; use - for standard input')
+import_cmd.parser.add_option('--watch', action='store_true',
+    help='keep running and import directories as their contents settle')
+import_cmd.parser.add_option('--plan', dest='plan',
+    help='save and show what the import would do without changing anything')
+import_cmd.parser.add_option('--apply-plan', dest='apply_plan',
+    help='import as described by a plan saved with --plan')
+import_cmd.parser.add_option('--stats', action='store_true',
+    help='show how much time each stage of the importer took')
+import_cmd.parser.add_option('--tag-report', dest='tag_report',
+    help='write a table of the time spent tagging each album to a CSV file')
 import_cmd.parser.add_option('-l', '--log', dest='logpath',
     help='file to log untaggable albums for later review')
 import_cmd.parser.add_option('-s', '--singletons', action='store_true',
@@ -523,10 +713,93 @@ def import_func(lib, config, opts, args):
 
     if quiet_fallback_str == 'asis':
         quiet_fallback = importer.action.ASIS
+    elif quiet_fallback_str == 'defer':
+        quiet_fallback = importer.action.DEFER
     else:
         quiet_fallback = importer.action.SKIP
+
+    # Deferred mode is a quiet mode that saves decisions for later.
+    if opts.defer:
+        quiet = True
+        quiet_fallback = importer.action.DEFER
+    if opts.resolve:
+        if args:
+            raise ui.UserError('--resolve does not take any paths')
+        quiet = False
+        if opts.manifest:
+            raise ui.UserError('--resolve does not take a manifest')
+
+    # Plans are made from a finite set of albums and carried out
+    # without any lookups.
+    if opts.plan and opts.watch:
+        raise ui.UserError('--plan cannot be used with --watch')
+    if opts.apply_plan:
+        if args:
+            raise ui.UserError('--apply-plan does not take any paths')
+        if opts.manifest:
+            raise ui.UserError('--apply-plan does not take a manifest')
+        if opts.resolve:
+            raise ui.UserError('--apply-plan cannot be used with --resolve')
+        if opts.plan:
+            raise ui.UserError('--apply-plan cannot be used with --plan')
+
+    # Watch mode: the settle time comes from the configuration.
+    if opts.watch:
+        if opts.manifest:
+            raise ui.UserError('--watch does not take a manifest')
+        watch = float(ui.config_val(config, 'beets', 'import_watch_settle',
+                                    DEFAULT_IMPORT_WATCH_SETTLE))
+    else:
+        watch = None
+
+    # Transaction batching.
+    commit_every = int(ui.config_val(config, 'beets', 'import_commit_every',
+                                     DEFAULT_IMPORT_COMMIT_EVERY))
+    commit_interval = float(ui.config_val(config, 'beets',
+                                          'import_commit_interval',
+                                          DEFAULT_IMPORT_COMMIT_TIME))
+
+    # File transfer concurrency.
+    transfer_threads = int(ui.config_val(config, 'beets',
+                                         'import_transfer_threads',
+                                         DEFAULT_IMPORT_XFER_THREADS))
+    transfer_per_device = int(ui.config_val(config, 'beets',
+                                            'import_transfer_per_device',
+                                            DEFAULT_IMPORT_XFER_PER_DEV))
+    lookup_threads = int(ui.config_val(config, 'beets',
+                                       'import_lookup_threads',
+                                       DEFAULT_IMPORT_LOOKUP_THREADS))
+    pool_size = int(ui.config_val(config, 'beets', 'import_pool_size',
+                                  DEFAULT_IMPORT_POOL_SIZE))
+
+    # Time limits for the whole import and for each lookup.
+    time_limit = float(ui.config_val(config, 'beets', 'import_time_limit',
+                                     DEFAULT_IMPORT_TIME_LIMIT))
+    lookup_timeout = float(ui.config_val(config, 'beets',
+                                         'import_lookup_timeout',
+                                         DEFAULT_IMPORT_LOOKUP_TIMEOUT))
+
+    # Where to keep downloaded art (an empty value disables the cache).
+    art_cache = ui.config_val(config, 'beets', 'import_art_cache',
+                              beets.autotag.art.DEFAULT_CACHE_DIR)
+    if art_cache:
+        art_cache = os.path.expanduser(art_cache)
+    else:
+        art_cache = None
+
+    # Worker processes for evaluating candidates.
+    autotag_processes = int(ui.config_val(config, 'beets',
+                                          'import_autotag_processes',
+                                          DEFAULT_IMPORT_AUTOTAG_PROCS))
+
     import_files(lib, args, copy, write, autot, opts.logpath, art, threaded,
-                 color, delete, quiet, resume, quiet_fallback, singletons, interactive_autotag)
+                 color, delete, quiet, resume, quiet_fallback, singletons,
+                 interactive_autotag, opts.resolve, opts.manifest, watch,
+                 opts.stats, commit_every, commit_interval,
+                 transfer_threads, transfer_per_device, opts.plan,
+                 opts.apply_plan, lookup_threads, pool_size, time_limit,
+                 lookup_timeout, art_cache, autotag_processes,
+                 opts.tag_report)
 import_cmd.func = import_func
 default_commands.append(import_cmd)
 
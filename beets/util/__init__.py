@@ -16,6 +16,7 @@
 import os
 import sys
 import re
+import shutil
 
 MAX_FILENAME_LENGTH = 200
 
@@ -74,13 +75,106 @@ def sorted_walk(path):
         for res in sorted_walk(cur):
             yield res
 
+MANIFEST_CHUNK_SIZE = 4096
+def manifest_paths(fh):
+    """Reads a manifest of file paths from the file-like object fh and
+    yields each path in normalized form. Paths are separated by NUL
+    characters if any appear in the input read by the time the first
+    NUL or newline arrives and by newlines otherwise. Input is read
+    incrementally so that paths are produced as they arrive on a pipe.
+    """
+    try:
+        fd = fh.fileno()
+    except (AttributeError, IOError, ValueError):
+        # Not backed by a real file (e.g., a StringIO).
+        fd = None
+
+    sep = None
+    buf = ''
+    while True:
+        if fd is None:
+            chunk = fh.read(MANIFEST_CHUNK_SIZE)
+        else:
+            # Unlike read(), this returns whatever is available
+            # instead of waiting for a full chunk.
+            chunk = os.read(fd, MANIFEST_CHUNK_SIZE)
+        buf += chunk
+        if sep is None:
+            # Wait for the first separator (or the end of the input)
+            # before deciding which kind is used.
+            if '\0' in buf:
+                sep = '\0'
+            elif '\n' in buf or not chunk:
+                sep = '\n'
+            else:
+                continue
+
+        # Emit all complete entries (and the remainder at EOF).
+        if chunk:
+            parts = buf.split(sep)
+            buf = parts.pop()
+        else:
+            parts = [buf]
+        for part in parts:
+            if sep == '\n':
+                part = part.rstrip('\r')
+            if part:
+                yield normpath(part)
+
+        if not chunk:
+            break
+
 def mkdirall(path):
     """Make all the enclosing directories of path (like mkdir -p on the
     parent).
     """
     for ancestor in ancestry(path):
         if not os.path.isdir(syspath(ancestor)):
-            os.mkdir(syspath(ancestor))
+            try:
+                os.mkdir(syspath(ancestor))
+            except OSError:
+                # Another thread may have created it in the meantime.
+                if not os.path.isdir(syspath(ancestor)):
+                    raise
+
+def samefile(path1, path2):
+    """Returns whether the two paths refer to the same file."""
+    try:
+        return os.path.samefile(syspath(path1), syspath(path2))
+    except (OSError, AttributeError):
+        # Missing file or no samefile() (on Windows).
+        return normpath(path1) == normpath(path2)
+
+COPY_BUFFER_SIZE = 1024 * 1024
+def copy(path, dest):
+    """Copy the contents of the file at path to dest. Permission bits
+    are not copied, so the copy is writable even when the original is
+    read-only. Large buffers are used to keep the number of system
+    calls (and disk seeks when copying between devices) low.
+    """
+    fsrc = open(syspath(path), 'rb')
+    try:
+        fdst = open(syspath(dest), 'wb')
+        try:
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+
+def move(path, dest):
+    """Move the file at path to dest. This is a rename when both are
+    on the same filesystem and a copy followed by a deletion
+    otherwise. Either way, the file keeps its permissions and
+    modification time.
+    """
+    try:
+        os.rename(syspath(path), syspath(dest))
+    except OSError:
+        # Probably a cross-device move.
+        copy(path, dest)
+        shutil.copystat(syspath(path), syspath(dest))
+        os.remove(syspath(path))
 
 def prune_dirs(path, root):
     """If path is an empty directory, then remove it. Recursively
@@ -229,24 +323,136 @@ def str2bool(value):
     else:
         return False
 
-def levenshtein(s1, s2):
-    """A nice DP edit distance implementation from Wikibooks:
-    http://en.wikibooks.org/wiki/Algorithm_implementation/Strings/
-    Levenshtein_distance#Python
+def levenshtein(s1, s2, limit=None):
+    """Returns the edit distance between two strings. If limit is
+    given, the computation may stop as soon as it is clear that the
+    distance is greater than limit, in which case limit + 1 is
+    returned.
+
+    This uses the bit-parallel algorithm of Myers (in Hyyro's
+    formulation for edit distance), with Python's integers as bit
+    vectors, so the work grows with the length of the longer string
+    only (for strings of reasonable length).
     """
     if len(s1) < len(s2):
-        return levenshtein(s2, s1)
-    if not s1:
-        return len(s2)
- 
-    previous_row = xrange(len(s2) + 1)
-    for i, c1 in enumerate(s1):
-        current_row = [i + 1]
-        for j, c2 in enumerate(s2):
-            insertions = previous_row[j + 1] + 1
-            deletions = current_row[j] + 1
-            substitutions = previous_row[j] + (c1 != c2)
-            current_row.append(min(insertions, deletions, substitutions))
-        previous_row = current_row
- 
-    return previous_row[-1]
+        s1, s2 = s2, s1
+    if limit is not None and len(s1) - len(s2) > limit:
+        return limit + 1
+    if not s2:
+        return len(s1)
+
+    # The shorter string is the "pattern": bit i of peq[c] is set if
+    # the pattern's ith character is c.
+    peq = {}
+    bit = 1
+    for c in s2:
+        peq[c] = peq.get(c, 0) | bit
+        bit <<= 1
+    mask = bit - 1
+    last = bit >> 1
+
+    # Vertical positive and negative deltas, and the distance between
+    # the pattern and the prefix of s1 processed so far.
+    pv = mask
+    mv = 0
+    score = len(s2)
+    remaining = len(s1)
+    for c in s1:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+
+        # Each remaining character lowers the score by at most one.
+        remaining -= 1
+        if limit is not None and score - remaining > limit:
+            return limit + 1
+
+    return score
+
+def assignment(costs):
+    """Solves the assignment problem for a square cost matrix, given
+    as a list of rows. Returns a list of (row, column) pairs, one for
+    each row in order, that uses every column once and has the
+    smallest total cost.
+
+    When every row's cheapest column is on the diagonal, or the rows'
+    cheapest columns are all different, that matching is returned
+    right away. Otherwise, this is the Hungarian algorithm in its
+    shortest-augmenting-path form, which takes O(n^3) time and does
+    not copy the matrix.
+    """
+    n = len(costs)
+
+    # Short cuts: each row can simply take its cheapest column. Prefer
+    # the diagonal among equally cheap choices.
+    cols = []
+    for i, row in enumerate(costs):
+        best = min(row)
+        if row[i] == best:
+            cols.append(i)
+        else:
+            cols.append(row.index(best))
+    if len(set(cols)) == n:
+        return list(enumerate(cols))
+
+    # Row and column potentials, the row assigned to each column, and
+    # the previous column on the augmenting path. Index 0 stands for
+    # a dummy column from which each path starts.
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (n + 1)
+    match = [0] * (n + 1)
+    way = [0] * (n + 1)
+    columns = range(1, n + 1)
+    for i in xrange(1, n + 1):
+        match[0] = i
+        j0 = 0
+        minv = [inf] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            # Grow the tree of alternating paths by its cheapest edge.
+            used[j0] = True
+            i0 = match[j0]
+            row = costs[i0 - 1]
+            ui0 = u[i0]
+            delta = inf
+            j1 = 0
+            for j in columns:
+                if not used[j]:
+                    cur = row[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in xrange(n + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if not match[j0]:
+                break
+
+        # Augment along the path to the free column.
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    out = [None] * n
+    for j in columns:
+        out[match[j] - 1] = j - 1
+    return list(enumerate(out))
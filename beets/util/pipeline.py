@@ -16,6 +16,10 @@
 pipelines in Python. The pipelines may be run either sequentially
 (single-threaded) or in parallel (one thread per pipeline stage).
 
+When the pipeline finishes (or is aborted), each stage's coroutine
+is closed, so stages may use `try`/`finally` to release resources or
+flush buffered work.
+
 This implementation supports pipeline bubbles (indications that the
 processing for a certain item should abort). To use them, yield the
 BUBBLE constant from any stage coroutine except the last.
@@ -28,19 +32,106 @@ When running a parallel pipeline, it is also possible to use
 multiple coroutines for the same pipeline stage; this lets you speed
 up a bottleneck stage by dividing its work among multiple threads.
 To do so, pass an iterable of coroutines to the Pipeline constructor
-in place of any single coroutine.
+in place of any single coroutine. Such a stage emits messages in the
+order in which its threads finish with them unless the pipeline is
+run in "ordered" mode, in which case the messages entering the stage
+are numbered and its output is put back into the original order
+(using a reorder buffer of bounded size).
+
+Stages other than the first may also process messages in batches.
+The coroutines of a stage marked with `batched` are sent lists of
+messages rather than single messages and yield lists of messages to
+be sent on. A batch is sent as soon as it is full or when its first
+message has waited for the stage's "linger" time, whichever comes
+first. Batching amortizes the cost of passing messages between
+threads and lets a stage do work in bulk (e.g., one lookup or
+database transaction for several messages). In ordered mode, the
+threads of a batched stage take turns collecting their batches so
+that each batch is a run of consecutive messages.
+
+A third way to run a pipeline, `run_pooled`, is suited to stages that
+spend most of their time waiting (on the network, for instance) and
+that are split among many coroutines. Stages marked with `blocking`
+are run by a fixed pool of worker threads shared among all of their
+coroutines, so a coroutine only occupies a thread while it handles a
+message; the other stages are run, one message at a time, by the
+thread that called `run_pooled`. (This is an event loop in the style
+of asyncio with blocking work offloaded to an executor, written with
+threads because generators cannot be suspended in the middle of a
+blocking call.) As with the other runners, each coroutine only
+handles one message at a time.
+
+A stage other than the first may be marked with `idle` to be sent the
+IDLE constant when no message has reached it for a while, so that it
+can do periodic work (e.g., flushing buffered results) even when the
+pipeline is waiting for input. Coroutines should yield nothing in
+response to IDLE.
+
+A running pipeline can be cancelled (from any thread) with `cancel`:
+the first stage stops producing messages, the middle stages finish
+the message they are handling and drop the messages still waiting for
+them, and the last stage handles every message that reaches it (the
+earlier stages' work on those messages, such as moving a file, may
+not be undoable). Then the stages shut down normally (so their
+coroutines can commit any outstanding work when they are closed).
+A stage can also be given a
+time limit for each message with `time_limit`; a watchdog thread
+notices when the limit is exceeded, logs the stuck thread's stack, and
+makes a parallel pipeline stop with a StageTimeout exception. (Python
+threads cannot be killed, so the stuck thread is abandoned.) The
+watchdog can also report, without stopping anything, messages that
+take longer than a "stall time."
+
+Pipelines keep per-stage statistics (messages processed, time spent
+working, time spent blocked on the input and output queues, and the
+depth of the queue feeding each stage). They are available from
+`Pipeline.stats` and may also be passed periodically to a monitor
+callback while the pipeline runs.
+
+The queues between the stages of a parallel pipeline can be bounded
+by the total "weight" of the messages they hold (as estimated by a
+function supplied by the caller) in addition to the number of
+messages. They can also be sized adaptively: each queue is shrunk or
+grown so that it holds about as many messages as the following stage
+consumes in `ADAPT_HORIZON` seconds. This keeps memory use in check
+when a stage stalls (while waiting for user input, for example).
 """
 from __future__ import with_statement # for Python 2.5
 import Queue
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition, currentThread
+from thread import get_ident
+from collections import deque
 import sys
+import time
 import types
+import math
+import logging
+import traceback
 
 BUBBLE = '__PIPELINE_BUBBLE__'
 POISON = '__PIPELINE_POISON__'
+IDLE = '__PIPELINE_IDLE__'
 
 DEFAULT_QUEUE_SIZE = 16
 
+# How often (in seconds) queue depths are sampled and the monitor is
+# called in parallel pipelines.
+SAMPLE_INTERVAL = 1.0
+
+# How often (in seconds) the watchdog checks for stalled stages.
+WATCHDOG_INTERVAL = 1.0
+
+# Adaptive queues hold enough messages for about this many seconds of
+# work in the following stage, but never fewer than ADAPT_MIN.
+ADAPT_HORIZON = 30.0
+ADAPT_MIN = 2
+
+# Global logger.
+log = logging.getLogger('beets')
+
+class StageTimeout(Exception):
+    """Raised when a pipeline stage exceeds its time limit."""
+
 def _invalidate_queue(q, val=None, sync=True):
     """Breaks a Queue such that it never blocks, always has size 1,
     and has no maximum size. get()ing from the queue returns `val`,
@@ -59,11 +150,13 @@ def _invalidate_queue(q, val=None, sync=True):
 
     try:
         q.maxsize = 0
+        q.max_weight = 0
         q._qsize = _qsize
         q._put = _put
         q._get = _get
-        q.not_empty.notify()
-        q.not_full.notify()
+        # Several threads (of a multi-coroutine stage) may be waiting.
+        q.not_empty.notifyAll()
+        q.not_full.notifyAll()
 
     finally:
         if sync:
@@ -73,11 +166,73 @@ class CountedQueue(Queue.Queue):
     """A queue that keeps track of the number of threads that are
     still feeding into it. The queue is poisoned when all threads are
     finished with the queue.
+
+    In addition to `maxsize`, the queue may be bounded by the total
+    weight of its contents: if `weigh` is a function that estimates
+    the weight of a message, put() blocks while adding the message
+    would bring the total above `max_weight` (a zero value disables
+    the limit). An empty queue always accepts a message, however
+    heavy.
     """
-    def __init__(self, maxsize=0):
+    def __init__(self, maxsize=0, max_weight=0, weigh=None):
         Queue.Queue.__init__(self, maxsize)
         self.nthreads = 0
         self.poisoned = False
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self.weights = deque()
+
+        # When set, messages are stored as (sequence number, message)
+        # pairs. Used for the input of reordering stages.
+        self.sequenced = False
+        self.seq = 0
+
+    def _full(self, weight):
+        if not self.queue:
+            return False
+        if self.maxsize > 0 and len(self.queue) >= self.maxsize:
+            return True
+        if self.max_weight > 0 and self.weight + weight > self.max_weight:
+            return True
+        return False
+
+    def put(self, item, block=True, timeout=None):
+        """Put an item into the queue, blocking until there is room
+        for it. (Non-blocking puts and timeouts are not supported.)
+        """
+        if self.weigh:
+            weight = self.weigh(item)
+        else:
+            weight = 0
+        with self.not_full:
+            while self._full(weight):
+                self.not_full.wait()
+            if self.sequenced:
+                item = (self.seq, item)
+                self.seq += 1
+            self._put(item)
+            self.weights.append(weight)
+            self.weight += weight
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _get(self):
+        item = Queue.Queue._get(self)
+        if self.weights:
+            self.weight -= self.weights.popleft()
+        # Removing a heavy message may make room for several others.
+        self.not_full.notifyAll()
+        return item
+
+    def resize(self, maxsize):
+        """Change the maximum number of messages in the queue. Has no
+        effect on unbounded (or invalidated) queues.
+        """
+        with self.mutex:
+            if self.maxsize > 0:
+                self.maxsize = maxsize
+                self.not_full.notifyAll()
 
     def acquire(self):
         """Indicate that a thread will start putting into this queue.
@@ -116,6 +271,230 @@ class CountedQueue(Queue.Queue):
                     # No items. Invalidate immediately.
                     _invalidate_queue(self, POISON, False)
 
+class Reorderer(object):
+    """Restores the order of the messages produced by the threads of a
+    multi-threaded stage before they are sent on to `out_queue`. The
+    stage's input messages are numbered in order; for each, a thread
+    hands the list of resulting messages to `put` along with its
+    number. Results that arrive early are held until all the earlier
+    ones are in. At most `size` results are buffered: a thread that
+    finishes a message too far ahead of the others waits.
+    """
+    def __init__(self, out_queue, size):
+        self.out_queue = out_queue
+        self.size = size
+        self.cond = Condition()
+        self.next = 0
+        self.pending = {}
+        self.aborted = False
+
+    def put(self, seq, msgs, count=1):
+        """Submit the list of messages produced for input message
+        number seq (and, for batches, the count-1 messages following
+        it). Returns False if the reorderer was aborted.
+        """
+        with self.cond:
+            while seq >= self.next + self.size and not self.aborted:
+                self.cond.wait()
+            if self.aborted:
+                return False
+            self.pending[seq] = (msgs, count)
+
+            # Send on every result that is now in order.
+            while self.next in self.pending:
+                msgs, count = self.pending.pop(self.next)
+                for msg in msgs:
+                    self.out_queue.put(msg)
+                self.next += count
+            self.cond.notifyAll()
+        return True
+
+    def abort(self):
+        """Wake any waiting threads and stop accepting results."""
+        with self.cond:
+            self.aborted = True
+            self.cond.notifyAll()
+
+class WorkerPool(object):
+    """A fixed set of daemon threads that call the functions submitted
+    to it.
+    """
+    def __init__(self, size):
+        self.jobs = Queue.Queue()
+        self.threads = []
+        for i in range(size):
+            thread = Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            func, args = job
+            func(*args)
+
+    def submit(self, func, *args):
+        """Call func(*args) in one of the pool's threads."""
+        self.jobs.put((func, args))
+
+    def close(self):
+        """Stop the threads once they have finished the work already
+        submitted.
+        """
+        for thread in self.threads:
+            self.jobs.put(None)
+
+class BlockingStage(object):
+    """A pipeline stage whose coroutines make blocking calls. See
+    `blocking`.
+    """
+    def __init__(self, stage):
+        self.stage = stage
+def blocking(stage):
+    """Mark a pipeline stage (a coroutine or an iterable of coroutines)
+    as blocking. When the pipeline is run with `run_pooled`, such
+    stages are run in the worker pool. The other runners ignore the
+    mark.
+    """
+    return BlockingStage(stage)
+
+class BatchStage(object):
+    """A pipeline stage that processes messages in batches. See
+    `batched`.
+    """
+    def __init__(self, stage, size, linger=0.0):
+        self.stage = stage
+        self.size = size
+        self.linger = linger
+def batched(stage, size, linger=0.0):
+    """Mark a pipeline stage (other than the first) as processing
+    batches of up to size messages. A batch is sent to the stage when
+    it is full or when its first message has waited for linger
+    seconds. The stage may also be marked with `blocking`.
+    """
+    return BatchStage(stage, size, linger)
+
+class TimedStage(object):
+    """A pipeline stage with a per-message time limit. See
+    `time_limit`.
+    """
+    def __init__(self, stage, seconds):
+        self.stage = stage
+        self.seconds = seconds
+def time_limit(stage, seconds):
+    """Limit the time a pipeline stage may spend on a single message
+    (or batch) to the given number of seconds. Only parallel pipelines
+    are stopped when the limit is exceeded; the other runners just log
+    a warning.
+    """
+    return TimedStage(stage, seconds)
+
+class IdleStage(object):
+    """A pipeline stage that is woken up when it has no messages. See
+    `idle`.
+    """
+    def __init__(self, stage, seconds):
+        self.stage = stage
+        self.seconds = seconds
+def idle(stage, seconds):
+    """Mark a pipeline stage (other than the first) to be sent IDLE
+    whenever it has received no message (or IDLE) for the given
+    number of seconds. When the pipeline is run sequentially, this
+    happens only between the messages of the first stage (including
+    its bubbles), since nothing else runs while a stage is busy.
+    """
+    return IdleStage(stage, seconds)
+
+class Supervisor(object):
+    """Tracks what each thread of a running pipeline is working on,
+    holds the pipeline's cancellation flag, and runs the watchdog
+    thread. `names` are the stage names, `limits` maps stage indices to
+    time limits, and on_timeout is called with the StageTimeout
+    exception (from the watchdog thread) when a limit is exceeded.
+    """
+    def __init__(self, names, limits=None, stall_time=None,
+                 on_timeout=None):
+        self.names = names
+        self.limits = limits or {}
+        self.stall_time = stall_time
+        self.on_timeout = on_timeout
+        self.cancelled = False
+        self.timed_out = None # The stuck thread.
+        self.lock = Lock()
+        # Maps threads to [stage, start time, reported, identifier].
+        self.active = {}
+        self.stopped = False
+        self.thread = None
+
+    def begin(self, stage):
+        """Note that the current thread started working on a message
+        for the given stage (an index).
+        """
+        with self.lock:
+            self.active[currentThread()] = [stage, time.time(), False,
+                                            get_ident()]
+
+    def end(self):
+        """Note that the current thread has finished its message."""
+        with self.lock:
+            self.active.pop(currentThread(), None)
+
+    def start(self):
+        """Start the watchdog thread, if there is anything to watch
+        for.
+        """
+        if self.limits or self.stall_time:
+            self.thread = Thread(target=self._watch)
+            self.thread.setDaemon(True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the watchdog thread."""
+        self.stopped = True
+        if self.thread:
+            self.thread.join()
+
+    def _watch(self):
+        while not self.stopped:
+            time.sleep(WATCHDOG_INTERVAL)
+            self.check()
+
+    def check(self):
+        """Report stalled threads and handle exceeded time limits."""
+        now = time.time()
+        with self.lock:
+            active = self.active.items()
+        for thread, entry in active:
+            stage, start, reported, ident = entry
+            elapsed = now - start
+            limit = self.limits.get(stage)
+            if limit and elapsed > limit and self.timed_out is None:
+                self.timed_out = thread
+                log.error('Stage %s exceeded its time limit of %.1fs:\n%s' %
+                          (self.names[stage], limit, _stack(ident)))
+                if self.on_timeout:
+                    self.on_timeout(StageTimeout(
+                        'stage %s took more than %.1f seconds' %
+                        (self.names[stage], limit)
+                    ))
+            elif self.stall_time and elapsed > self.stall_time and \
+                 not reported:
+                entry[2] = True
+                log.warn('Stage %s has been busy for %.1fs:\n%s' %
+                         (self.names[stage], elapsed, _stack(ident)))
+
+def _stack(ident):
+    """Returns a formatted stack trace for the running thread with the
+    given identifier.
+    """
+    frame = sys._current_frames().get(ident)
+    if frame is None:
+        return ''
+    return ''.join(traceback.format_stack(frame))
+
 class MultiMessage(object):
     """A message yielded by a pipeline stage encapsulating multiple
     values to be sent to the next stage.
@@ -140,6 +519,72 @@ def _allmsgs(obj):
     else:
         return [obj]
 
+def _batchmsgs(obj):
+    """Returns a list of all the messages in a batched stage's output,
+    which is a list of messages (or None).
+    """
+    if obj is None:
+        return []
+    out = []
+    for msg in obj:
+        out.extend(_allmsgs(msg))
+    return out
+
+def _close(coro):
+    """Close a stage coroutine (if it is a generator) so that it can
+    run its cleanup code.
+    """
+    if hasattr(coro, 'close'):
+        coro.close()
+
+class StageStats(object):
+    """Accumulates timing and throughput information for a pipeline
+    stage (or for one of the threads running a stage). All times are
+    in seconds.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.messages = 0    # Messages received (or produced, if first).
+        self.busy = 0.0      # Time spent running the coroutine.
+        self.in_wait = 0.0   # Time spent blocked on the input queue.
+        self.out_wait = 0.0  # Time spent blocked on the output queue.
+
+        # Samples of the input queue's depth.
+        self.depth = 0
+        self.depth_max = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+
+    def sample_depth(self, depth):
+        """Record the current depth of the stage's input queue."""
+        self.depth = depth
+        self.depth_max = max(self.depth_max, depth)
+        self.depth_total += depth
+        self.depth_samples += 1
+
+    def mean_depth(self):
+        """The average sampled input queue depth (or None if the
+        queue was never sampled).
+        """
+        if self.depth_samples:
+            return self.depth_total / float(self.depth_samples)
+
+    def add(self, other):
+        """Add another StageStats' counters to this one's."""
+        self.messages += other.messages
+        self.busy += other.busy
+        self.in_wait += other.in_wait
+        self.out_wait += other.out_wait
+
+    def __repr__(self):
+        return 'StageStats(%s: %i messages, %.3fs busy, %.3fs in, ' \
+               '%.3fs out)' % (self.name, self.messages, self.busy,
+                               self.in_wait, self.out_wait)
+
+def _stage_name(coro, index):
+    """Returns a descriptive name for a stage coroutine."""
+    return getattr(coro, '__name__', None) or 'stage %i' % index
+
 class PipelineThread(Thread):
     """Abstract base class for pipeline-stage threads."""
     def __init__(self, all_threads):
@@ -148,6 +593,13 @@ class PipelineThread(Thread):
         self.abort_flag = False
         self.all_threads = all_threads
         self.exc_info = None
+        self.stats = StageStats(None)
+        self.batch = None
+        self.batch_lock = None
+        self.idle = None
+        self.index = None
+        self.supervisor = None
+        self.setDaemon(True)
 
     def abort(self):
         """Shut down the thread at the next chance possible.
@@ -160,6 +612,8 @@ class PipelineThread(Thread):
                 _invalidate_queue(self.in_queue)
             if hasattr(self, 'out_queue'):
                 _invalidate_queue(self.out_queue)
+            if getattr(self, 'reorderer', None):
+                self.reorderer.abort()
 
     def abort_all(self, exc_info):
         """Abort all other threads in the system for an exception.
@@ -168,6 +622,89 @@ class PipelineThread(Thread):
         for thread in self.all_threads:
             thread.abort()
 
+    def run(self):
+        try:
+            self._run()
+        finally:
+            # Give the coroutine a chance to clean up (in a finally
+            # clause or by catching GeneratorExit).
+            try:
+                _close(self.coro)
+            except:
+                self.abort_all(sys.exc_info())
+
+    def _run(self):
+        """Run the stage's coroutine until the pipeline finishes or is
+        aborted. Implemented by subclasses.
+        """
+        raise NotImplementedError
+
+    def _call(self, func, *args):
+        """Invoke the coroutine (via func) while letting the
+        supervisor know what the thread is working on.
+        """
+        self.supervisor.begin(self.index)
+        try:
+            return func(*args)
+        finally:
+            self.supervisor.end()
+
+    def _receive(self):
+        """Get the next message from the input queue or, if the stage
+        is batched, a list of messages. Returns POISON when the input
+        is exhausted and, if the stage is marked with `idle`, IDLE when
+        no message arrives in time.
+        """
+        if self.batch_lock:
+            # The stage's other threads wait while this one collects
+            # its batch, so that the batch holds consecutive sequence
+            # numbers (as the reorderer expects).
+            with self.batch_lock:
+                return self._collect()
+        return self._collect()
+
+    def _collect(self):
+        """Take the next message or batch from the input queue (see
+        `_receive`).
+        """
+        if self.idle:
+            try:
+                msg = self.in_queue.get(True, self.idle)
+            except Queue.Empty:
+                return IDLE
+        else:
+            msg = self.in_queue.get()
+        if msg is POISON or not self.batch:
+            return msg
+
+        # Collect more messages until the batch is full or the first
+        # message has lingered long enough.
+        size, linger = self.batch
+        msgs = [msg]
+        deadline = time.time() + linger
+        while len(msgs) < size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    msg = self.in_queue.get(True, timeout)
+                else:
+                    msg = self.in_queue.get(False)
+            except Queue.Empty:
+                break
+            if msg is POISON:
+                # The queue stays poisoned, so the next call returns
+                # POISON too.
+                break
+            msgs.append(msg)
+        return msgs
+
+    def _outmsgs(self, out):
+        """Returns the list of messages in the stage's output."""
+        if self.batch:
+            return _batchmsgs(out)
+        else:
+            return _allmsgs(out)
+
 class FirstPipelineThread(PipelineThread):
     """The thread running the first stage in a parallel pipeline setup.
     The coroutine should just be a generator.
@@ -181,25 +718,34 @@ class FirstPipelineThread(PipelineThread):
         self.abort_lock = Lock()
         self.abort_flag = False
     
-    def run(self):
+    def _run(self):
+        stats = self.stats
         try:
             while True:
                 with self.abort_lock:
                     if self.abort_flag:
                         return
+                if self.supervisor.cancelled:
+                    break
                 
                 # Get the value from the generator.
+                start = time.time()
                 try:
-                    msg = self.coro.next()
+                    msg = self._call(self.coro.next)
                 except StopIteration:
                     break
+                finally:
+                    stats.busy += time.time() - start
                 
                 # Send messages to the next stage.
                 for msg in _allmsgs(msg):
                     with self.abort_lock:
                         if self.abort_flag:
                             return
+                    stats.messages += 1
+                    start = time.time()
                     self.out_queue.put(msg)
+                    stats.out_wait += time.time() - start
 
         except:
             self.abort_all(sys.exc_info())
@@ -212,14 +758,17 @@ class MiddlePipelineThread(PipelineThread):
     """A thread running any stage in the pipeline except the first or
     last.
     """
-    def __init__(self, coro, in_queue, out_queue, all_threads):
+    def __init__(self, coro, in_queue, out_queue, all_threads,
+                 reorderer=None):
         super(MiddlePipelineThread, self).__init__(all_threads)
         self.coro = coro
         self.in_queue = in_queue
         self.out_queue = out_queue
         self.out_queue.acquire()
+        self.reorderer = reorderer
 
-    def run(self):
+    def _run(self):
+        stats = self.stats
         try:
             # Prime the coroutine.
             self.coro.next()
@@ -230,23 +779,63 @@ class MiddlePipelineThread(PipelineThread):
                         return
 
                 # Get the message from the previous stage.
-                msg = self.in_queue.get()
+                start = time.time()
+                msg = self._receive()
+                stats.in_wait += time.time() - start
                 if msg is POISON:
                     break
                 
                 with self.abort_lock:
                     if self.abort_flag:
                         return
+                if msg is IDLE:
+                    self._call(self.coro.send, IDLE)
+                    continue
 
                 # Invoke the current stage.
-                out = self.coro.send(msg)
+                if self.batch:
+                    count = len(msg)
+                else:
+                    count = 1
+                if self.reorderer:
+                    if msg is None or (self.batch and None in msg):
+                        # The queue was invalidated by another thread's
+                        # abort before ours was signalled.
+                        return
+                    if self.batch:
+                        seq = msg[0][0]
+                        msg = [m for _, m in msg]
+                    else:
+                        seq, msg = msg
+                if self.supervisor.cancelled:
+                    # Drop the remaining messages (leaving no gaps for
+                    # the reorderer to wait on).
+                    if self.reorderer and \
+                       not self.reorderer.put(seq, [], count):
+                        return
+                    continue
+                stats.messages += count
+                start = time.time()
+                out = self._call(self.coro.send, msg)
+                stats.busy += time.time() - start
+
+                # Put the results back in order.
+                if self.reorderer:
+                    start = time.time()
+                    if not self.reorderer.put(seq, self._outmsgs(out),
+                                              count):
+                        return
+                    stats.out_wait += time.time() - start
+                    continue
                 
                 # Send messages to next stage.
-                for msg in _allmsgs(out):
+                for msg in self._outmsgs(out):
                     with self.abort_lock:
                         if self.abort_flag:
                             return
+                    start = time.time()
                     self.out_queue.put(msg)
+                    stats.out_wait += time.time() - start
 
         except:
             self.abort_all(sys.exc_info())
@@ -264,7 +853,9 @@ class LastPipelineThread(PipelineThread):
         self.coro = coro
         self.in_queue = in_queue
 
-    def run(self):
+    def _run(self):
+        stats = self.stats
+
         # Prime the coroutine.
         self.coro.next()
 
@@ -275,16 +866,28 @@ class LastPipelineThread(PipelineThread):
                         return
                     
                 # Get the message from the previous stage.
-                msg = self.in_queue.get()
+                start = time.time()
+                msg = self._receive()
+                stats.in_wait += time.time() - start
                 if msg is POISON:
                     break
                 
                 with self.abort_lock:
                     if self.abort_flag:
                         return
+                if msg is IDLE:
+                    self._call(self.coro.send, IDLE)
+                    continue
 
-                # Send to consumer.
-                self.coro.send(msg)
+                # Send to consumer. Even when the pipeline is cancelled,
+                # the messages that got this far are handled.
+                if self.batch:
+                    stats.messages += len(msg)
+                else:
+                    stats.messages += 1
+                start = time.time()
+                self._call(self.coro.send, msg)
+                stats.busy += time.time() - start
 
         except:
             self.abort_all(sys.exc_info())
@@ -295,66 +898,280 @@ class Pipeline(object):
     is a coroutine that receives messages from the previous stage and
     yields messages to be sent to the next stage.
     """
-    def __init__(self, stages):
+    def __init__(self, stages, monitor=None, stall_time=None):
         """Makes a new pipeline from a list of coroutines. There must
-        be at least two stages.
+        be at least two stages. If monitor is provided, it is called
+        with the list of per-stage `StageStats` objects periodically
+        while the pipeline runs and once more when it finishes. If
+        stall_time is given, a warning (with a stack trace) is logged
+        whenever a stage spends longer than that on one message.
         """
         if len(stages) < 2:
             raise ValueError('pipeline must have at least two stages')
         self.stages = []
-        for stage in stages:
+        self.blocking = set()
+        self.batching = {} # Maps stage indices to (size, linger).
+        self.limits = {} # Maps stage indices to time limits.
+        self.idle_times = {} # Maps stage indices to idle intervals.
+        for i, stage in enumerate(stages):
+            while isinstance(stage, (BlockingStage, BatchStage,
+                                     TimedStage, IdleStage)):
+                if isinstance(stage, BlockingStage):
+                    self.blocking.add(i)
+                elif isinstance(stage, TimedStage):
+                    self.limits[i] = stage.seconds
+                elif isinstance(stage, IdleStage):
+                    if i == 0:
+                        raise ValueError('the first stage cannot be idle')
+                    self.idle_times[i] = stage.seconds
+                else:
+                    if i == 0:
+                        raise ValueError('the first stage cannot be batched')
+                    self.batching[i] = (stage.size, stage.linger)
+                stage = stage.stage
             if isinstance(stage, types.GeneratorType):
                 # Default to one thread per stage.
                 self.stages.append((stage,))
             else:
                 self.stages.append(stage)
+        self.monitor = monitor
+        self.stall_time = stall_time
+        self.supervisor = None
+        self.cancelled = False
+
+        # Statistics for each stage. Each stage's entry is the sum of
+        # the entries in _part_stats for the stage's coroutines.
+        self._part_stats = []
+        self.stats = []
+        for i, stage in enumerate(self.stages):
+            self._part_stats.append([])
+            self.stats.append(StageStats(_stage_name(stage[0], i)))
+
+        # Smoothed message rates used for adaptive queue sizing.
+        self._rates = None
+
+    def _update_stats(self, depths=None):
+        """Recompute the per-stage statistics from the per-thread
+        counters, record the depths of the stages' input queues (if
+        given), and invoke the monitor.
+        """
+        for stats, parts in zip(self.stats, self._part_stats):
+            stats.messages = 0
+            stats.busy = stats.in_wait = stats.out_wait = 0.0
+            for part in parts:
+                stats.add(part)
+        if depths:
+            for stats, depth in zip(self.stats[1:], depths):
+                stats.sample_depth(depth)
+        if self.monitor:
+            self.monitor(self.stats)
         
+    def cancel(self):
+        """Stop the pipeline gracefully: no more messages are produced
+        and those not yet being handled by a middle stage are dropped
+        (the last stage still handles the messages that reach it). May
+        be called from any thread, even before the pipeline is run.
+        """
+        self.cancelled = True
+        if self.supervisor:
+            self.supervisor.cancelled = True
+
+    def _supervise(self, on_timeout=None):
+        """Set up and start the supervisor for a run."""
+        self.supervisor = Supervisor([st.name for st in self.stats],
+                                     self.limits, self.stall_time,
+                                     on_timeout)
+        self.supervisor.cancelled = self.cancelled
+        self.supervisor.start()
+        return self.supervisor
+
+    def _adapt(self, queues, queue_size, counts, elapsed):
+        """Resize the queues so that each holds about ADAPT_HORIZON
+        seconds' worth of messages for the stage it feeds. counts
+        gives each stage's message count at the previous adjustment,
+        elapsed seconds ago. Returns the new counts.
+        """
+        new_counts = [stats.messages for stats in self.stats]
+        if self._rates is None:
+            self._rates = [None] * len(queues)
+        for i, queue in enumerate(queues):
+            # Exponentially smoothed rate of the downstream stage.
+            rate = (new_counts[i+1] - counts[i+1]) / elapsed
+            if self._rates[i] is not None:
+                rate = (rate + self._rates[i]) / 2.0
+            self._rates[i] = rate
+            size = int(math.ceil(rate * ADAPT_HORIZON))
+            queue.resize(max(ADAPT_MIN, min(queue_size, size)))
+        return new_counts
+
     def run_sequential(self):
         """Run the pipeline sequentially in the current thread. The
         stages are run one after the other. Only the first coroutine
         in each stage is used.
         """
         coros = [stage[0] for stage in self.stages]
+        stats = [StageStats(None) for coro in coros]
+        for parts, part in zip(self._part_stats, stats):
+            parts.append(part)
+        supervisor = self._supervise()
+
+        def call(i, func, *args):
+            supervisor.begin(i)
+            try:
+                return func(*args)
+            finally:
+                supervisor.end()
+
+        # Messages waiting to be sent to batched stages and the time
+        # at which the oldest of them arrived.
+        buffers = [[] for coro in coros]
+        arrived = [None for coro in coros]
+        # The time each stage was last sent anything (for idle stages).
+        woken = [time.time() for coro in coros]
+
+        def send(i, msgs, flush=False):
+            # Send messages through stage i. Returns the messages to
+            # send to the next stage.
+            coro, coro_stats = coros[i], stats[i]
+            out_msgs = []
+            if i in self.idle_times:
+                if msgs:
+                    woken[i] = time.time()
+                elif time.time() - woken[i] >= self.idle_times[i]:
+                    call(i, coro.send, IDLE)
+                    woken[i] = time.time()
+            if i in self.batching:
+                size, linger = self.batching[i]
+                buf = buffers[i]
+                if msgs and not buf:
+                    arrived[i] = time.time()
+                buf.extend(msgs)
+                while buf and (flush or len(buf) >= size or
+                               time.time() - arrived[i] >= linger):
+                    batch = buf[:size]
+                    del buf[:size]
+                    start = time.time()
+                    out = call(i, coro.send, batch)
+                    coro_stats.busy += time.time() - start
+                    coro_stats.messages += len(batch)
+                    out_msgs.extend(_batchmsgs(out))
+                    arrived[i] = time.time()
+            else:
+                for msg in msgs:
+                    start = time.time()
+                    out = call(i, coro.send, msg)
+                    coro_stats.busy += time.time() - start
+                    coro_stats.messages += 1
+                    out_msgs.extend(_allmsgs(out))
+            return out_msgs
 
         # "Prime" the coroutines.
         for coro in coros[1:]:
             coro.next()
         
         # Begin the pipeline.
-        for out in coros[0]:
-            msgs = _allmsgs(out)
-            for coro in coros[1:]:
-                next_msgs = []
-                for msg in msgs:
-                    out = coro.send(msg)
-                    next_msgs.extend(_allmsgs(out))
-                msgs = next_msgs
+        try:
+            producer = iter(coros[0])
+            while not supervisor.cancelled:
+                start = time.time()
+                try:
+                    out = call(0, producer.next)
+                except StopIteration:
+                    break
+                finally:
+                    stats[0].busy += time.time() - start
+                msgs = _allmsgs(out)
+                stats[0].messages += len(msgs)
+                for i in range(1, len(coros)):
+                    msgs = send(i, msgs)
+
+            # Send any partial batches on. When cancelled, only the
+            # last stage's batch (which the other stages have already
+            # handled) is sent.
+            msgs = []
+            for i in range(1, len(coros)):
+                if supervisor.cancelled and i < len(coros) - 1:
+                    continue
+                msgs = send(i, msgs, True)
+        finally:
+            supervisor.stop()
+            self._update_stats()
+
+            # Let the coroutines clean up.
+            for coro in coros:
+                _close(coro)
     
-    def run_parallel(self, queue_size=DEFAULT_QUEUE_SIZE):
+    def run_parallel(self, queue_size=DEFAULT_QUEUE_SIZE, max_weight=0,
+                     weigh=None, adaptive=False, ordered=False,
+                     reorder_size=None):
         """Run the pipeline in parallel using one thread per stage. The
-        messages between the stages are stored in queues of the given
-        size.
+        messages between the stages are stored in queues holding at
+        most queue_size messages. If weigh is a function estimating
+        the weight of a message, each queue also holds messages of
+        at most max_weight total weight. If adaptive, then the queues
+        are resized (up to queue_size) according to the throughput of
+        the stages they feed. If ordered, then multi-threaded middle
+        stages emit messages in the order they were received, holding
+        up to reorder_size (by default, queue_size) results in their
+        reorder buffers. Raises StageTimeout if a stage exceeds its
+        time limit.
         """
-        queues = [CountedQueue(queue_size) for i in range(len(self.stages)-1)]
+        queues = [CountedQueue(queue_size, max_weight, weigh)
+                  for i in range(len(self.stages)-1)]
         threads = []
 
         # Set up first stage.
         for coro in self.stages[0]:
             threads.append(FirstPipelineThread(coro, queues[0], threads))
+            self._part_stats[0].append(threads[-1].stats)
 
         # Middle stages.
         for i in range(1, len(self.stages)-1):
+            if ordered and len(self.stages[i]) > 1:
+                queues[i-1].sequenced = True
+                reorderer = Reorderer(
+                    queues[i], reorder_size or queue_size or
+                    DEFAULT_QUEUE_SIZE
+                )
+            else:
+                reorderer = None
+            if reorderer and i in self.batching:
+                batch_lock = Lock()
+            else:
+                batch_lock = None
             for coro in self.stages[i]:
                 threads.append(MiddlePipelineThread(
-                    coro, queues[i-1], queues[i], threads
+                    coro, queues[i-1], queues[i], threads, reorderer
                 ))
+                threads[-1].batch = self.batching.get(i)
+                threads[-1].batch_lock = batch_lock
+                threads[-1].idle = self.idle_times.get(i)
+                self._part_stats[i].append(threads[-1].stats)
 
         # Last stage.
         for coro in self.stages[-1]:
             threads.append(
                 LastPipelineThread(coro, queues[-1], threads)
             )
+            threads[-1].batch = self.batching.get(len(self.stages)-1)
+            threads[-1].idle = self.idle_times.get(len(self.stages)-1)
+            self._part_stats[-1].append(threads[-1].stats)
         
+        # The watchdog aborts the pipeline when a time limit is
+        # exceeded.
+        timeouts = []
+        def on_timeout(exc):
+            timeouts.append(exc)
+            for thread in threads:
+                thread.abort()
+        supervisor = self._supervise(on_timeout)
+        index = 0
+        for i, stage in enumerate(self.stages):
+            for coro in stage:
+                threads[index].index = i
+                threads[index].supervisor = supervisor
+                index += 1
+
         # Start threads.
         for thread in threads:
             thread.start()
@@ -362,9 +1179,19 @@ class Pipeline(object):
         # Wait for termination. The final thread lasts the longest.
         try:
             # Using a timeout allows us to receive KeyboardInterrupt
-            # exceptions during the join().
-            while threads[-1].isAlive():
-                threads[-1].join(1)
+            # exceptions during the join(). It also lets us sample the
+            # pipeline's statistics (and adapt the queue sizes)
+            # periodically.
+            counts = [0] * len(self.stages)
+            last = time.time()
+            while threads[-1].isAlive() and not timeouts:
+                threads[-1].join(SAMPLE_INTERVAL)
+                self._update_stats([q.qsize() for q in queues])
+                now = time.time()
+                if adaptive and now - last >= SAMPLE_INTERVAL:
+                    counts = self._adapt(queues, queue_size, counts,
+                                         now - last)
+                    last = now
 
         except:
             # Stop all the threads immediately.
@@ -376,8 +1203,16 @@ class Pipeline(object):
             # Make completely sure that all the threads have finished
             # before we return. They should already be either finished,
             # in normal operation, or aborted, in case of an exception.
-            for thread in threads[:-1]:
+            # A thread that exceeded its time limit is abandoned.
+            for thread in threads:
+                if thread is supervisor.timed_out:
+                    continue
                 thread.join()
+            supervisor.stop()
+            self._update_stats()
+
+        if timeouts:
+            raise timeouts[0]
 
         for thread in threads:
             exc_info = thread.exc_info
@@ -385,6 +1220,208 @@ class Pipeline(object):
                 # Make the exception appear as it was raised originally.
                 raise exc_info[0], exc_info[1], exc_info[2]
 
+    def run_pooled(self, pool_size, queue_size=DEFAULT_QUEUE_SIZE,
+                   ordered=False):
+        """Run the pipeline's blocking stages (see `blocking`) using a
+        pool of pool_size threads and the other stages in the current
+        thread. At most queue_size messages wait before each stage. If
+        ordered, then stages with several coroutines emit messages in
+        the order they were received. Batched stages are sent the
+        messages that are waiting for them (up to their batch size)
+        without lingering. Time limits are not enforced (stages that
+        exceed them are only reported).
+        """
+        nstages = len(self.stages)
+        last = nstages - 1
+        # Exhausted producers are dropped from the idle lists.
+        idle = [list(stage) for stage in self.stages]
+        inflight = [0] * nstages
+        # Waiting (sequence number, message) pairs for each stage.
+        inputs = [deque() for stage in self.stages]
+        seqs = [0] * nstages
+        # Reorder buffers: the next sequence number to emit from each
+        # stage and the results that arrived before it.
+        next_seqs = [0] * nstages
+        early = [{} for stage in self.stages]
+        # The time each stage was last sent anything (for idle stages).
+        woken = [time.time()] * nstages
+
+        stats = {}
+        for i, stage in enumerate(self.stages):
+            for coro in stage:
+                stats[coro] = StageStats(None)
+                self._part_stats[i].append(stats[coro])
+        results = Queue.Queue()
+        supervisor = self._supervise()
+
+        def run(i, coro, seq, count, msg):
+            # Invoke a coroutine and report the result.
+            start = time.time()
+            supervisor.begin(i)
+            try:
+                try:
+                    if i == 0:
+                        out = coro.next()
+                    else:
+                        out = coro.send(msg)
+                finally:
+                    supervisor.end()
+                    stats[coro].busy += time.time() - start
+            except StopIteration:
+                results.put((i, coro, seq, count, None, StopIteration))
+            except:
+                results.put((i, coro, seq, count, None, sys.exc_info()))
+            else:
+                results.put((i, coro, seq, count, out, None))
+
+        def emit(i, msgs):
+            # Send messages on to the stage after stage i.
+            if i < last:
+                for msg in msgs:
+                    inputs[i+1].append((seqs[i+1], msg))
+                    seqs[i+1] += 1
+
+        def finish(i, coro, seq, count, out, exc):
+            # Handle a coroutine's result.
+            inflight[i] -= 1
+            if exc is StopIteration:
+                return
+            idle[i].append(coro)
+            if exc:
+                raise exc[0], exc[1], exc[2]
+            if i in self.batching:
+                msgs = _batchmsgs(out)
+            else:
+                msgs = _allmsgs(out)
+            if i == 0:
+                stats[coro].messages += len(msgs)
+            else:
+                stats[coro].messages += count
+            if ordered and i > 0 and len(self.stages[i]) > 1:
+                early[i][seq] = (msgs, count)
+                while next_seqs[i] in early[i]:
+                    msgs, count = early[i].pop(next_seqs[i])
+                    emit(i, msgs)
+                    next_seqs[i] += count
+            else:
+                emit(i, msgs)
+
+        def ready(i):
+            # Can a coroutine in stage i be given a message? After a
+            # cancellation, only the last stage takes any more.
+            if (supervisor.cancelled and i < last) or not idle[i]:
+                return False
+            if i < last and len(inputs[i+1]) >= queue_size:
+                return False
+            if i == 0:
+                return True
+            if not inputs[i]:
+                return False
+            if ordered and len(self.stages[i]) > 1:
+                # Bound the reorder buffer.
+                return inputs[i][0][0] < next_seqs[i] + queue_size
+            return True
+
+        def dispatch(i):
+            coro = idle[i].pop()
+            if i == 0:
+                seq, count, msg = None, 1, None
+            elif i in self.batching:
+                size = self.batching[i][0]
+                batch = []
+                while inputs[i] and len(batch) < size:
+                    batch.append(inputs[i].popleft())
+                seq, count = batch[0][0], len(batch)
+                msg = [m for _, m in batch]
+            else:
+                seq, msg = inputs[i].popleft()
+                count = 1
+            inflight[i] += 1
+            woken[i] = time.time()
+            return coro, seq, count, msg
+
+        def wake(i):
+            # Send IDLE to the waiting coroutines of stage i if it has
+            # been idle for long enough.
+            if supervisor.cancelled or inputs[i] or \
+               time.time() - woken[i] < self.idle_times[i]:
+                return
+            for coro in list(idle[i]):
+                supervisor.begin(i)
+                try:
+                    coro.send(IDLE)
+                finally:
+                    supervisor.end()
+            woken[i] = time.time()
+
+        # "Prime" the coroutines.
+        for stage in self.stages[1:]:
+            for coro in stage:
+                coro.next()
+
+        pool = WorkerPool(pool_size)
+        interrupted = False
+        last_sample = time.time()
+        try:
+            try:
+                while True:
+                    # Hand work to the pool.
+                    for i in self.blocking:
+                        while ready(i):
+                            pool.submit(run, i, *dispatch(i))
+
+                    # Run one step of the first ready non-blocking
+                    # stage.
+                    ran = False
+                    for i in range(nstages):
+                        if i not in self.blocking and ready(i):
+                            run(i, *dispatch(i))
+                            ran = True
+                            break
+
+                    # Collect results, waiting if there is nothing
+                    # else to do.
+                    if not ran:
+                        if not sum(inflight):
+                            break
+                        try:
+                            result = results.get(True, SAMPLE_INTERVAL)
+                        except Queue.Empty:
+                            pass
+                        else:
+                            results.put(result)
+                    while not results.empty():
+                        finish(*results.get())
+                    for i in self.idle_times:
+                        wake(i)
+
+                    now = time.time()
+                    if now - last_sample >= SAMPLE_INTERVAL:
+                        self._update_stats([len(q) for q in inputs[1:]])
+                        last_sample = now
+
+            except KeyboardInterrupt:
+                interrupted = True
+                raise
+        finally:
+            pool.close()
+            supervisor.stop()
+
+            # Unless we were interrupted, let the coroutines that are
+            # still running finish.
+            if not interrupted:
+                while sum(inflight):
+                    i, coro, _, _, _, exc = results.get()
+                    inflight[i] -= 1
+                    if exc is not StopIteration:
+                        idle[i].append(coro)
+            self._update_stats()
+
+            # Let the idle coroutines clean up.
+            for coros in idle:
+                for coro in coros:
+                    _close(coro)
+
 # Smoke test.
 if __name__ == '__main__':
     import time
@@ -0,0 +1,227 @@
+# This file is part of beets.
+# Copyright 2011, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Watches directory trees for directories whose contents have
+stopped changing. This is used to import music from a "drop folder"
+as it arrives.
+
+A directory becomes pending when a file that has not been seen before
+appears in it. Once no changes have been observed in a pending
+directory for a given "settle time," the directory is reported as
+settled and all of its files are considered seen. Later changes to
+seen files (e.g., tag updates) do not make a directory pending again.
+
+If the `pyinotify` module is available, changes are detected using
+Linux's inotify facility. Otherwise, the trees are polled
+periodically, which only requires stat()ing the files.
+"""
+import os
+import time
+import logging
+
+from beets.util import bytestring_path, normpath
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+DEFAULT_SETTLE_TIME = 30.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+# Global logger.
+log = logging.getLogger('beets')
+
+class Watcher(object):
+    """Abstract base class for directory watchers. Subclasses detect
+    changes and report them using `_activity`.
+    """
+    def __init__(self, paths, settle_time=DEFAULT_SETTLE_TIME,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.paths = [bytestring_path(normpath(p)) for p in paths]
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+
+        # Maps pending directories to the time of the last change.
+        self.changed = {}
+        # Paths of files that have already been reported.
+        self.seen = set()
+
+    def _activity(self, dirpath, filepath=None, deleted=False):
+        """Record a change in the directory dirpath. filepath, if
+        provided, is the path of the file that changed. If filepath is
+        None, the directory's current contents are checked for new
+        files.
+        """
+        if deleted:
+            self.seen.discard(filepath)
+        elif filepath is not None:
+            if filepath not in self.seen:
+                self.changed[dirpath] = time.time()
+        elif any(p not in self.seen for p in dir_files(dirpath)):
+            self.changed[dirpath] = time.time()
+
+        # Any change in a pending directory delays its settling.
+        if dirpath in self.changed:
+            self.changed[dirpath] = time.time()
+
+    def _wait(self, timeout):
+        """Wait for up to timeout seconds, recording any changes that
+        occur in the meantime.
+        """
+        raise NotImplementedError
+
+    def poll(self):
+        """Waits for up to `poll_interval` seconds and then returns a
+        sorted list of the directories that have settled. The list
+        may be empty.
+        """
+        self._wait(self.poll_interval)
+
+        now = time.time()
+        settled = []
+        for dirpath, changed in self.changed.items():
+            if now - changed >= self.settle_time:
+                settled.append(dirpath)
+                del self.changed[dirpath]
+                self.seen.update(dir_files(dirpath))
+        settled.sort()
+        if settled:
+            log.debug('Settled directories: %s' % ', '.join(settled))
+        return settled
+
+    def close(self):
+        """Release any resources held by the watcher."""
+        pass
+
+class PollingWatcher(Watcher):
+    """Detects changes by periodically walking the watched trees and
+    comparing each directory's file names, sizes, and modification
+    times to those seen on the previous walk.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PollingWatcher, self).__init__(*args, **kwargs)
+        self.signatures = {}
+        self._scan()
+
+    def _scan(self):
+        signatures = {}
+        for top in self.paths:
+            for dirpath, _, filenames in os.walk(top):
+                sig = []
+                for filename in filenames:
+                    try:
+                        st = os.stat(os.path.join(dirpath, filename))
+                    except OSError:
+                        # Removed during the walk.
+                        continue
+                    sig.append((filename, st.st_size, st.st_mtime))
+                sig.sort()
+                signatures[dirpath] = sig
+                if sig != self.signatures.get(dirpath):
+                    self._activity(dirpath)
+
+        # Forget files in directories that no longer exist.
+        for dirpath in set(self.signatures) - set(signatures):
+            self.changed.pop(dirpath, None)
+            self.seen = set(p for p in self.seen
+                            if os.path.dirname(p) != dirpath)
+        self.signatures = signatures
+
+    def _wait(self, timeout):
+        time.sleep(timeout)
+        self._scan()
+
+    def _activity(self, dirpath, filepath=None, deleted=False):
+        # Files that disappeared since they were seen are forgotten so
+        # that they are imported again if they reappear.
+        present = set(dir_files(dirpath))
+        self.seen = set(p for p in self.seen
+                        if os.path.dirname(p) != dirpath or p in present)
+        super(PollingWatcher, self)._activity(dirpath, filepath, deleted)
+
+if pyinotify:
+    class _EventHandler(pyinotify.ProcessEvent):
+        def my_init(self, watcher):
+            self.watcher = watcher
+        def process_default(self, event):
+            if event.dir:
+                # A new subdirectory may already contain files.
+                if event.mask & (pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO):
+                    self.watcher._activity(event.pathname)
+            else:
+                deleted = bool(event.mask & (pyinotify.IN_DELETE |
+                                             pyinotify.IN_MOVED_FROM))
+                self.watcher._activity(event.path, event.pathname, deleted)
+
+class InotifyWatcher(Watcher):
+    """Detects changes using inotify (via the pyinotify module)."""
+    MASK = 0
+    if pyinotify:
+        MASK = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | \
+               pyinotify.IN_MOVED_TO | pyinotify.IN_DELETE | \
+               pyinotify.IN_MOVED_FROM | pyinotify.IN_MODIFY
+
+    def __init__(self, *args, **kwargs):
+        super(InotifyWatcher, self).__init__(*args, **kwargs)
+        self.wm = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(
+            self.wm, _EventHandler(watcher=self), timeout=0
+        )
+        for top in self.paths:
+            self.wm.add_watch(top, self.MASK, rec=True, auto_add=True)
+
+        # Files present before we started watching are new, too.
+        for top in self.paths:
+            for dirpath, _, _ in os.walk(top):
+                self._activity(dirpath)
+
+    def _wait(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            if self.notifier.check_events(int(remaining * 1000)):
+                self.notifier.read_events()
+                self.notifier.process_events()
+
+    def close(self):
+        self.notifier.stop()
+
+def watcher(paths, settle_time=DEFAULT_SETTLE_TIME,
+            poll_interval=DEFAULT_POLL_INTERVAL):
+    """Returns a Watcher for the given list of directories, using
+    inotify if it is available and polling otherwise.
+    """
+    if pyinotify:
+        cls = InotifyWatcher
+    else:
+        log.debug('pyinotify not available; polling for changes')
+        cls = PollingWatcher
+    return cls(paths, settle_time, poll_interval)
+
+def dir_files(dirpath):
+    """Returns the paths of the regular files directly inside dirpath.
+    """
+    try:
+        names = os.listdir(dirpath)
+    except OSError:
+        return []
+    out = []
+    for name in names:
+        path = os.path.join(dirpath, name)
+        if os.path.isfile(path):
+            out.append(path)
+    return out
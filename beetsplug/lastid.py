@@ -94,7 +94,7 @@ class LastIdPlugin(BeetsPlugin):
         if last_data['track_mbid']:
             # log.debug('Last track ID match: %s/%s' %
             #           (last_data['track_mbid'], track_data['id']))
-            if last_data['track_mbid'] != track_data['id']:
+            if last_data['track_mbid'] != info['id']:
                 dist += autotag.TRACK_ID_WEIGHT
             dist_max += autotag.TRACK_ID_WEIGHT
 
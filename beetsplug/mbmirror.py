@@ -0,0 +1,59 @@
+# This file is part of beets.
+# Copyright 2011, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Looks up metadata in a local mirror of the MusicBrainz database
+instead of the MusicBrainz web service, so imports need not wait for
+the server.
+
+Build the mirror from a MusicBrainz data dump (the unpacked "mbdump"
+directory) with:
+    beet mbmirror /path/to/mbdump
+
+Put something like the following in your .beetsconfig to choose where
+the mirror is stored:
+    [mbmirror]
+    path = ~/.beetsmb
+Once the mirror exists, all lookups use it.
+"""
+import os
+
+from beets.plugins import BeetsPlugin
+from beets import ui
+from beets.autotag import mb
+from beets.autotag import mirror
+
+DEFAULT_PATH = '~/.beetsmb'
+
+class MBMirrorPlugin(BeetsPlugin):
+    def __init__(self):
+        self.path = os.path.expanduser(DEFAULT_PATH)
+
+    def configure(self, config):
+        self.path = os.path.expanduser(
+            ui.config_val(config, 'mbmirror', 'path', DEFAULT_PATH)
+        )
+        if os.path.exists(self.path):
+            mb.set_backend(mirror.Mirror(self.path))
+
+    def commands(self):
+        cmd = ui.Subcommand('mbmirror', help='build the local MusicBrainz '
+                                             'mirror from a data dump')
+        def func(lib, config, opts, args):
+            if len(args) != 1:
+                raise ui.UserError('specify the dump directory')
+            ui.print_('Building mirror at %s...' % self.path)
+            mirror.Mirror(self.path).import_dump(args[0])
+            mb.set_backend(mirror.Mirror(self.path))
+        cmd.func = func
+        return [cmd]
@@ -50,7 +50,6 @@ setup(name='beets',
       install_requires=[
           'mutagen',
           'python-musicbrainz2 >= 0.7.2',
-          'munkres',
       ],
 
       classifiers=[
@@ -80,7 +80,24 @@ def iconfig(lib, **kwargs):
         threaded = False,
         autot = True,
         singletons = False,
+        interactive_autotag = False,
         choose_item_func = lambda x, y: importer.action.SKIP,
+        resolve = False,
+        manifest = None,
+        watch = None,
+        commit_every = 1,
+        commit_interval = 0,
+        transfer_threads = 1,
+        transfer_per_device = 0,
+        plan = None,
+        apply_plan = None,
+        lookup_threads = 1,
+        pool_size = 0,
+        time_limit = None,
+        lookup_timeout = None,
+        art_cache = None,
+        autotag_processes = 0,
+        tag_report = None,
     )
     for k, v in kwargs.items():
         setattr(config, k, v)
@@ -0,0 +1,115 @@
+# This file is part of beets.
+# Copyright 2011, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Benchmarks for the autotagger's inner loops. They only report how
+long things take (timings depend too much on the machine to be checked
+by the test suite), so run them by hand:
+
+    python benchmark.py [name ...]
+
+where each name is that of a benchmark below without the "bench_"
+prefix. With no names, every benchmark is run.
+"""
+
+import sys
+import time
+import random
+
+import _common
+from beets import util
+from beets import autotag
+import test_autotag
+
+# Each measurement is repeated and the best time is reported.
+REPEAT = 3
+
+def _best_time(func, *args):
+    """Returns the shortest time (in seconds) taken by func(*args) in
+    REPEAT calls.
+    """
+    best = None
+    for i in range(REPEAT):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _report(name, count, unit, elapsed, reference=None):
+    """Print a line giving the rate at which count things were done in
+    elapsed seconds and, if the time of a reference implementation is
+    given, the speedup over it.
+    """
+    line = '%-24s %10.0f %s/s' % (name, count / max(elapsed, 1e-9), unit)
+    if reference is not None:
+        line += '  (%.1fx reference)' % (reference / max(elapsed, 1e-9))
+    print line
+
+def bench_levenshtein():
+    """`util.levenshtein` against the dynamic-programming version on
+    strings the length of track titles.
+    """
+    rng = random.Random(0)
+    def word(n):
+        return ''.join([rng.choice('abcdefgh ') for i in range(n)])
+    pairs = [(word(rng.randint(5, 40)), word(rng.randint(5, 40)))
+             for i in range(2000)]
+    def run(func):
+        for s1, s2 in pairs:
+            func(s1, s2)
+    _report('levenshtein', len(pairs), 'pairs',
+            _best_time(run, util.levenshtein),
+            _best_time(run, test_autotag._levenshtein_dp))
+
+def bench_assignment():
+    """`util.assignment` on random cost matrices the size of an album,
+    a double album, and box sets with no useful track numbers.
+    """
+    rng = random.Random(6)
+    for n in (12, 30, 60, 100):
+        matrices = [[[rng.random() for j in range(n)] for i in range(n)]
+                    for k in range(5)]
+        def run():
+            for costs in matrices:
+                util.assignment(costs)
+        _report('assignment %ix%i' % (n, n), len(matrices), 'matrices',
+                _best_time(run))
+
+def bench_string_dist():
+    """`autotag.string_dist` against the version from before its
+    patterns were precompiled and its results cached, comparing the
+    track titles of a run of releases with those of their candidates.
+    Each run starts with empty caches.
+    """
+    rng = random.Random(7)
+    titles = test_autotag._release_titles(rng, 60)
+    pairs = []
+    for i in range(20):
+        pairs += zip(titles, rng.sample(titles, len(titles)))
+    def run(func):
+        test_autotag._clear_string_caches()
+        for str1, str2 in pairs:
+            func(str1, str2)
+    _report('string_dist', len(pairs), 'calls',
+            _best_time(run, autotag.string_dist),
+            _best_time(run, test_autotag._reference_string_dist))
+
+BENCHMARKS = [bench_levenshtein, bench_assignment, bench_string_dist]
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    for bench in BENCHMARKS:
+        if not names or bench.__name__[len('bench_'):] in names:
+            bench()
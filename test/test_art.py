@@ -15,6 +15,8 @@
 """Tests for the album art fetchers."""
 
 import unittest
+import os
+import shutil
 
 import _common
 from beets.autotag import art
@@ -53,6 +55,75 @@ class AmazonArtTest(unittest.TestCase):
         artpath = art.art_for_album(album)
         self.assertEqual(artpath, None)
 
+class CountingUrlRetrieve(object):
+    """Downloads a real (temporary) file and counts the requests."""
+    def __init__(self, directory, typeval):
+        self.directory = directory
+        self.headers = MockHeaders(typeval)
+        self.calls = 0
+    def __call__(self, url):
+        self.calls += 1
+        path = os.path.join(self.directory, 'download%i' % self.calls)
+        f = open(path, 'w')
+        f.write('image')
+        f.close()
+        return path, self.headers
+
+class ArtCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.base = os.path.join(_common.RSRC, 'artcache')
+        os.mkdir(self.base)
+        self.cache = art.ArtCache(os.path.join(self.base, 'cache'))
+        self.old_urlretrieve = art.urllib.urlretrieve
+
+    def tearDown(self):
+        art.urllib.urlretrieve = self.old_urlretrieve
+        shutil.rmtree(self.base)
+
+    def test_hit_not_downloaded_again(self):
+        retrieve = CountingUrlRetrieve(self.base, 'image/jpeg')
+        art.urllib.urlretrieve = retrieve
+        path1 = self.cache.art_for_album({'asin': 'xxxx'})
+        path2 = self.cache.art_for_album({'asin': 'xxxx'})
+        self.assertEqual(retrieve.calls, 1)
+        self.assertEqual(path1, path2)
+        self.assertEqual(open(path1).read(), 'image')
+
+    def test_discs_share_asin(self):
+        retrieve = CountingUrlRetrieve(self.base, 'image/jpeg')
+        art.urllib.urlretrieve = retrieve
+        self.cache.art_for_album({'asin': 'xxxx', 'album_id': 'disc1'})
+        self.cache.art_for_album({'asin': 'xxxx', 'album_id': 'disc2'})
+        self.assertEqual(retrieve.calls, 1)
+
+    def test_miss_remembered(self):
+        retrieve = CountingUrlRetrieve(self.base, 'text/html')
+        art.urllib.urlretrieve = retrieve
+        self.assertEqual(self.cache.art_for_album({'asin': 'xxxx'}), None)
+        calls = retrieve.calls
+        self.assertEqual(self.cache.art_for_album({'asin': 'xxxx'}), None)
+        self.assertEqual(retrieve.calls, calls)
+
+    def test_expired_miss_retried(self):
+        retrieve = CountingUrlRetrieve(self.base, 'text/html')
+        art.urllib.urlretrieve = retrieve
+        self.cache.art_for_album({'asin': 'xxxx'})
+        calls = retrieve.calls
+        miss = self.cache._path('asin-xxxx', art.MISS_SUFFIX)
+        old = os.path.getmtime(miss) - art.MISS_TTL - 1
+        os.utime(miss, (old, old))
+        self.cache.art_for_album({'asin': 'xxxx'})
+        self.assertTrue(retrieve.calls > calls)
+
+    def test_album_without_asin_has_no_art(self):
+        retrieve = CountingUrlRetrieve(self.base, 'image/jpeg')
+        art.urllib.urlretrieve = retrieve
+        path = self.cache.art_for_album({'asin': None, 'album_id': 'x'})
+        self.assertEqual(path, None)
+        self.assertEqual(retrieve.calls, 0)
+        self.assertEqual(self.cache.lookup({'asin': None, 'album_id': 'x'}),
+                         (True, None))
+
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
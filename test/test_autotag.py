@@ -14,14 +14,20 @@
 
 """Tests for autotagging functionality.
 """
+from __future__ import with_statement # for Python 2.5
 
 import unittest
 import os
 import shutil
 import re
+import random
+import gc
 
 import _common
 from beets import autotag
+from beets.autotag import timing
+from beets import util
+from beets import plugins
 from beets.library import Item
 
 class PluralityTest(unittest.TestCase):
@@ -192,6 +198,47 @@ class AlbumsInDirTest(unittest.TestCase):
             else:
                 self.assertEqual(len(album), 1)
 
+class AlbumsFromPathsTest(unittest.TestCase):
+    def setUp(self):
+        self.base = os.path.abspath(os.path.join(_common.RSRC, 'tempdir'))
+        os.mkdir(self.base)
+        os.mkdir(os.path.join(self.base, 'album1'))
+        os.mkdir(os.path.join(self.base, 'album2'))
+
+        self.paths = [
+            os.path.join(self.base, 'album1', 'album1song1.mp3'),
+            os.path.join(self.base, 'album1', 'album1song2.mp3'),
+            os.path.join(self.base, 'album2', 'album2song.mp3'),
+        ]
+        for path in self.paths:
+            _mkmp3(path)
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_groups_by_directory(self):
+        albums = list(autotag.albums_from_paths(self.paths))
+        self.assertEqual(len(albums), 2)
+        self.assertEqual(albums[0][0], os.path.join(self.base, 'album1'))
+        self.assertEqual(len(albums[0][1]), 2)
+        self.assertEqual(len(albums[1][1]), 1)
+
+    def test_skips_non_media_files(self):
+        textpath = os.path.join(self.base, 'album2', 'notes.txt')
+        open(textpath, 'w').close()
+        albums = list(autotag.albums_from_paths(self.paths + [textpath]))
+        self.assertEqual(len(albums[1][1]), 1)
+
+    def test_is_lazy(self):
+        consumed = []
+        def paths():
+            for path in self.paths:
+                consumed.append(path)
+                yield path
+        albums = autotag.albums_from_paths(paths())
+        albums.next()
+        # The first album is complete once the third path is seen.
+        self.assertEqual(len(consumed), 3)
+
 class OrderingTest(unittest.TestCase):
     def item(self, title, track):
         return Item({
@@ -284,6 +331,83 @@ class OrderingTest(unittest.TestCase):
         for i, item in enumerate(ordered):
             self.assertEqual(i+1, item.track)
 
+class TrackDistanceMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.items = []
+        for i, title in enumerate(['one', 'two', 'three']):
+            self.items.append(Item({
+                'title': title, 'artist': 'some artist', 'track': i + 1,
+                'length': 100.0 + i * 50.0, 'mb_trackid': '',
+                'mb_albumid': '', 'mb_artistid': '',
+            }))
+        self.items[2].track = 0
+        self.items[1].mb_trackid = 'id-two'
+        self.tracks = [
+            {'title': 'One', 'artist': 'Some Artist', 'length': 98.0,
+             'id': 'id-one'},
+            {'title': 'two', 'artist': 'other artist', 'id': 'id-two'},
+            {'title': 'Tree', 'length': 300.0, 'id': 'id-three'},
+        ]
+        self.old_find_plugins = plugins.find_plugins
+
+    def tearDown(self):
+        plugins.find_plugins = self.old_find_plugins
+        # Make sure the test plugin classes are not found by other
+        # tests.
+        gc.collect()
+
+    def _pairwise(self, incl_artist):
+        return [[autotag.track_distance(item, track, j + 1, incl_artist)
+                 for j, track in enumerate(self.tracks)]
+                for item in self.items]
+
+    def test_matrix_matches_pairwise_distance(self):
+        self.assertEqual(autotag.track_distance_matrix(self.items,
+                                                       self.tracks),
+                         self._pairwise(False))
+
+    def test_matrix_matches_pairwise_distance_with_artist(self):
+        self.assertEqual(autotag.track_distance_matrix(self.items,
+                                                       self.tracks, True),
+                         self._pairwise(True))
+
+    def test_plugin_distances_included(self):
+        class TitlePlugin(plugins.BeetsPlugin):
+            def track_distance(self, item, info):
+                if item.title == info['title']:
+                    return 0.0, 1.0
+                return 1.0, 1.0
+        plugin = TitlePlugin()
+        plugins.find_plugins = lambda: [plugin]
+        self.assertEqual(autotag.track_distance_matrix(self.items,
+                                                       self.tracks),
+                         self._pairwise(False))
+
+    def test_plugin_batch_hook_called_once(self):
+        calls = []
+        class BatchPlugin(plugins.BeetsPlugin):
+            def track_distance_matrix(self, items, tracks):
+                calls.append((len(items), len(tracks)))
+                return ([[0.5] * len(tracks) for item in items],
+                        [[1.0] * len(tracks) for item in items])
+        plugin = BatchPlugin()
+        plugins.find_plugins = lambda: [plugin]
+        costs = autotag.track_distance_matrix(self.items, self.tracks)
+        self.assertEqual(calls, [(3, 3)])
+        plugins.find_plugins = lambda: []
+        self.assertNotEqual(costs,
+                            autotag.track_distance_matrix(self.items,
+                                                          self.tracks))
+
+    def test_plugins_without_track_distance_skipped(self):
+        class AlbumPlugin(plugins.BeetsPlugin):
+            def album_distance(self, items, info):
+                return 1.0, 1.0
+        plugins.find_plugins = lambda: [AlbumPlugin()]
+        d, dm = plugins.track_distance_matrix(self.items, self.tracks)
+        self.assertEqual(d, [[0.0] * 3] * 3)
+        self.assertEqual(dm, [[0.0] * 3] * 3)
+
 class ApplyTest(unittest.TestCase):
     def setUp(self):
         self.items = []
@@ -420,6 +544,315 @@ class ApplyCompilationTest(unittest.TestCase):
         self.assertTrue(self.items[0].comp)
         self.assertTrue(self.items[1].comp)
 
+class KnownTracksTest(unittest.TestCase):
+    def setUp(self):
+        self.item = Item({
+            'title': 'one', 'track': 1, 'artist': 'some artist',
+            'album': 'some album', 'length': 1,
+            'mb_trackid': '', 'mb_albumid': '', 'mb_artistid': '',
+        })
+        info = {
+            'artist': 'some artist',
+            'artist_id': 'artistid',
+            'tracks': [{'title': 'one', 'id': 'id1', 'length': 1},
+                       {'title': 'two', 'id': 'id2', 'length': 1}],
+        }
+        other = {
+            'artist': 'other artist',
+            'artist_id': 'otherid',
+            'tracks': [{'title': 'two', 'id': 'id2', 'length': 1},
+                       {'title': 'three', 'id': 'id3', 'length': 1,
+                        'artist': 'third artist'}],
+        }
+        self.candidates = [(0.1, [], info), (0.2, [], other)]
+        self.old_match_track = autotag.mb.match_track
+        self.searches = []
+        def match_track(artist, title):
+            self.searches.append((artist, title))
+            return []
+        autotag.mb.match_track = match_track
+
+    def tearDown(self):
+        autotag.mb.match_track = self.old_match_track
+
+    def test_candidate_tracks_unique(self):
+        tracks = autotag.candidate_tracks(self.candidates)
+        self.assertEqual([t['id'] for t in tracks], ['id1', 'id2', 'id3'])
+
+    def test_candidate_tracks_get_album_artist(self):
+        tracks = autotag.candidate_tracks(self.candidates)
+        self.assertEqual(tracks[0]['artist'], 'some artist')
+        self.assertEqual(tracks[0]['artist_id'], 'artistid')
+        self.assertEqual(tracks[2]['artist'], 'third artist')
+        self.assertFalse('artist' in self.candidates[0][2]['tracks'][0])
+
+    def test_strong_known_match_skips_search(self):
+        tracks = autotag.candidate_tracks(self.candidates)
+        candidates, rec = autotag.tag_item(self.item, known_tracks=tracks)
+        self.assertEqual(self.searches, [])
+        self.assertEqual(rec, autotag.RECOMMEND_STRONG)
+        self.assertEqual(candidates[0][1]['id'], 'id1')
+
+    def test_weak_known_match_searches(self):
+        self.item.title = 'something else'
+        tracks = autotag.candidate_tracks(self.candidates)
+        autotag.tag_item(self.item, known_tracks=tracks)
+        self.assertEqual(self.searches, [('some artist', 'something else')])
+
+class PruningTest(unittest.TestCase):
+    def setUp(self):
+        self.items = []
+        for i, title in enumerate(['one', 'two', 'three']):
+            self.items.append(Item({
+                'title': title, 'track': i + 1, 'artist': 'some artist',
+                'album': 'some album', 'length': 1, 'comp': False,
+                'mb_trackid': '', 'mb_albumid': '', 'mb_artistid': '',
+            }))
+        self.albums = {}
+        self.albums['some artist'] = [
+            self.info('a', 'other artist', 'other album', ['x', 'y', 'z']),
+            self.info('b', 'some artist', 'some album',
+                      ['one', 'two', 'three']),
+            self.info('c', 'some artist', 'some album', ['one', 'two']),
+            self.info('d', 'some artist', 'some album',
+                      ['one', 'two', 'tree']),
+        ]
+        self.albums[None] = [
+            self.info('e', 'Various Artists', 'some album',
+                      ['one', 'two', 'three'], va=True),
+        ]
+
+        self.searches = []
+        self.ordered = []
+        self.old_match_album = autotag.mb.match_album
+        self.old_order_items = autotag.order_items
+        def match_album(artist, album, tracks, limit):
+            self.searches.append(artist)
+            return iter(self.albums[artist])
+        def order_items(items, trackinfo):
+            self.ordered.append(trackinfo)
+            return self.old_order_items(items, trackinfo)
+        autotag.mb.match_album = match_album
+        autotag.order_items = order_items
+        self.config = _common.iconfig(None)
+
+    def tearDown(self):
+        autotag.mb.match_album = self.old_match_album
+        autotag.order_items = self.old_order_items
+
+    def info(self, album_id, artist, album, titles, va=False):
+        return {
+            'album_id': album_id, 'artist': artist, 'album': album,
+            'va': va,
+            'tracks': [{'title': t, 'id': '%s%i' % (album_id, i),
+                        'length': 1} for i, t in enumerate(titles)],
+        }
+
+    def test_bound_does_not_exceed_distance(self):
+        items = list(reversed(self.items))
+        for infos in self.albums.values():
+            for info in infos:
+                if len(info['tracks']) != len(items):
+                    continue
+                ordered = self.old_order_items(items, info['tracks'])
+                self.assertTrue(autotag.distance_bound(items, info) <=
+                                autotag.distance(ordered, info))
+
+    def test_unpruned_evaluates_every_candidate(self):
+        _, _, cands, _ = autotag.tag_album(self.items, self.config)
+        self.assertEqual([info['album_id'] for _, _, info in cands],
+                         ['b', 'd', 'a'])
+        self.assertEqual(len(self.ordered), 3)
+
+    def test_pruned_finds_same_best_candidate(self):
+        _, _, cands, rec = autotag.tag_album(self.items, self.config,
+                                             prune=True)
+        self.assertEqual(cands[0][2]['album_id'], 'b')
+        self.assertEqual(rec, autotag.RECOMMEND_STRONG)
+        self.assertEqual(len(self.ordered), 1)
+
+    def test_strong_match_skips_various_artists_search(self):
+        self.items[0].comp = True
+        autotag.tag_album(self.items, self.config, prune=True)
+        self.assertEqual(self.searches, ['some artist'])
+
+    def test_weak_match_searches_various_artists(self):
+        for item in self.items:
+            item.comp = True
+            item.album = 'an album'
+        autotag.tag_album(self.items, self.config, prune=True)
+        self.assertEqual(self.searches, ['some artist', None])
+
+    def test_unpruned_searches_various_artists(self):
+        self.items[0].comp = True
+        _, _, cands, _ = autotag.tag_album(self.items, self.config)
+        self.assertEqual(self.searches, ['some artist', None])
+        self.assertEqual(len(cands), 4)
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+    def time(self):
+        return self.now
+
+class ProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.old_time = timing.time
+        timing.time = self.clock
+
+        self.items = []
+        for i, title in enumerate(['one', 'two', 'three']):
+            self.items.append(Item({
+                'title': title, 'track': i + 1, 'artist': 'some artist',
+                'album': 'some album', 'length': 1, 'comp': False,
+                'mb_trackid': '', 'mb_albumid': '', 'mb_artistid': '',
+            }))
+        self.albums = []
+        for album_id, titles in [('a', ['x', 'y', 'z']),
+                                 ('b', ['one', 'two', 'three']),
+                                 ('c', ['one', 'two']),
+                                 ('d', ['one', 'two', 'tree'])]:
+            self.albums.append({
+                'album_id': album_id, 'artist': 'some artist',
+                'album': 'some album', 'va': False,
+                'tracks': [{'title': t, 'id': '%s%i' % (album_id, i),
+                            'length': 1} for i, t in enumerate(titles)],
+            })
+        self.old_match_album = autotag.mb.match_album
+        autotag.mb.match_album = lambda *args: iter(self.albums)
+        self.config = _common.iconfig(None)
+
+    def tearDown(self):
+        timing.time = self.old_time
+        autotag.mb.match_album = self.old_match_album
+        timing.deactivate()
+
+    def test_nested_time_not_counted_twice(self):
+        profile = timing.Profile()
+        timing.activate(profile)
+        with timing.timed('search'):
+            self.clock.now += 1.0
+            with timing.timed('query'):
+                self.clock.now += 2.0
+            self.clock.now += 4.0
+        self.clock.now += 8.0
+        timing.deactivate()
+        self.assertEqual(profile.times['search'], 5.0)
+        self.assertEqual(profile.times['query'], 2.0)
+        self.assertEqual(profile.total, 15.0)
+        self.assertEqual(profile.other(), 8.0)
+
+    def test_nothing_recorded_without_profile(self):
+        profile = timing.Profile()
+        timing.count('queries')
+        with timing.timed('search'):
+            self.clock.now += 1.0
+        self.assertEqual(timing.current(), None)
+        self.assertEqual(profile.counts['queries'], 0)
+
+    def test_tag_album_records_candidates(self):
+        profile = timing.Profile()
+        _, _, cands, _ = autotag.tag_album(self.items, self.config,
+                                           profile=profile)
+        self.assertEqual(timing.current(), None)
+        self.assertEqual(profile.counts['candidates'], 4)
+        self.assertEqual(profile.counts['evaluated'], 3)
+        self.assertEqual(profile.counts['matrix_cells'], 27)
+        self.assertEqual(profile.values['best_rank'], 1)
+        self.assertEqual(profile.values['best_distance'], cands[0][0])
+
+    def test_tag_album_records_pruning(self):
+        profile = timing.Profile()
+        autotag.tag_album(self.items, self.config, prune=True,
+                          profile=profile)
+        self.assertEqual(profile.counts['evaluated'], 2)
+        self.assertEqual(profile.counts['pruned'], 1)
+
+    def test_queries_counted(self):
+        old_wait = autotag.mb.QUERY_WAIT_TIME
+        autotag.mb.QUERY_WAIT_TIME = 0.0
+        profile = timing.Profile()
+        timing.activate(profile)
+        try:
+            self.assertEqual(autotag.mb._query_wrap(lambda: 'result'),
+                             'result')
+        finally:
+            autotag.mb.QUERY_WAIT_TIME = old_wait
+        self.assertEqual(profile.counts['queries'], 1)
+        self.assertTrue('query' in profile.times)
+
+    def test_report_row_has_every_field(self):
+        profile = timing.Profile('path')
+        profile.counts['queries'] = 3
+        profile.values['best_rank'] = 0
+        row = timing.report_row(profile)
+        self.assertEqual(len(row), len(timing.REPORT_FIELDS))
+        fields = dict(zip(timing.REPORT_FIELDS, row))
+        self.assertEqual(fields['name'], 'path')
+        self.assertEqual(fields['queries'], 3)
+        self.assertEqual(fields['best_rank'], 0)
+        self.assertEqual(fields['best_distance'], '')
+
+class ParallelEvaluationTest(unittest.TestCase):
+    def setUp(self):
+        self.items = []
+        for i, title in enumerate(['one', 'two', 'three', 'four']):
+            self.items.append(Item({
+                'title': title, 'track': 4 - i, 'artist': 'some artist',
+                'album': 'some album', 'length': 1, 'comp': False,
+                'mb_trackid': '', 'mb_albumid': '', 'mb_artistid': '',
+            }))
+        titles = ['one', 'two', 'three', 'four']
+        self.albums = []
+        for i in range(8):
+            titles = titles[1:] + titles[:1]
+            self.albums.append({
+                'album_id': 'album%i' % i, 'artist': 'some artist',
+                'album': 'some album %i' % i, 'va': False,
+                'tracks': [{'title': t, 'id': '%i-%s' % (i, t),
+                            'length': 1} for t in titles],
+            })
+        self.albums.append(dict(self.albums[0]))
+        self.albums.append({
+            'album_id': 'short', 'artist': 'some artist',
+            'album': 'some album', 'va': False,
+            'tracks': [{'title': 'one', 'id': 'short-1'}],
+        })
+        self.old_match_album = autotag.mb.match_album
+        autotag.mb.match_album = lambda *args: iter(self.albums)
+        self.config = _common.iconfig(None)
+
+    def tearDown(self):
+        autotag.stop_pool()
+        autotag.mb.match_album = self.old_match_album
+
+    def _results(self, prune=False):
+        _, _, cands, rec = autotag.tag_album(self.items, self.config,
+                                             prune=prune)
+        return [(dist, [self.items.index(i) for i in items],
+                 info['album_id']) for dist, items, info in cands], rec
+
+    def test_parallel_results_match_sequential(self):
+        expected = self._results()
+        autotag.start_pool(3)
+        self.assertEqual(self._results(), expected)
+        self.assertEqual(len(expected[0]), 8)
+
+    def test_parallel_results_use_original_items(self):
+        autotag.start_pool(2)
+        _, _, cands, _ = autotag.tag_album(self.items, self.config)
+        for _, items, _ in cands:
+            for item in items:
+                self.assertTrue(any(item is i for i in self.items))
+
+    def test_parallel_pruned_best_matches_sequential(self):
+        expected, rec = self._results(True)
+        autotag.start_pool(3)
+        results, parallel_rec = self._results(True)
+        self.assertEqual(results[0], expected[0])
+        self.assertEqual(parallel_rec, rec)
+
 class StringDistanceTest(unittest.TestCase):
     def test_equal_strings(self):
         dist = autotag.string_dist('Some String', 'Some String')
@@ -487,6 +920,248 @@ class StringDistanceTest(unittest.TestCase):
         dist = autotag.string_dist('Untitled', '[Untitled]')
         self.assertEqual(dist, 0.0)
 
+    def test_cached_distance_is_unchanged(self):
+        dist1 = autotag.string_dist('Some Song (Live)', 'some song')
+        dist2 = autotag.string_dist('Some Song (Live)', 'some song')
+        self.assertEqual(dist1, dist2)
+        self.assertTrue(dist1 > 0.0)
+
+def _levenshtein_dp(s1, s2):
+    """A nice DP edit distance implementation from Wikibooks:
+    http://en.wikibooks.org/wiki/Algorithm_implementation/Strings/
+    Levenshtein_distance#Python
+
+    This is much slower than `util.levenshtein`, which it checks.
+    """
+    if len(s1) < len(s2):
+        return _levenshtein_dp(s2, s1)
+    if not s1:
+        return len(s2)
+
+    previous_row = xrange(len(s2) + 1)
+    for i, c1 in enumerate(s1):
+        current_row = [i + 1]
+        for j, c2 in enumerate(s2):
+            insertions = previous_row[j + 1] + 1
+            deletions = current_row[j] + 1
+            substitutions = previous_row[j] + (c1 != c2)
+            current_row.append(min(insertions, deletions, substitutions))
+        previous_row = current_row
+
+    return previous_row[-1]
+
+def _reference_string_dist(str1, str2):
+    """The string distance as computed before the patterns were
+    compiled and the results cached, for comparison.
+    """
+    str1 = str1.lower()
+    str2 = str2.lower()
+    for word in autotag.SD_END_WORDS:
+        if str1.endswith(', %s' % word):
+            str1 = '%s %s' % (word, str1[:-len(word)-2])
+        if str2.endswith(', %s' % word):
+            str2 = '%s %s' % (word, str2[:-len(word)-2])
+    def basic(a, b):
+        a = re.sub(r'[^a-z0-9]', '', a.lower())
+        b = re.sub(r'[^a-z0-9]', '', b.lower())
+        if not a and not b:
+            return 0.0
+        return _levenshtein_dp(a, b) / float(max(len(a), len(b)))
+    base_dist = basic(str1, str2)
+    penalty = 0.0
+    for pat, weight in autotag.SD_PATTERNS:
+        case_str1 = re.sub(pat, '', str1)
+        case_str2 = re.sub(pat, '', str2)
+        if case_str1 != str1 or case_str2 != str2:
+            case_dist = basic(case_str1, case_str2)
+            case_delta = max(0.0, base_dist - case_dist)
+            if case_delta == 0.0:
+                continue
+            str1 = case_str1
+            str2 = case_str2
+            base_dist = case_dist
+            penalty += weight * case_delta
+    return base_dist + penalty
+
+# Title decorations that `SD_PATTERNS` and `SD_END_WORDS` look for.
+_DECORATIONS = [' (Live)', ' [Remastered]', ' (EP)', ' Single',
+                ' feat. Somebody', ' ft: Somebody', ', Pt. 2', ' Part Two',
+                ', The', ', A', ' (Radio Edit)']
+
+def _release_titles(rng, count):
+    """Generates track titles like those found on real releases, with
+    the decorations that `SD_PATTERNS` look for on some of them.
+    """
+    words = ['love', 'night', 'the', 'song', 'blue', 'heart', 'time',
+             'a', 'road', 'dream', 'fire', 'home', 'light', 'river']
+    decorations = ['', '', '', ' (Live)', ' [Remastered]', ' (EP)',
+                   ' feat. Somebody', ', Pt. 2', ', The', ' (Radio Edit)']
+    titles = []
+    for i in range(count):
+        title = ' '.join(rng.choice(words)
+                         for j in range(rng.randint(1, 4)))
+        titles.append(title.title() + rng.choice(decorations))
+    return titles
+
+def _clear_string_caches():
+    """Empty the caches behind `string_dist`."""
+    for func in (autotag._sd_normalize, autotag._sd_variants,
+                 autotag._sd_alnum, autotag._string_dist_basic,
+                 autotag._string_dist):
+        func.clear()
+
+class StringDistanceReferenceTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        # A few releases' worth of track titles from files compared with
+        # the titles from candidate releases.
+        titles = _release_titles(rng, 60)
+        self.pairs = []
+        for i in range(20):
+            self.pairs += zip(titles, rng.sample(titles, len(titles)))
+        _clear_string_caches()
+
+    def test_matches_reference(self):
+        for str1, str2 in self.pairs[:200]:
+            self.assertAlmostEqual(autotag.string_dist(str1, str2),
+                                   _reference_string_dist(str1, str2))
+
+    def test_decorations_match_reference(self):
+        # Each decoration on either string or both, with different
+        # capitalization, computed from scratch and then from the
+        # caches.
+        pairs = []
+        for base in ('Some Song', 'The Road Home'):
+            for deco1 in [''] + _DECORATIONS:
+                for deco2 in [''] + _DECORATIONS:
+                    pairs.append((base + deco1, base.upper() + deco2))
+        for i in range(2):
+            for str1, str2 in pairs:
+                self.assertAlmostEqual(autotag.string_dist(str1, str2),
+                                       _reference_string_dist(str1, str2))
+
+class EditDistanceTest(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(0)
+        def word(n):
+            return ''.join([rand.choice('abcd ') for i in range(n)])
+        self.pairs = [(word(rand.randint(0, 40)), word(rand.randint(0, 40)))
+                      for i in range(500)]
+
+    def test_simple_distances(self):
+        self.assertEqual(util.levenshtein('kitten', 'sitting'), 3)
+        self.assertEqual(util.levenshtein('', 'abc'), 3)
+        self.assertEqual(util.levenshtein('abc', ''), 3)
+        self.assertEqual(util.levenshtein('abc', 'abc'), 0)
+        self.assertEqual(util.levenshtein(u'caf\xe9', u'cafe'), 1)
+
+    def test_matches_dp(self):
+        for s1, s2 in self.pairs:
+            self.assertEqual(util.levenshtein(s1, s2),
+                             _levenshtein_dp(s1, s2))
+
+    def test_long_strings(self):
+        s1 = 'abcdefghij' * 20
+        s2 = 'abcdefghij' * 19 + 'abcdexghij'
+        self.assertEqual(util.levenshtein(s1, s2), 1)
+
+    def test_bounded_distance(self):
+        for s1, s2 in self.pairs:
+            dist = _levenshtein_dp(s1, s2)
+            for limit in (0, 3, 10):
+                if dist <= limit:
+                    self.assertEqual(util.levenshtein(s1, s2, limit), dist)
+                else:
+                    self.assertEqual(util.levenshtein(s1, s2, limit),
+                                     limit + 1)
+
+def _total(costs, matching):
+    return sum(costs[i][j] for i, j in matching)
+
+class AssignmentTest(unittest.TestCase):
+    def _random(self, rng, n):
+        return [[rng.random() for j in range(n)] for i in range(n)]
+
+    def _check_matching(self, costs, matching):
+        self.assertEqual([i for i, j in matching], range(len(costs)))
+        self.assertEqual(sorted(j for i, j in matching), range(len(costs)))
+
+    def test_empty(self):
+        self.assertEqual(util.assignment([]), [])
+
+    def test_diagonal_preferred_on_ties(self):
+        costs = [[0.0] * 4 for i in range(4)]
+        self.assertEqual(util.assignment(costs),
+                         [(0, 0), (1, 1), (2, 2), (3, 3)])
+
+    def test_separable_permutation(self):
+        costs = [[1.0, 0.0, 1.0],
+                 [1.0, 1.0, 0.0],
+                 [0.0, 1.0, 1.0]]
+        self.assertEqual(util.assignment(costs), [(0, 1), (1, 2), (2, 0)])
+
+    def test_conflicting_rows(self):
+        costs = [[0.0, 0.1, 5.0],
+                 [0.0, 5.0, 0.2],
+                 [0.0, 0.3, 9.0]]
+        self.assertEqual(util.assignment(costs), [(0, 1), (1, 2), (2, 0)])
+
+    def test_optimal_for_small_matrices(self):
+        import itertools
+        rng = random.Random(4)
+        for n in range(1, 7):
+            for trial in range(20):
+                costs = self._random(rng, n)
+                matching = util.assignment(costs)
+                self._check_matching(costs, matching)
+                best = min(sum(costs[i][p[i]] for i in range(n))
+                           for p in itertools.permutations(range(n)))
+                self.assertAlmostEqual(_total(costs, matching), best)
+
+    def test_optimal_for_large_matrix(self):
+        # An optimal matching cannot be improved by exchanging the
+        # columns of any two rows.
+        rng = random.Random(5)
+        costs = self._random(rng, 60)
+        matching = util.assignment(costs)
+        self._check_matching(costs, matching)
+        for i, j in matching:
+            for k, l in matching:
+                self.assertTrue(costs[i][j] + costs[k][l] <=
+                                costs[i][l] + costs[k][j] + 1e-9)
+
+class MemoTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        def func(a, b):
+            self.calls.append((a, b))
+            return a + b
+        self.memo = autotag._Memo(func, 2)
+
+    def test_result_remembered(self):
+        self.assertEqual(self.memo(1, 2), 3)
+        self.assertEqual(self.memo(1, 2), 3)
+        self.assertEqual(self.calls, [(1, 2)])
+
+    def test_old_entries_dropped(self):
+        for i in range(5):
+            self.memo(i, 0)
+        self.memo(0, 0)
+        self.assertEqual(len(self.calls), 6)
+
+    def test_recent_entries_kept(self):
+        self.memo(0, 0)
+        self.memo(1, 0)
+        self.memo(2, 0) # Starts a new generation.
+        self.memo(1, 0) # Still in the old one.
+        self.assertEqual(len(self.calls), 3)
+
+    def test_hits_and_misses_counted(self):
+        self.memo(0, 0)
+        self.memo(0, 0)
+        self.memo(1, 0)
+        self.assertEqual((self.memo.hits, self.memo.misses), (1, 2))
+
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
@@ -19,6 +19,7 @@ import unittest
 import shutil
 import os
 import stat
+import errno
 from os.path import join
 
 import _common
@@ -98,6 +99,32 @@ class MoveTest(unittest.TestCase):
             # Make everything writable so it can be cleaned up.
             os.chmod(self.path, 0777)
             os.chmod(self.i.path, 0777)
+
+    def test_move_across_devices_keeps_stat(self):
+        os.chmod(self.path, 0640)
+        os.utime(self.path, (1000000000, 1000000000))
+        def cross_device_rename(src, dst):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        old_rename = os.rename
+        os.rename = cross_device_rename
+        try:
+            self.i.move(self.lib)
+        finally:
+            os.rename = old_rename
+        self.assertFalse(os.path.exists(self.path))
+        st = os.stat(self.dest)
+        self.assertEqual(stat.S_IMODE(st.st_mode), 0640)
+        self.assertEqual(int(st.st_mtime), 1000000000)
+
+    def test_copy_in_several_chunks(self):
+        old_size = util.COPY_BUFFER_SIZE
+        util.COPY_BUFFER_SIZE = 1000
+        try:
+            self.i.move(self.lib, copy=True)
+        finally:
+            util.COPY_BUFFER_SIZE = old_size
+        self.assertEqual(open(self.path, 'rb').read(),
+                         open(self.dest, 'rb').read())
     
 class HelperTest(unittest.TestCase):
     def test_ancestry_works_on_file(self):
@@ -17,11 +17,18 @@
 import unittest
 import os
 import shutil
+import csv
+import pickle
+from StringIO import StringIO
 
 import _common
 from beets import library
 from beets import importer
+from beets.autotag import timing
 from beets import mediafile
+from beets import util
+from beets import plugins
+from beets.util import pipeline
 
 TEST_TITLES = ('The Opener','The Second Track','The Last Track')
 class NonAutotaggedImportTest(unittest.TestCase):
@@ -97,7 +104,24 @@ class NonAutotaggedImportTest(unittest.TestCase):
                 choose_match_func = None,
                 should_resume_func = None,
                 singletons=False,
+                interactive_autotag=False,
                 choose_item_func = None,
+                resolve=False,
+                manifest=None,
+                watch=None,
+                commit_every=1,
+                commit_interval=0,
+                transfer_threads=1,
+                transfer_per_device=0,
+                plan=None,
+                apply_plan=None,
+                lookup_threads=1,
+                pool_size=0,
+                time_limit=None,
+                lookup_timeout=None,
+                art_cache=None,
+                autotag_processes=0,
+                tag_report=None,
         )
 
         return paths
@@ -163,6 +187,19 @@ class ImportApplyTest(unittest.TestCase, _common.ExtraAsserts):
     def tearDown(self):
         shutil.rmtree(self.libdir)
 
+    def _apply_coro(self, config):
+        # Chain the transfer and apply stages.
+        transfer = importer.transfer_files(config)
+        applier = importer.apply_choices(config)
+        def coro():
+            while True:
+                task = yield
+                applier.send(transfer.send(task))
+        out = coro()
+        for c in (transfer, applier, out):
+            c.next() # Prime coroutine.
+        return out
+
     def _call_apply(self, coro, items, info):
         task = importer.ImportTask(None, None, None)
         task.is_album = True
@@ -176,47 +213,570 @@ class ImportApplyTest(unittest.TestCase, _common.ExtraAsserts):
         coro.send(task)
 
     def test_apply_no_delete(self):
-        coro = importer.apply_choices(_common.iconfig(self.lib, delete=False))
-        coro.next() # Prime coroutine.
+        coro = self._apply_coro(_common.iconfig(self.lib, delete=False))
         self._call_apply(coro, [self.i], self.info)
         self.assertExists(self.srcpath)
 
     def test_apply_with_delete(self):
-        coro = importer.apply_choices(_common.iconfig(self.lib, delete=True))
-        coro.next() # Prime coroutine.
+        coro = self._apply_coro(_common.iconfig(self.lib, delete=True))
         self._call_apply(coro, [self.i], self.info)
         self.assertNotExists(self.srcpath)
 
     def test_apply_asis_uses_album_path(self):
-        coro = importer.apply_choices(_common.iconfig(self.lib))
-        coro.next() # Prime coroutine.
+        coro = self._apply_coro(_common.iconfig(self.lib))
         self._call_apply_choice(coro, [self.i], importer.action.ASIS)
         self.assertExists(
             os.path.join(self.libdir, self.lib.path_formats['default']+'.mp3')
         )
 
     def test_apply_match_uses_album_path(self):
-        coro = importer.apply_choices(_common.iconfig(self.lib))
-        coro.next() # Prime coroutine.
+        coro = self._apply_coro(_common.iconfig(self.lib))
         self._call_apply(coro, [self.i], self.info)
         self.assertExists(
             os.path.join(self.libdir, self.lib.path_formats['default']+'.mp3')
         )
 
     def test_apply_as_tracks_uses_singleton_path(self):
-        coro = importer.apply_choices(_common.iconfig(self.lib))
-        coro.next() # Prime coroutine.
+        coro = self._apply_coro(_common.iconfig(self.lib))
         self._call_apply_choice(coro, [self.i], importer.action.TRACKS)
         self.assertExists(
             os.path.join(self.libdir, self.lib.path_formats['singleton']+'.mp3')
         )
 
+    def test_apply_as_tracks_announces_each_item(self):
+        imported = []
+        def listener(lib, item):
+            imported.append(item)
+        plugins._event_handlers['item_imported'].append(listener)
+        try:
+            coro = self._apply_coro(_common.iconfig(self.lib))
+            self._call_apply_choice(coro, [self.i], importer.action.TRACKS)
+        finally:
+            plugins._event_handlers['item_imported'].remove(listener)
+        self.assertEqual(imported, [self.i])
+
+    def test_apply_with_threaded_transfer(self):
+        self.lib.path_formats['default'] = '$title'
+        config = _common.iconfig(self.lib, threaded=True,
+                                 transfer_threads=3, transfer_per_device=1)
+        coro = self._apply_coro(config)
+        items = []
+        for i in range(5):
+            path = os.path.join(self.libdir, 'src%i.mp3' % i)
+            shutil.copy(self.srcpath, path)
+            item = library.Item.from_path(path)
+            item.title = 'track %i' % i
+            item.comp = False
+            items.append(item)
+        self._call_apply_choice(coro, items, importer.action.ASIS)
+        for i in range(5):
+            self.assertExists(os.path.join(self.libdir, 'track %i.mp3' % i))
+
+    def test_apply_uses_fetched_art(self):
+        artpath = os.path.join(self.libdir, 'fetched.jpg')
+        shutil.copy(self.srcpath, artpath)
+        coro = self._apply_coro(_common.iconfig(self.lib, art=True))
+        task = importer.ImportTask(None, None, None)
+        task.is_album = True
+        task.set_choice((self.info, [self.i]))
+        task.art_path = artpath
+        coro.send(task)
+        self.assertExists(os.path.join(self.libdir, 'cover.jpg'))
+
+    def test_fetch_art_uses_cache(self):
+        class DummyCache(object):
+            def art_for_album(self, info):
+                return 'cached/' + info['album_id']
+        fetcher = importer.fetch_art(_common.iconfig(self.lib, art=True),
+                                     DummyCache())
+        fetcher.next()
+        task = importer.ImportTask(None, None, None)
+        task.is_album = True
+        task.set_choice((self.info, [self.i]))
+        fetcher.send(task)
+        self.assertEqual(task.art_path, 'cached/albumid')
+
+    def test_fetch_art_skips_deferred_task(self):
+        class DummyCache(object):
+            def art_for_album(self, info):
+                raise AssertionError('fetched art for a deferred task')
+        fetcher = importer.fetch_art(_common.iconfig(self.lib, art=True),
+                                     DummyCache())
+        fetcher.next()
+        task = importer.ImportTask(None, 'path', [self.i])
+        task.set_match(None, None, [], None)
+        task.set_choice(importer.action.DEFER)
+        fetcher.send(task)
+        self.assertEqual(task.art_path, None)
+
     def test_apply_sentinel(self):
-        coro = importer.apply_choices(_common.iconfig(self.lib))
-        coro.next()
+        coro = self._apply_coro(_common.iconfig(self.lib))
         coro.send(importer.ImportTask.done_sentinel('toppath'))
         # Just test no exception for now.
 
+class CommitBatchTest(unittest.TestCase):
+    class DummyLibrary(object):
+        def __init__(self):
+            self.saves = 0
+        def save(self):
+            self.saves += 1
+
+    def setUp(self):
+        self.lib = self.DummyLibrary()
+
+    def _task(self, choice=importer.action.ASIS):
+        task = importer.ImportTask(None, None, [])
+        task.is_album = True
+        task.set_choice(choice)
+        return task
+
+    def test_commits_every_n_tasks(self):
+        batch = importer._CommitBatch(self.lib, _common.iconfig(
+            self.lib, commit_every=2
+        ))
+        batch.add(self._task())
+        self.assertEqual(self.lib.saves, 0)
+        batch.add(self._task())
+        self.assertEqual(self.lib.saves, 1)
+
+    def test_commits_after_interval(self):
+        batch = importer._CommitBatch(self.lib, _common.iconfig(
+            self.lib, commit_every=0, commit_interval=60
+        ))
+        batch.add(self._task())
+        self.assertEqual(self.lib.saves, 0)
+        batch.last_commit -= 60
+        batch.add(self._task())
+        self.assertEqual(self.lib.saves, 1)
+
+    def test_commits_after_interval_without_new_task(self):
+        batch = importer._CommitBatch(self.lib, _common.iconfig(
+            self.lib, commit_every=0, commit_interval=60
+        ))
+        batch.add(self._task())
+        batch.check()
+        self.assertEqual(self.lib.saves, 0)
+        batch.last_commit -= 60
+        batch.check()
+        self.assertEqual(self.lib.saves, 1)
+
+    def test_final_commit(self):
+        batch = importer._CommitBatch(self.lib, _common.iconfig(
+            self.lib, commit_every=10
+        ))
+        batch.add(self._task())
+        batch.commit()
+        self.assertEqual(self.lib.saves, 1)
+        batch.commit()
+        self.assertEqual(self.lib.saves, 1)
+
+    def test_skipped_tasks_do_not_save(self):
+        batch = importer._CommitBatch(self.lib, _common.iconfig(self.lib))
+        batch.add(self._task(importer.action.SKIP))
+        self.assertEqual(self.lib.saves, 0)
+
+    def test_delete_deferred_until_commit(self):
+        path = os.path.join(_common.RSRC, 'testfile')
+        open(path, 'w').close()
+        batch = importer._CommitBatch(self.lib, _common.iconfig(
+            self.lib, commit_every=2
+        ))
+        batch.add(self._task(), [path])
+        self.assertTrue(os.path.exists(path))
+        batch.add(self._task())
+        self.assertFalse(os.path.exists(path))
+
+class PendingStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.pending_file = os.path.join(_common.RSRC, 'testpending')
+        self.orig_pending_file = importer.PENDING_FILE
+        importer.PENDING_FILE = self.pending_file
+
+        self.items = [_common.item(), _common.item()]
+        self.items[0].title = 'first'
+        self.items[1].title = 'second'
+        self.info = {'artist': 'some artist', 'album': 'some album'}
+        self.task = importer.ImportTask('toppath', 'path', self.items)
+        self.task.set_match('artist', 'album',
+                            [(0.5, self.items[::-1], self.info)],
+                            'RECOMMEND_NONE')
+
+    def tearDown(self):
+        importer.PENDING_FILE = self.orig_pending_file
+        if os.path.exists(self.pending_file):
+            os.remove(self.pending_file)
+
+    def test_empty_store(self):
+        self.assertEqual(importer.pending_get(), [])
+
+    def test_entry_round_trip(self):
+        importer.pending_add(self.task.pending_entry())
+        entries = importer.pending_get()
+        self.assertEqual(len(entries), 1)
+
+        task = importer.ImportTask.from_pending(entries[0])
+        self.assertEqual(task.path, 'path')
+        self.assertEqual(task.pending_key, 'path')
+        self.assertEqual(task.cur_artist, 'artist')
+        self.assertEqual([i.title for i in task.items], ['first', 'second'])
+        dist, items, info = task.candidates[0]
+        self.assertEqual(dist, 0.5)
+        self.assertEqual([i.title for i in items], ['second', 'first'])
+        self.assertEqual(info, self.info)
+
+    def test_later_entry_replaces_earlier(self):
+        importer.pending_add(self.task.pending_entry())
+        self.task.cur_album = 'another album'
+        importer.pending_add(self.task.pending_entry())
+        entries = importer.pending_get()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['cur_album'], 'another album')
+
+    def test_remove_entry(self):
+        importer.pending_add(self.task.pending_entry())
+        importer.pending_remove(['path'])
+        self.assertEqual(importer.pending_get(), [])
+
+    def test_readded_entry_after_removal(self):
+        importer.pending_add(self.task.pending_entry())
+        importer.pending_remove(['path'])
+        importer.pending_add(self.task.pending_entry())
+        self.assertEqual(len(importer.pending_get()), 1)
+
+    def test_compact_drops_removed_entries(self):
+        importer.pending_add(self.task.pending_entry())
+        self.task.path = 'other path'
+        importer.pending_add(self.task.pending_entry())
+        importer.pending_remove(['path'])
+        size = os.path.getsize(self.pending_file)
+        files = sorted(os.listdir(_common.RSRC))
+        importer.pending_compact()
+        self.assertTrue(os.path.getsize(self.pending_file) < size)
+        self.assertEqual([e['key'] for e in importer.pending_get()],
+                         ['other path'])
+        # No temporary file is left behind.
+        self.assertEqual(sorted(os.listdir(_common.RSRC)), files)
+
+    def test_compact_deletes_empty_store(self):
+        importer.pending_add(self.task.pending_entry())
+        importer.pending_remove(['path'])
+        importer.pending_compact()
+        self.assertFalse(os.path.exists(self.pending_file))
+
+    def test_truncated_entry_ignored(self):
+        importer.pending_add(self.task.pending_entry())
+        f = open(self.pending_file, 'ab')
+        f.write(pickle.dumps({'key': 'other'}, pickle.HIGHEST_PROTOCOL)[:-4])
+        f.close()
+        self.assertEqual([e['key'] for e in importer.pending_get()],
+                         ['path'])
+
+    def test_apply_stores_deferred_task(self):
+        coro = importer.apply_choices(_common.iconfig(None))
+        coro.next() # Prime coroutine.
+        self.task.set_choice(importer.action.DEFER)
+        coro.send(self.task)
+        entries = importer.pending_get()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['key'], 'path')
+
+    def test_idle_apply_commits_after_interval(self):
+        class FakeTime(object):
+            now = 1000.0
+            def time(self):
+                return self.now
+        clock = FakeTime()
+        old_time = importer.time
+        importer.time = clock
+        try:
+            importer.pending_add(self.task.pending_entry())
+            task = importer.ImportTask.from_pending(
+                importer.pending_get()[0]
+            )
+            task.set_choice(importer.action.SKIP)
+            coro = importer.apply_choices(_common.iconfig(
+                None, commit_every=0, commit_interval=60
+            ))
+            coro.next() # Prime coroutine.
+            coro.send(task)
+            coro.send(pipeline.IDLE)
+            self.assertEqual(len(importer.pending_get()), 1)
+            clock.now += 60
+            coro.send(pipeline.IDLE)
+            self.assertEqual(importer.pending_get(), [])
+        finally:
+            importer.time = old_time
+
+    def test_read_pending_yields_album_tasks(self):
+        importer.pending_add(self.task.pending_entry())
+        tasks = list(importer.read_pending(_common.iconfig(None)))
+        self.assertEqual(len(tasks), 1)
+        self.assertTrue(tasks[0].is_album)
+        tasks = list(importer.read_pending(
+            _common.iconfig(None, singletons=True)
+        ))
+        self.assertEqual(tasks, [])
+
+class TaskWeightTest(unittest.TestCase):
+    def test_album_weight_counts_candidate_tracks(self):
+        items = [_common.item(), _common.item()]
+        task = importer.ImportTask(None, 'path', items)
+        self.assertEqual(importer._task_weight(task), 3)
+        info = {'tracks': [{}, {}, {}]}
+        task.set_match(None, None, [(0.0, items, info)] * 2, None)
+        self.assertEqual(importer._task_weight(task), 9)
+
+    def test_item_weight_counts_candidates(self):
+        task = importer.ImportTask.item_task(_common.item())
+        task.set_item_match([(0.0, {}), (0.1, {})], None)
+        self.assertEqual(importer._task_weight(task), 3)
+
+class TagReportTest(unittest.TestCase):
+    def setUp(self):
+        self.old_match_album = importer.autotag.mb.match_album
+        importer.autotag.mb.match_album = lambda *args: iter([])
+
+    def tearDown(self):
+        importer.autotag.mb.match_album = self.old_match_album
+
+    def test_lookup_writes_report_row(self):
+        report = StringIO()
+        config = _common.iconfig(None, tag_report=report)
+        item = _common.item()
+        item.mb_albumid = ''
+        coro = importer.initial_lookup(config)
+        coro.next()
+        coro.send(importer.ImportTask(None, 'path', [item]))
+        rows = list(csv.reader(StringIO(report.getvalue())))
+        self.assertEqual(len(rows), 1)
+        fields = dict(zip(timing.REPORT_FIELDS, rows[0]))
+        self.assertEqual(fields['name'], 'path')
+        self.assertEqual(fields['candidates'], '0')
+
+class TaskPayloadTest(unittest.TestCase):
+    def setUp(self):
+        self.items = [_common.item(), _common.item()]
+        self.items[1].title = 'other title'
+        self.task = importer.ImportTask(None, 'path', self.items)
+
+    def test_compacted_items_restored(self):
+        self.task.compact()
+        items = self.task.items
+        self.assertEqual([i.record for i in items],
+                         [i.record for i in self.items])
+        self.assertTrue(self.task.items is items)
+
+    def test_item_count_does_not_restore(self):
+        self.task.compact()
+        self.assertEqual(self.task.item_count(), 2)
+        self.assertEqual(importer._task_weight(self.task), 3)
+        self.assertTrue(self.task._items is None)
+
+    def test_compacted_candidates_restored(self):
+        info = {'tracks': [{}, {}]}
+        self.task.set_match(None, None, [(0.0, self.items[::-1], info)],
+                            None)
+        self.task.compact()
+        self.assertEqual(importer._task_weight(self.task), 5)
+        self.assertTrue(self.task._items is None)
+        dist, items, cinfo = self.task.candidates[0]
+        self.assertEqual(items, self.task.items[::-1])
+        self.assertTrue(items[0] is self.task.items[1])
+        self.assertTrue(cinfo is info)
+
+    def _lookup(self, **kwargs):
+        info = {'tracks': [{}, {}]}
+        candidates = [(0.1, self.items, info), (0.2, self.items[::-1], info)]
+        old_tag_album = importer.autotag.tag_album
+        importer.autotag.tag_album = \
+            lambda *args, **kwargs: (None, None, candidates, None)
+        try:
+            coro = importer.initial_lookup(_common.iconfig(None, **kwargs))
+            coro.next() # Prime coroutine.
+            coro.send(self.task)
+        finally:
+            importer.autotag.tag_album = old_tag_album
+
+    def test_lookup_compacts_task(self):
+        self._lookup(quiet=False)
+        self.assertTrue(self.task._items is None)
+        self.assertEqual(len(self.task.candidates), 2)
+
+    def test_quiet_lookup_keeps_best_candidate(self):
+        self._lookup(quiet=True, quiet_fallback=importer.action.SKIP)
+        self.assertEqual([c[0] for c in self.task.candidates], [0.1])
+
+    def test_quiet_deferring_lookup_keeps_candidates(self):
+        self._lookup(quiet=True, quiet_fallback=importer.action.DEFER)
+        self.assertEqual(len(self.task.candidates), 2)
+
+    def test_choice_drops_candidates(self):
+        info = {'tracks': [{}, {}]}
+        self.task.set_match(None, None, [(0.0, self.items, info)], None)
+        self.task.set_choice((info, self.items))
+        self.assertEqual(self.task.candidates, None)
+        self.assertEqual(importer._task_weight(self.task), 3)
+
+    def test_defer_keeps_candidates(self):
+        info = {'tracks': [{}, {}]}
+        self.task.set_match(None, None, [(0.0, self.items, info)], None)
+        self.task.set_choice(importer.action.DEFER)
+        self.assertEqual(len(self.task.candidates), 1)
+
+    def test_item_choice_drops_match(self):
+        task = importer.ImportTask.item_task(_common.item())
+        task.set_item_match([(0.0, {})], None)
+        task.set_choice(importer.action.ASIS)
+        self.assertEqual(task.item_match, None)
+
+class PlanTest(unittest.TestCase, _common.ExtraAsserts):
+    def setUp(self):
+        self.libdir = os.path.join(_common.RSRC, 'testlibdir')
+        os.mkdir(self.libdir)
+        self.lib = library.Library(':memory:', self.libdir)
+        self.lib.path_formats = {'default': '$title'}
+
+        self.items = []
+        for i in range(2):
+            path = os.path.join(self.libdir, 'src%i.mp3' % i)
+            shutil.copy(os.path.join(_common.RSRC, 'full.mp3'), path)
+            item = library.Item.from_path(path)
+            item.comp = False
+            item.title = 'track %i' % i
+            self.items.append(item)
+        self.task = importer.ImportTask(None, 'path', self.items)
+        self.task.is_album = True
+        self.task.set_choice(importer.action.ASIS)
+
+    def tearDown(self):
+        shutil.rmtree(self.libdir)
+
+    def _plan(self):
+        planfile = StringIO()
+        coro = importer.plan_choices(
+            _common.iconfig(self.lib, plan=planfile)
+        )
+        coro.next() # Prime coroutine.
+        coro.send(self.task)
+        planfile.seek(0)
+        return list(importer.plan_entries(planfile))
+
+    def test_plan_records_destinations(self):
+        entries = self._plan()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['dests'], [
+            util.normpath(os.path.join(self.libdir, 'track 0.mp3')),
+            util.normpath(os.path.join(self.libdir, 'track 1.mp3')),
+        ])
+        self.assertEqual(entries[0]['conflicts'], [None, None])
+        self.assertEqual(entries[0]['sizes'][0],
+                         os.path.getsize(self.items[0].path))
+
+    def test_plan_has_no_side_effects(self):
+        self._plan()
+        self.assertNotExists(os.path.join(self.libdir, 'track 0.mp3'))
+        self.assertEqual(list(self.lib.items()), [])
+
+    def test_plan_detects_conflicts(self):
+        self.items[1].title = 'track 0'
+        open(os.path.join(self.libdir, 'track 0.mp3'), 'w').close()
+        entries = self._plan()
+        self.assertEqual(entries[0]['conflicts'], ['exists', 'duplicate'])
+
+    def test_task_from_plan(self):
+        entry = self._plan()[0]
+        task = importer.ImportTask.from_plan(entry)
+        self.assertTrue(task.is_album)
+        self.assertEqual(task.choice_flag, importer.action.ASIS)
+        self.assertEqual(task.dests, entry['dests'])
+        self.assertEqual([i.title for i in task.items],
+                         ['track 0', 'track 1'])
+
+    def test_transfer_uses_planned_destinations(self):
+        entry = self._plan()[0]
+        entry['dests'][0] = os.path.join(self.libdir, 'elsewhere.mp3')
+        coro = importer.transfer_files(_common.iconfig(self.lib))
+        coro.next() # Prime coroutine.
+        coro.send(importer.ImportTask.from_plan(entry))
+        self.assertExists(os.path.join(self.libdir, 'elsewhere.mp3'))
+        self.assertExists(os.path.join(self.libdir, 'track 1.mp3'))
+
+    def _defer(self):
+        self.task = importer.ImportTask(None, 'path', self.items)
+        self.task.set_match('artist', 'album', [], 'RECOMMEND_NONE')
+        self.task.set_choice(importer.action.DEFER)
+
+    def test_plan_records_deferred_task(self):
+        self._defer()
+        entries = self._plan()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['choice'], 'DEFER')
+        self.assertEqual(entries[0]['dests'], [None, None])
+        self.assertEqual(entries[0]['pending']['key'], 'path')
+
+    def test_applied_plan_defers_task(self):
+        self._defer()
+        task = importer.ImportTask.from_plan(self._plan()[0])
+        self.assertEqual(task.choice_flag, importer.action.DEFER)
+
+        pending_file = os.path.join(_common.RSRC, 'testpending')
+        orig_pending_file = importer.PENDING_FILE
+        importer.PENDING_FILE = pending_file
+        try:
+            coro = importer.apply_choices(_common.iconfig(self.lib))
+            coro.next() # Prime coroutine.
+            coro.send(task)
+            coro.close()
+            entries = importer.pending_get()
+        finally:
+            importer.PENDING_FILE = orig_pending_file
+            if os.path.exists(pending_file):
+                os.remove(pending_file)
+        self.assertEqual([e['key'] for e in entries], ['path'])
+        self.assertEqual(list(self.lib.items()), [])
+
+class ManifestTest(unittest.TestCase):
+    def _paths(self, text):
+        return list(util.manifest_paths(StringIO(text)))
+
+    def test_newline_separated(self):
+        self.assertEqual(self._paths('/a/b.mp3\n/a/c.mp3\n'),
+                         ['/a/b.mp3', '/a/c.mp3'])
+
+    def test_nul_separated(self):
+        self.assertEqual(self._paths('/a/b\nc.mp3\0/a/d.mp3\0'),
+                         ['/a/b\nc.mp3', '/a/d.mp3'])
+
+    def test_missing_final_separator(self):
+        self.assertEqual(self._paths('/a/b.mp3\n/a/c.mp3'),
+                         ['/a/b.mp3', '/a/c.mp3'])
+
+    def test_blank_lines_ignored(self):
+        self.assertEqual(self._paths('/a/b.mp3\r\n\n/a/c.mp3\n'),
+                         ['/a/b.mp3', '/a/c.mp3'])
+
+    def test_entry_spanning_chunks(self):
+        path = '/' + 'x' * util.MANIFEST_CHUNK_SIZE
+        self.assertEqual(self._paths(path + '\n/y\n'), [path, '/y'])
+
+    def test_nul_separated_with_long_first_path(self):
+        path = '/' + 'x' * util.MANIFEST_CHUNK_SIZE + '\ny.mp3'
+        self.assertEqual(self._paths(path + '\0/a/d.mp3\0'),
+                         [path, '/a/d.mp3'])
+
+    def test_nul_separated_in_small_reads(self):
+        class SmallReads(object):
+            def __init__(self, text):
+                self.fh = StringIO(text)
+            def read(self, size):
+                return self.fh.read(min(size, 3))
+        paths = util.manifest_paths(SmallReads('/a/b.mp3\0/a/c.mp3\0'))
+        self.assertEqual(list(paths), ['/a/b.mp3', '/a/c.mp3'])
+
+    def test_paths_normalized(self):
+        self.assertEqual(self._paths('a/../b.mp3\n'),
+                         [os.path.abspath('b.mp3')])
+
 class DuplicateCheckTest(unittest.TestCase):
     def setUp(self):
         self.lib = library.Library(':memory:')
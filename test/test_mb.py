@@ -17,6 +17,7 @@
 
 import unittest
 import time
+import pickle
 import musicbrainz2.model
 import musicbrainz2.webservice as mbws
 
@@ -186,6 +187,47 @@ class MBReleaseDictTest(unittest.TestCase):
         d = mb.release_dict(release)
         self.assertTrue(d['va'])
 
+class ReleaseTracksTest(unittest.TestCase):
+    def setUp(self):
+        self.fetched = []
+        self.old_release_info = mb.release_info
+        def release_info(release_id):
+            self.fetched.append(release_id)
+            track = musicbrainz2.model.Track()
+            track.title = 'TITLE'
+            track.id = 'dom/ID'
+            return [track], 'RG ID'
+        mb.release_info = release_info
+
+    def tearDown(self):
+        mb.release_info = self.old_release_info
+
+    def test_len_uses_count_without_fetching(self):
+        tracks = mb.ReleaseTracks('dom/ALBUM ID', 12)
+        self.assertEqual(len(tracks), 12)
+        self.assertEqual(self.fetched, [])
+
+    def test_len_fetches_without_count(self):
+        tracks = mb.ReleaseTracks('dom/ALBUM ID')
+        self.assertEqual(len(tracks), 1)
+        self.assertEqual(self.fetched, ['dom/ALBUM ID'])
+
+    def test_tracks_fetched_once(self):
+        tracks = mb.ReleaseTracks('dom/ALBUM ID', 1)
+        self.assertEqual(tracks[0]['title'], 'TITLE')
+        self.assertEqual([t['id'] for t in tracks], ['ID'])
+        self.assertEqual(self.fetched, ['dom/ALBUM ID'])
+
+    def test_fetched_length_overrides_count(self):
+        tracks = mb.ReleaseTracks('dom/ALBUM ID', 12)
+        list(tracks)
+        self.assertEqual(len(tracks), 1)
+
+    def test_pickles_as_list(self):
+        tracks = mb.ReleaseTracks('dom/ALBUM ID', 1)
+        out = pickle.loads(pickle.dumps(tracks))
+        self.assertEqual(out, [{'title': 'TITLE', 'id': 'ID'}])
+
 class QuerySanitationTest(unittest.TestCase):
     def test_special_char_escaped(self):
         res = mb._lucene_escape('!')
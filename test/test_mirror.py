@@ -0,0 +1,294 @@
+# This file is part of beets.
+# Copyright 2011, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Tests for the local MusicBrainz mirror.
+"""
+import unittest
+import os
+import shutil
+
+import _common
+from beets.autotag import mb
+from beets.autotag import mirror
+
+def _release(album_id, artist, album, titles, va=False, **kwargs):
+    info = {
+        'album_id': album_id, 'album': album,
+        'artist': artist, 'artist_id': 'artist-' + artist,
+        'asin': None, 'albumtype': 'album', 'va': va,
+        'tracks': [{'title': title, 'id': '%s-%i' % (album_id, i),
+                    'length': 100.0 + i} for i, title in enumerate(titles)],
+    }
+    info.update(kwargs)
+    return info
+
+class GramsTest(unittest.TestCase):
+    def test_words_padded(self):
+        self.assertEqual(mirror.grams('ab'), set([u'$ab', u'ab$']))
+
+    def test_case_and_accents_ignored(self):
+        self.assertEqual(mirror.grams(u'Bj\xf6rk'), mirror.grams('bjork'))
+
+    def test_punctuation_ignored(self):
+        self.assertEqual(mirror.grams('!!!'), set())
+        self.assertEqual(mirror.grams('a-ha'), mirror.grams('a ha'))
+
+class MirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.mirror = mirror.Mirror(':memory:')
+        self.mirror.add_release(_release(
+            'a1', 'The Beatles', 'Abbey Road',
+            ['Come Together', 'Something'], year=1969
+        ))
+        self.mirror.add_release(_release(
+            'a2', 'The Beatles', 'Abbey Road',
+            ['Come Together', 'Something', 'Her Majesty']
+        ))
+        self.mirror.add_release(_release(
+            'a3', 'Abbey Lincoln', 'Abbey Is Blue', ['Afro Blue']
+        ))
+        va = _release('a4', 'Various Artists', 'Abbey Road Covers',
+                      ['Something'], va=True)
+        va['tracks'][0]['artist'] = 'Someone'
+        va['tracks'][0]['artist_id'] = 'artist-someone'
+        self.mirror.add_release(va)
+        self.mirror.commit()
+
+    def test_match_album_ranks_by_similarity(self):
+        ids = [info['album_id'] for info in
+               self.mirror.match_album('The Beatles', 'Abbey Road')]
+        self.assertEqual(ids[:2], ['a1', 'a2'])
+        self.assertEqual(ids[2:], ['a4', 'a3'])
+
+    def test_match_album_prefers_track_count(self):
+        ids = [info['album_id'] for info in
+               self.mirror.match_album('The Beatles', 'Abbey Road', 3)]
+        self.assertEqual(ids[0], 'a2')
+
+    def test_match_album_tolerates_typos(self):
+        infos = list(self.mirror.match_album('beatles', 'abey road', 2))
+        self.assertEqual(infos[0]['album_id'], 'a1')
+
+    def test_match_album_limit(self):
+        infos = list(self.mirror.match_album('The Beatles', 'Abbey Road',
+                                             limit=1))
+        self.assertEqual(len(infos), 1)
+
+    def test_match_album_various_artists(self):
+        infos = list(self.mirror.match_album(None, 'Abbey Road'))
+        self.assertEqual([info['album_id'] for info in infos], ['a4'])
+        self.assertTrue(infos[0]['va'])
+
+    def test_match_album_no_words(self):
+        self.assertEqual(list(self.mirror.match_album('x', '!!!')), [])
+
+    def test_release_dict(self):
+        info = self.mirror.album_for_id('a1')
+        self.assertEqual(info['album'], 'Abbey Road')
+        self.assertEqual(info['artist'], 'The Beatles')
+        self.assertEqual(info['artist_id'], 'artist-The Beatles')
+        self.assertEqual(info['year'], 1969)
+        self.assertFalse('month' in info)
+        self.assertFalse(info['va'])
+        self.assertEqual(info['tracks'], [
+            {'title': 'Come Together', 'id': 'a1-0', 'length': 100.0},
+            {'title': 'Something', 'id': 'a1-1', 'length': 101.0},
+        ])
+
+    def test_album_for_missing_id(self):
+        self.assertEqual(self.mirror.album_for_id('nothing'), None)
+
+    def test_match_track_uses_artist(self):
+        infos = list(self.mirror.match_track('Someone', 'Something'))
+        self.assertEqual(infos[0]['id'], 'a4-0')
+        self.assertEqual(infos[0]['artist'], 'Someone')
+        infos = list(self.mirror.match_track('The Beatles', 'Something'))
+        self.assertEqual(infos[0]['artist'], 'The Beatles')
+        self.assertEqual(infos[0]['artist_id'], 'artist-The Beatles')
+
+    def test_track_for_id(self):
+        info = self.mirror.track_for_id('a3-0')
+        self.assertEqual(info['title'], 'Afro Blue')
+        self.assertEqual(info['artist'], 'Abbey Lincoln')
+        self.assertEqual(self.mirror.track_for_id('nothing'), None)
+
+class BackendTest(unittest.TestCase):
+    def setUp(self):
+        self.mirror = mirror.Mirror(':memory:')
+        self.mirror.add_release(_release('a1', 'Artist', 'Album', ['Track']))
+        self.mirror.commit()
+        mb.set_backend(self.mirror)
+
+    def tearDown(self):
+        mb.set_backend(None)
+
+    def test_lookups_use_backend(self):
+        info = mb.match_album('Artist', 'Album', 1).next()
+        self.assertEqual(info['album_id'], 'a1')
+        self.assertEqual(mb.match_track('Artist', 'Track').next()['id'],
+                         'a1-0')
+        self.assertEqual(mb.album_for_id('a1')['album'], 'Album')
+        self.assertEqual(mb.track_for_id('a1-0')['title'], 'Track')
+
+class CommonTitleTest(unittest.TestCase):
+    def setUp(self):
+        self.mirror = mirror.Mirror(':memory:')
+        for i in range(30):
+            self.mirror.add_release(_release(
+                'other%i' % i, 'Band %i' % i, 'Album %i' % i,
+                ['Intro', 'Song %i' % i]
+            ))
+        self.mirror.add_release(_release(
+            'target', 'Zyxwvut', 'Debut', ['Intro (Live)', 'Outro']
+        ))
+        self.mirror.commit()
+        self.old_min = mirror.COMMON_GRAM_MIN
+        self.old_share = mirror.COMMON_GRAM_SHARE
+
+    def tearDown(self):
+        mirror.COMMON_GRAM_MIN = self.old_min
+        mirror.COMMON_GRAM_SHARE = self.old_share
+
+    def test_artist_picks_track_among_better_titles(self):
+        # The other artists' tracks match the title better.
+        infos = list(self.mirror.match_track('Zyxwvut', 'Intro', limit=1))
+        self.assertEqual(infos[0]['id'], 'target-0')
+        self.assertEqual(infos[0]['artist'], 'Zyxwvut')
+
+    def test_common_grams_not_searched(self):
+        mirror.COMMON_GRAM_MIN = 0
+        mirror.COMMON_GRAM_SHARE = 0.4
+        # Every "intro" trigram is in more than 40% of the titles;
+        # only the rarest is kept.
+        self.assertEqual(len(self.mirror._search_grams(
+            mirror.TRACK_TITLE, mirror.grams('Intro')
+        )), 1)
+        self.assertEqual(sorted(self.mirror._search_grams(
+            mirror.TRACK_TITLE, mirror.grams('Intro Live')
+        )), sorted(mirror.grams('Live')))
+
+    def test_track_found_with_common_grams_left_out(self):
+        mirror.COMMON_GRAM_MIN = 0
+        mirror.COMMON_GRAM_SHARE = 0.4
+        infos = list(self.mirror.match_track('Zyxwvut', 'Intro', limit=1))
+        self.assertEqual(infos[0]['id'], 'target-0')
+
+    def test_unknown_grams_not_searched(self):
+        self.assertEqual(self.mirror._search_grams(
+            mirror.TRACK_TITLE, mirror.grams('qqqq')
+        ), [])
+        self.assertEqual(list(self.mirror.match_track(None, 'qqqq')), [])
+
+# The tables of a tiny data dump: one release by a single artist with
+# two discs, one of which has a guest artist, and a Various Artists
+# release with no release group type.
+DUMP = {
+    'artist': [
+        ['1', 'artist-gid', '1'],
+        ['2', 'guest-gid', '2'],
+        ['3', mb.VARIOUS_ARTISTS_ID, '3'],
+    ],
+    'artist_name': [
+        ['1', 'Some Artist'], ['2', 'Guest'], ['3', 'Various Artists'],
+    ],
+    'artist_credit': [['1', '1'], ['2', '2'], ['3', '3']],
+    'artist_credit_name': [
+        ['1', '0', '1'], ['2', '0', '2'], ['3', '0', '3'],
+    ],
+    'release_name': [['1', 'Tab\\tbed 1999'], ['2', 'Compilation']],
+    'release_group': [
+        ['1', 'rg-gid', '1', '1', '1'],
+        ['2', 'rg2-gid', '2', '3', '\\N'],
+    ],
+    'release_group_type': [['1', 'Album']],
+    'release': [
+        ['10', 'release-gid', '1', '1', '1', '1', '\\N', '\\N', '\\N', '\\N',
+         '2001', '5', '\\N', 'more', 'columns'],
+        ['11', 'va-gid', '2', '3', '2', '1', '\\N', '\\N', '\\N', '\\N',
+         '\\N', '\\N', '\\N'],
+    ],
+    'release_meta': [['10', '\\N', '\\N', 'B000ASIN']],
+    'medium': [['1', '100', '10', '2'], ['2', '101', '10', '1'],
+               ['3', '102', '11', '1']],
+    'recording': [['1', 'rec1'], ['2', 'rec2'], ['3', 'rec3'],
+                  ['4', 'rec4']],
+    'track_name': [['1', 'First'], ['2', 'Second'], ['3', 'Third'],
+                   ['4', 'Fourth']],
+    'track': [
+        ['1', '3', '100', '1', '3', '2', '\\N'],
+        ['2', '1', '101', '1', '1', '1', '180000'],
+        ['3', '2', '101', '2', '2', '1', '200000'],
+        ['4', '4', '102', '1', '4', '1', '1000'],
+    ],
+}
+
+class ImportDumpTest(unittest.TestCase):
+    def setUp(self):
+        self.base = os.path.join(_common.RSRC, 'mbdump')
+        os.mkdir(self.base)
+        for table, rows in DUMP.items():
+            f = open(os.path.join(self.base, table), 'w')
+            for row in rows:
+                f.write('\t'.join(row) + '\n')
+            f.close()
+        self.dbpath = os.path.join(self.base, 'mirror.db')
+        self.mirror = mirror.Mirror(self.dbpath)
+        self.mirror.import_dump(self.base)
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_release_metadata(self):
+        info = self.mirror.album_for_id('release-gid')
+        self.assertEqual(info['album'], 'Tab\tbed 1999')
+        self.assertEqual(info['artist'], 'Some Artist')
+        self.assertEqual(info['artist_id'], 'artist-gid')
+        self.assertEqual(info['asin'], 'B000ASIN')
+        self.assertEqual(info['albumtype'], 'album')
+        self.assertEqual(info['year'], 2001)
+        self.assertEqual(info['month'], 5)
+        self.assertFalse(info['va'])
+
+    def test_tracks_in_disc_order(self):
+        tracks = self.mirror.album_for_id('release-gid')['tracks']
+        self.assertEqual([t['id'] for t in tracks], ['rec1', 'rec2', 'rec3'])
+        self.assertEqual(tracks[0]['length'], 180.0)
+        self.assertFalse('length' in tracks[2])
+
+    def test_track_artist_only_when_different(self):
+        tracks = self.mirror.album_for_id('release-gid')['tracks']
+        self.assertFalse('artist' in tracks[0])
+        self.assertEqual(tracks[2]['artist'], 'Guest')
+        self.assertEqual(tracks[2]['artist_id'], 'guest-gid')
+
+    def test_various_artists_release(self):
+        info = self.mirror.album_for_id('va-gid')
+        self.assertTrue(info['va'])
+        self.assertEqual(info['albumtype'], '')
+
+    def test_search_after_import(self):
+        info = self.mirror.match_album('some artist', 'tabbed', 3).next()
+        self.assertEqual(info['album_id'], 'release-gid')
+
+    def test_reimport_replaces_releases(self):
+        self.mirror.import_dump(self.base)
+        ids = [info['album_id'] for info in
+               self.mirror.match_album('some artist', 'tabbed')]
+        self.assertEqual(sorted(ids), ['release-gid', 'va-gid'])
+
+def suite():
+    return unittest.TestLoader().loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
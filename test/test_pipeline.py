@@ -16,6 +16,9 @@
 """
 
 import unittest
+import time
+import logging
+import threading
 
 import _common
 from beets.util import pipeline
@@ -162,6 +165,517 @@ class MultiMessageTest(unittest.TestCase):
         self.pl.run_parallel()
         self.assertEqual(self.l, [0,0,1,-1,2,-2,3,-3,4,-4])
 
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.l = []
+        self.monitored = []
+        self.pl = pipeline.Pipeline(
+            (_produce(), _multi_work(), _consume(self.l)),
+            self.monitored.append,
+        )
+
+    def _check_stats(self):
+        self.assertEqual([s.name for s in self.pl.stats],
+                         ['_produce', '_multi_work', '_consume'])
+        self.assertEqual([s.messages for s in self.pl.stats], [5, 5, 10])
+        for stats in self.pl.stats:
+            self.assertTrue(stats.busy >= 0.0)
+
+    def test_run_sequential(self):
+        self.pl.run_sequential()
+        self._check_stats()
+
+    def test_run_parallel(self):
+        self.pl.run_parallel()
+        self._check_stats()
+
+    def test_monitor_called_at_end(self):
+        self.pl.run_parallel()
+        self.assertTrue(self.monitored)
+        self.assertTrue(self.monitored[-1] is self.pl.stats)
+
+    def test_parallel_stage_stats_summed(self):
+        pl = pipeline.Pipeline((_produce(), (_work(), _work()),
+                                _consume(self.l)))
+        pl.run_parallel()
+        self.assertEqual(pl.stats[1].messages, 5)
+
+    def test_stats_available_after_exception(self):
+        pl = pipeline.Pipeline((_produce(), _exc_work(), _consume(self.l)))
+        self.assertRaises(TestException, pl.run_sequential)
+        self.assertEqual(pl.stats[0].messages, 4)
+
+    def test_queue_depth_sampling(self):
+        stats = pipeline.StageStats('test')
+        self.assertEqual(stats.mean_depth(), None)
+        stats.sample_depth(2)
+        stats.sample_depth(4)
+        self.assertEqual(stats.mean_depth(), 3.0)
+        self.assertEqual(stats.depth_max, 4)
+
+class CloseTest(unittest.TestCase):
+    def _closing_consume(self, l):
+        try:
+            while True:
+                i = yield
+                l.append(i)
+        finally:
+            l.append('closed')
+
+    def test_run_sequential(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(), self._closing_consume(l)))
+        pl.run_sequential()
+        self.assertEqual(l, [0, 1, 2, 3, 4, 'closed'])
+
+    def test_run_parallel(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(), self._closing_consume(l)))
+        pl.run_parallel()
+        self.assertEqual(l, [0, 1, 2, 3, 4, 'closed'])
+
+    def test_closed_after_exception(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(), _exc_work(),
+                                self._closing_consume(l)))
+        self.assertRaises(TestException, pl.run_parallel)
+        self.assertEqual(l[-1], 'closed')
+
+class CountedQueueTest(unittest.TestCase):
+    def test_poison_wakes_all_consumers(self):
+        q = pipeline.CountedQueue()
+        q.acquire()
+        out = []
+        threads = [threading.Thread(target=lambda: out.append(q.get()))
+                   for i in range(3)]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        time.sleep(0.05) # Let the consumers block.
+        q.release()
+        for thread in threads:
+            thread.join(5.0)
+        self.assertEqual(out, [pipeline.POISON] * 3)
+
+class WeightedQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.q = pipeline.CountedQueue(10, 5, lambda msg: msg)
+
+    def test_weight_tracked(self):
+        self.q.put(2)
+        self.q.put(3)
+        self.assertEqual(self.q.weight, 5)
+        self.q.get()
+        self.assertEqual(self.q.weight, 3)
+
+    def test_full_by_weight(self):
+        self.q.put(3)
+        self.assertTrue(self.q._full(3))
+        self.assertFalse(self.q._full(2))
+
+    def test_heavy_message_accepted_when_empty(self):
+        self.q.put(10)
+        self.assertEqual(self.q.qsize(), 1)
+
+    def test_resize(self):
+        self.q.put(1)
+        self.q.resize(1)
+        self.assertTrue(self.q._full(0))
+
+    def test_unbounded_queue_not_resized(self):
+        q = pipeline.CountedQueue()
+        q.resize(1)
+        self.assertEqual(q.maxsize, 0)
+
+class AdaptiveQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.old_interval = pipeline.SAMPLE_INTERVAL
+        pipeline.SAMPLE_INTERVAL = 0.01
+
+    def tearDown(self):
+        pipeline.SAMPLE_INTERVAL = self.old_interval
+
+    def _slow_consume(self, l):
+        while True:
+            i = yield
+            time.sleep(0.005)
+            l.append(i)
+
+    def test_weighted_adaptive_run(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(20), _work(),
+                                self._slow_consume(l)))
+        pl.run_parallel(8, 3, lambda msg: 1, adaptive=True)
+        self.assertEqual(l, [i*2 for i in range(20)])
+
+    def test_adapt_sizes_to_downstream_rate(self):
+        pl = pipeline.Pipeline((_produce(), _work(), _consume([])))
+        queues = [pipeline.CountedQueue(100), pipeline.CountedQueue(100)]
+        pl.stats[1].messages = 1
+        pl.stats[2].messages = 100
+        pl._adapt(queues, 100, [0, 0, 0], 60.0)
+        self.assertEqual(queues[0].maxsize, pipeline.ADAPT_MIN)
+        self.assertEqual(queues[1].maxsize, 50)
+
+class OrderedStageTest(unittest.TestCase):
+    def _jitter_work(self):
+        # Later messages tend to finish first.
+        i = None
+        while True:
+            i = yield i
+            time.sleep(0.01 * ((10 - i) % 4))
+            if i == 3:
+                i = pipeline.BUBBLE
+            elif i == 5:
+                i = pipeline.multiple([5, -5])
+
+    def test_run_parallel_ordered(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(10),
+                                (self._jitter_work(), self._jitter_work(),
+                                 self._jitter_work()),
+                                _consume(l)))
+        pl.run_parallel(ordered=True, reorder_size=2)
+        self.assertEqual(l, [0, 1, 2, 4, 5, -5, 6, 7, 8, 9])
+
+    def test_ordered_exception(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(10), (_exc_work(), _exc_work()),
+                                _consume(l)))
+        self.assertRaises(TestException, pl.run_parallel, 1, ordered=True)
+
+    def test_reorderer_holds_early_results(self):
+        q = pipeline.CountedQueue()
+        reorderer = pipeline.Reorderer(q, 4)
+        reorderer.put(1, ['b'])
+        self.assertEqual(q.qsize(), 0)
+        reorderer.put(0, ['a'])
+        self.assertEqual([q.get(), q.get()], ['a', 'b'])
+
+class PooledTest(unittest.TestCase):
+    def _slow_work(self):
+        i = None
+        while True:
+            i = yield i
+            time.sleep(0.01 * ((10 - i) % 4))
+            i *= 2
+
+    def test_run_pooled(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(), pipeline.blocking(_work()),
+                                _consume(l)))
+        pl.run_pooled(2)
+        self.assertEqual(l, [0,2,4,6,8])
+
+    def test_many_coroutines_few_threads(self):
+        l = []
+        workers = [self._slow_work() for i in range(8)]
+        pl = pipeline.Pipeline((_produce(10), pipeline.blocking(workers),
+                                _consume(l)))
+        pl.run_pooled(3, ordered=True)
+        self.assertEqual(l, [i*2 for i in range(10)])
+        self.assertEqual(pl.stats[1].messages, 10)
+
+    def test_unordered_delivers_everything(self):
+        l = []
+        workers = [self._slow_work() for i in range(4)]
+        pl = pipeline.Pipeline((_produce(10), pipeline.blocking(workers),
+                                _consume(l)))
+        pl.run_pooled(4, queue_size=2)
+        self.assertEqual(sorted(l), [i*2 for i in range(10)])
+
+    def test_bubbles_and_multiple(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(), pipeline.blocking(_bub_work()),
+                                _multi_work(), _consume(l)))
+        pl.run_pooled(1)
+        self.assertEqual(l, [0,0,2,-2,4,-4,8,-8])
+
+    def test_exception(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(), pipeline.blocking(_exc_work()),
+                                _consume(l)))
+        self.assertRaises(TestException, pl.run_pooled, 2)
+        self.assertEqual(l, [0,2,4][:len(l)])
+
+    def test_blocking_mark_ignored_by_other_runners(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(), pipeline.blocking(_work()),
+                                _consume(l)))
+        pl.run_parallel()
+        self.assertEqual(l, [0,2,4,6,8])
+
+# A batched worker that records the size of each batch.
+def _batch_work(sizes):
+    out = None
+    while True:
+        batch = yield out
+        sizes.append(len(batch))
+        out = [i * 2 for i in batch]
+def _batch_consume(l):
+    while True:
+        batch = yield
+        l.extend(batch)
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.l = []
+        self.sizes = []
+        self.pl = pipeline.Pipeline((
+            _produce(10),
+            pipeline.batched(_batch_work(self.sizes), 4, 1.0),
+            _consume(self.l),
+        ))
+
+    def test_run_sequential(self):
+        self.pl.run_sequential()
+        self.assertEqual(self.l, [i*2 for i in range(10)])
+        self.assertEqual(self.sizes, [4, 4, 2])
+
+    def test_run_parallel(self):
+        self.pl.run_parallel()
+        self.assertEqual(self.l, [i*2 for i in range(10)])
+        self.assertEqual(sum(self.sizes), 10)
+        self.assertTrue(max(self.sizes) <= 4)
+        self.assertEqual(self.pl.stats[1].messages, 10)
+
+    def test_run_pooled(self):
+        self.pl.run_pooled(2)
+        self.assertEqual(self.l, [i*2 for i in range(10)])
+        self.assertTrue(max(self.sizes) <= 4)
+
+    def test_batched_last_stage(self):
+        pl = pipeline.Pipeline((
+            _produce(10), _work(),
+            pipeline.batched(_batch_consume(self.l), 3),
+        ))
+        pl.run_parallel()
+        self.assertEqual(self.l, [i*2 for i in range(10)])
+        self.assertEqual(pl.stats[2].messages, 10)
+
+    def test_zero_linger_sequential(self):
+        pl = pipeline.Pipeline((
+            _produce(5), pipeline.batched(_batch_work(self.sizes), 4),
+            _consume(self.l),
+        ))
+        pl.run_sequential()
+        self.assertEqual(self.sizes, [1, 1, 1, 1, 1])
+
+    def test_ordered_batches(self):
+        stage = pipeline.batched([_batch_work(self.sizes) for i in range(3)],
+                                 2)
+        pl = pipeline.Pipeline((_produce(20), stage, _consume(self.l)))
+        pl.run_parallel(ordered=True)
+        self.assertEqual(self.l, [i*2 for i in range(20)])
+
+    def test_ordered_batches_with_slow_producer(self):
+        # Messages trickle in, so several threads collect batches at
+        # the same time.
+        def slow_produce():
+            for i in range(20):
+                time.sleep(0.003)
+                yield i
+        stage = pipeline.batched([_batch_work(self.sizes) for i in range(3)],
+                                 4, 0.05)
+        pl = pipeline.Pipeline((slow_produce(), stage, _consume(self.l)))
+        thread = threading.Thread(target=pl.run_parallel,
+                                  args=(8,), kwargs={'ordered': True})
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(10.0)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(self.l, [i*2 for i in range(20)])
+
+    def test_first_stage_cannot_be_batched(self):
+        self.assertRaises(ValueError, pipeline.Pipeline,
+                          (pipeline.batched(_produce(), 2), _consume([])))
+
+class IdleTest(unittest.TestCase):
+    def _slow_produce(self, num, bubbles):
+        # Bubbles stand for the first stage waiting for input.
+        for i in range(num):
+            yield i
+            for j in range(bubbles):
+                time.sleep(0.01)
+                yield pipeline.BUBBLE
+
+    def _idle_consume(self, l, idles):
+        while True:
+            i = yield
+            if i is pipeline.IDLE:
+                idles.append(len(l))
+            else:
+                l.append(i)
+
+    def _idle_run(self, method, *args):
+        l, idles = [], []
+        pl = pipeline.Pipeline((
+            self._slow_produce(2, 10), _work(),
+            pipeline.idle(self._idle_consume(l, idles), 0.03),
+        ))
+        getattr(pl, method)(*args)
+        self.assertEqual(l, [0, 2])
+        self.assertTrue(idles)
+        return idles
+
+    def test_idle_sequential(self):
+        idles = self._idle_run('run_sequential')
+        # Woken between the messages as well as after them.
+        self.assertTrue(1 in idles)
+
+    def test_idle_parallel(self):
+        self._idle_run('run_parallel')
+
+    def test_idle_pooled(self):
+        old_interval = pipeline.SAMPLE_INTERVAL
+        pipeline.SAMPLE_INTERVAL = 0.01
+        try:
+            self._idle_run('run_pooled', 2)
+        finally:
+            pipeline.SAMPLE_INTERVAL = old_interval
+
+    def test_busy_stage_not_woken(self):
+        l, idles = [], []
+        pl = pipeline.Pipeline((
+            _produce(5), _work(),
+            pipeline.idle(self._idle_consume(l, idles), 10.0),
+        ))
+        pl.run_parallel()
+        self.assertEqual(l, [0, 2, 4, 6, 8])
+        self.assertEqual(idles, [])
+
+    def test_first_stage_cannot_be_idle(self):
+        self.assertRaises(ValueError, pipeline.Pipeline,
+                          (pipeline.idle(_produce(), 1.0), _consume([])))
+
+class CancelTest(unittest.TestCase):
+    def setUp(self):
+        self.old_interval = pipeline.WATCHDOG_INTERVAL
+        pipeline.WATCHDOG_INTERVAL = 0.01
+
+    def tearDown(self):
+        pipeline.WATCHDOG_INTERVAL = self.old_interval
+
+    def _cancelling_consume(self, l, pls):
+        # The pipeline is passed in a list since it does not exist yet.
+        while True:
+            i = yield
+            l.append(i)
+            if len(l) == 3:
+                pls[0].cancel()
+
+    def _sleepy_work(self, delay):
+        i = None
+        while True:
+            i = yield i
+            time.sleep(delay)
+
+    def _cancel_run(self, method, *args):
+        l, pls = [], []
+        pl = pipeline.Pipeline((_produce(1000), _work(),
+                                self._cancelling_consume(l, pls)))
+        pls.append(pl)
+        getattr(pl, method)(*args)
+        self.assertTrue(3 <= len(l) < 1000)
+        self.assertEqual(l, [i*2 for i in range(len(l))])
+
+    def test_cancel_sequential(self):
+        self._cancel_run('run_sequential')
+
+    def test_cancel_parallel(self):
+        self._cancel_run('run_parallel', 2)
+
+    def test_cancel_pooled(self):
+        self._cancel_run('run_pooled', 2)
+
+    def test_cancel_ordered(self):
+        l, pls = [], []
+        pl = pipeline.Pipeline((_produce(1000), (_work(), _work()),
+                                self._cancelling_consume(l, pls)))
+        pls.append(pl)
+        pl.run_parallel(2, ordered=True)
+        self.assertEqual(l, [i*2 for i in range(len(l))])
+
+    def _cancelling_work(self, worked, pls):
+        # Cancels the pipeline after handling six messages.
+        i = None
+        while True:
+            i = yield i
+            worked.append(i)
+            if len(worked) == 6:
+                pls[0].cancel()
+            i *= 2
+
+    def _drain_run(self, last, method, *args):
+        # Every message handled by the middle stage reaches the last
+        # stage, even after the cancellation.
+        worked, l, pls = [], [], []
+        pl = pipeline.Pipeline((_produce(1000),
+                                self._cancelling_work(worked, pls),
+                                last(l)))
+        pls.append(pl)
+        getattr(pl, method)(*args)
+        self.assertTrue(6 <= len(worked) < 1000)
+        self.assertEqual(l, [i*2 for i in worked])
+
+    def test_last_stage_drains_sequential(self):
+        self._drain_run(
+            lambda l: pipeline.batched(_batch_consume(l), 4, 10.0),
+            'run_sequential'
+        )
+
+    def test_last_stage_drains_parallel(self):
+        self._drain_run(_consume, 'run_parallel', 100)
+
+    def test_last_stage_drains_pooled(self):
+        self._drain_run(_consume, 'run_pooled', 2)
+
+    def test_cancel_before_run(self):
+        l = []
+        pl = pipeline.Pipeline((_produce(), _work(), _consume(l)))
+        pl.cancel()
+        pl.run_parallel()
+        self.assertEqual(l, [])
+
+    def test_time_limit_exceeded(self):
+        pl = pipeline.Pipeline((
+            _produce(),
+            pipeline.time_limit(self._sleepy_work(0.5), 0.05),
+            _consume([]),
+        ))
+        self.assertRaises(pipeline.StageTimeout, pl.run_parallel)
+
+    def test_time_limit_not_exceeded(self):
+        l = []
+        pl = pipeline.Pipeline((
+            _produce(),
+            pipeline.time_limit(_work(), 10.0),
+            _consume(l),
+        ))
+        pl.run_parallel()
+        self.assertEqual(l, [0,2,4,6,8])
+
+    def test_stall_reported(self):
+        pl = pipeline.Pipeline((_produce(2), self._sleepy_work(0.1),
+                                _consume([])), stall_time=0.02)
+        messages = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+        handler = Handler()
+        old_level = pipeline.log.level
+        pipeline.log.setLevel(logging.WARNING)
+        pipeline.log.propagate = False
+        pipeline.log.addHandler(handler)
+        try:
+            pl.run_sequential()
+        finally:
+            pipeline.log.removeHandler(handler)
+            pipeline.log.setLevel(old_level)
+            pipeline.log.propagate = True
+        self.assertTrue(messages)
+        self.assertTrue('_sleepy_work' in messages[0])
+
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
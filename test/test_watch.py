@@ -0,0 +1,84 @@
+# This file is part of beets.
+# Copyright 2011, Adrian Sampson.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+"""Tests for the directory watcher used by the importer's watch mode.
+"""
+import unittest
+import os
+import shutil
+
+import _common
+from beets.util import watch
+
+class WatcherTestMixin(object):
+    def setUp(self):
+        self.base = os.path.abspath(os.path.join(_common.RSRC, 'watchdir'))
+        os.mkdir(self.base)
+        self.album = os.path.join(self.base, 'album')
+        os.mkdir(self.album)
+        self._touch(os.path.join(self.album, 'one.mp3'))
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.base)
+
+    def _touch(self, path, data=''):
+        f = open(path, 'a')
+        f.write(data)
+        f.close()
+
+    def test_existing_directory_settles(self):
+        self.assertEqual(self.watcher.poll(), [self.album])
+
+    def test_settled_directory_not_reported_again(self):
+        self.watcher.poll()
+        self.assertEqual(self.watcher.poll(), [])
+
+    def test_new_file_makes_directory_pending(self):
+        self.watcher.poll()
+        self._touch(os.path.join(self.album, 'two.mp3'))
+        self.assertEqual(self.watcher.poll(), [self.album])
+
+    def test_changing_seen_file_ignored(self):
+        self.watcher.poll()
+        self._touch(os.path.join(self.album, 'one.mp3'), 'new tags')
+        self.assertEqual(self.watcher.poll(), [])
+
+    def test_new_subdirectory_detected(self):
+        self.watcher.poll()
+        subdir = os.path.join(self.base, 'other')
+        os.mkdir(subdir)
+        self._touch(os.path.join(subdir, 'three.mp3'))
+        self.assertEqual(self.watcher.poll(), [subdir])
+
+    def test_unsettled_directory_not_reported(self):
+        self.watcher.settle_time = 1000.0
+        self.assertEqual(self.watcher.poll(), [])
+
+class PollingWatcherTest(WatcherTestMixin, unittest.TestCase):
+    def setUp(self):
+        super(PollingWatcherTest, self).setUp()
+        self.watcher = watch.PollingWatcher([self.base], 0.0, 0.0)
+
+if watch.pyinotify:
+    class InotifyWatcherTest(WatcherTestMixin, unittest.TestCase):
+        def setUp(self):
+            super(InotifyWatcherTest, self).setUp()
+            self.watcher = watch.InotifyWatcher([self.base], 0.0, 0.05)
+
+def suite():
+    return unittest.TestLoader().loadTestsFromName(__name__)
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')